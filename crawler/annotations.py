@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Annotations of the web demo, <target_dir>/annotations.sqlite, an SQLite database in WAL mode.
+
+Request threads only queue the annotations; a writer thread inserts them in batches, so several
+annotators do not wait for each other's disk writes. The corpus index attaches the database to
+sample segments nobody has annotated yet, see CorpusIndex.random_sample.
+
+Exporting the accepted (or rejected) segment keys, one per line:
+    python -m crawler.annotations <dir_for_resulting_samples> --status OK
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+from crawler.db import connect
+
+ANNOTATIONS_FILENAME = "annotations.sqlite"
+
+
+class STATUS:
+    OK = "OK"
+    NOT_OK = "NOT_OK"
+
+
+class AnnotationStore:
+    def __init__(self, filename, batch_size=100, flush_interval=1.0):
+        self.filename = filename
+        self.conn = connect(filename)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS annotations (id INTEGER PRIMARY KEY, key TEXT, "
+                          "annotator TEXT, status TEXT, txt TEXT, created REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS annotations_key ON annotations (key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS annotations_annotator ON annotations (annotator, key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS annotations_status ON annotations (status, key)")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # the connection is shared by the writer thread and the request threads exporting
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self._write_behind, daemon=True)
+        self.writer.start()
+
+    def add(self, key, annotator, status, txt=None):
+        self.pending.put((key, annotator, status, txt, time.time()))
+
+    def _write_behind(self):
+        while True:
+            rows = [self.pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while rows[-1] is not None and len(rows) < self.batch_size:
+                try:
+                    rows.append(self.pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            stop = rows[-1] is None
+            batch = rows[:-1] if stop else rows
+            if batch:
+                with self.lock, self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.executemany("INSERT INTO annotations (key, annotator, status, txt, created) "
+                                          "VALUES (?, ?, ?, ?, ?)", batch)
+            for _ in rows:
+                self.pending.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """
+        Waits until the queued annotations are written
+
+        """
+        self.pending.join()
+
+    def keys(self, status=None, annotator=None):
+        """
+        Keys of the annotated segments, with the latest annotation of a segment by the given
+        annotator (or by anyone) having the given status
+
+        """
+        query = ("SELECT key, status FROM annotations WHERE id IN (SELECT MAX(id) FROM annotations {}GROUP BY key) "
+                 "ORDER BY key").format("WHERE annotator = ? " if annotator is not None else "")
+        with self.lock:
+            rows = self.conn.execute(query, (annotator,) if annotator is not None else ()).fetchall()
+        return [key for key, s in rows if status is None or s == status]
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM annotations GROUP BY status").fetchall())
+
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_dir", type=str)
+    parser.add_argument("--status", choices=[STATUS.OK, STATUS.NOT_OK], default=STATUS.OK)
+    parser.add_argument("--annotator", type=str, default=None, help="Only the annotations of this annotator")
+
+    opt = parser.parse_args()
+    store = AnnotationStore(os.path.join(opt.target_dir, ANNOTATIONS_FILENAME))
+    for key in store.keys(opt.status, opt.annotator):
+        print(key)
+    store.close()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Speech recognition of extracted segments, used to cross check the closed captions.
+
+A backend transcribes 16 bit PCM samples. AsrClient sends the segments of a video to the backend
+concurrently from a bounded thread pool, retries failed requests and stores the transcripts in
+an optional TranscriptCache keyed by segment hash, so that a re-run never queries the backend
+again for the same segment.
+
+A running request cannot be cancelled: a backend bounds every request with its own timeout, and
+AsrClient does not retry a request once the segment timed out.
+"""
+import time
+import random
+import threading
+import collections
+import concurrent.futures
+import termcolor
+from crawler.db import connect
+
+
+class RecognizerBackend:
+    name = None
+
+    def transcribe(self, samples, sample_rate):
+        """
+        Returns the transcript of the int16 samples, None if no speech was recognized. Raises
+        on errors worth retrying (network, quota)
+
+        """
+        raise NotImplementedError
+
+
+class GoogleWebRecognizer(RecognizerBackend):
+    name = "google-web"
+
+    def __init__(self, language="en-US", key=None, timeout=10.0):
+        """
+        :param timeout: seconds to wait for the connection and for every read of a single request,
+                        the request raises socket.timeout afterwards
+        """
+        self.language = language
+        self.key = key
+        self.timeout = timeout
+
+    def transcribe(self, samples, sample_rate):
+        import speech_recognition as sr
+        recognizer = sr.Recognizer()
+        # passed as the urlopen timeout of the request
+        recognizer.operation_timeout = self.timeout
+        audio = sr.AudioData(samples.tobytes(), sample_rate, 2)
+        try:
+            return recognizer.recognize_google(audio, key=self.key, language=self.language)
+        except sr.UnknownValueError:
+            return None
+
+
+class MockRecognizer(RecognizerBackend):
+    """
+    Local stand-in for a recognition service: answers transcript (a string or a function of
+    samples and sample rate) after latency seconds and fails with probability failure_rate
+
+    """
+    name = "mock"
+
+    def __init__(self, transcript="", latency=0.0, failure_rate=0.0, seed=None):
+        self.transcript = transcript
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.num_requests = 0
+
+    def transcribe(self, samples, sample_rate):
+        with self.lock:
+            self.num_requests += 1
+            failed = self.random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise IOError("mock recognizer failure")
+        return self.transcript(samples, sample_rate) if callable(self.transcript) else self.transcript
+
+
+class TranscriptCache:
+    """
+    Transcripts by segment hash and backend. Segments without recognized speech are stored with
+    a NULL transcript, failed requests are not stored
+
+    """
+    def __init__(self, filename):
+        self.conn = connect(filename)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS transcripts (key TEXT, backend TEXT, transcript TEXT, "
+                          "PRIMARY KEY (key, backend))")
+
+    def get_many(self, keys, backend):
+        """
+        Returns {key: transcript} of the cached keys
+
+        """
+        res = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            res.update(self.conn.execute("SELECT key, transcript FROM transcripts WHERE backend = ? AND key IN ({})".format(
+                ", ".join("?" * len(chunk))), [backend] + chunk).fetchall())
+        return res
+
+    def put_many(self, transcripts, backend):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?)",
+                                  [(key, backend, transcript) for key, transcript in transcripts.items()])
+
+    def close(self):
+        self.conn.close()
+
+
+class AsrClient:
+    def __init__(self, backend=None, max_workers=8, timeout=30.0, retries=2, backoff=1.0, cache=None):
+        """
+        :param backend: RecognizerBackend, GoogleWebRecognizer() if None
+        :param timeout: seconds to wait for a segment including its retries, the segment counts as
+                        failed afterwards
+        :param retries: additional attempts after a failed request, backoff * 2^attempt seconds apart
+        :param cache: TranscriptCache or its filename
+
+        The number of requests, retries, timeouts, failures and cached segments are counted in stats
+        """
+        self.backend = backend or GoogleWebRecognizer()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = TranscriptCache(cache) if isinstance(cache, str) else cache
+        self._executor = None
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _transcribe(self, samples, sample_rate, deadline):
+        for attempt in range(self.retries + 1):
+            self._count("requests")
+            try:
+                return self.backend.transcribe(samples, sample_rate)
+            except Exception as e:
+                delay = self.backoff * 2 ** attempt
+                if attempt == self.retries or time.monotonic() + delay >= deadline:
+                    raise
+                self._count("retries")
+                termcolor.cprint("ASR request failed ({}), retrying".format(e), color="yellow")
+                time.sleep(delay)
+
+    def transcribe_many(self, segments):
+        """
+        :param segments: (key, int16 samples, sample rate) tuples
+        :return: {key: transcript}, None for the segments without recognized speech or failed
+        """
+        segments = list(segments)
+        backend_name = self.backend.name or type(self.backend).__name__
+        res = self.cache.get_many([key for key, _, _ in segments], backend_name) if self.cache is not None else {}
+        self._count("cached", len(res))
+        deadline = time.monotonic() + self.timeout
+        futures = {self.executor.submit(self._transcribe, samples, sample_rate, deadline): key
+                   for key, samples, sample_rate in segments if key not in res}
+        if not futures:
+            return res
+
+        transcripts = {}
+        done, not_done = concurrent.futures.wait(futures, timeout=self.timeout)
+        for future in not_done:
+            # only drops the requests still queued, the running ones end by the backend timeout
+            future.cancel()
+            self._count("timeouts")
+            termcolor.cprint("ASR request timed out for {}".format(futures[future]), color="red")
+            res[futures[future]] = None
+        for future in done:
+            try:
+                transcripts[futures[future]] = future.result()
+            except Exception as e:
+                self._count("failures")
+                termcolor.cprint("ASR request failed for {}: {}".format(futures[future], e), color="red")
+                res[futures[future]] = None
+        if self.cache is not None:
+            self.cache.put_many(transcripts, backend_name)
+        res.update(transcripts)
+        return res
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,172 @@
+"""
+Statistics of 16 bit PCM audio shared by the manifest dump and the quality filters.
+"""
+import wave
+import numpy as np
+
+# frame RMS relative to full scale below which a frame counts as silent, about -40 dBFS
+SILENCE_THRESHOLD = 0.01
+FRAME_SEC = 0.01
+# samples with an absolute value above this fraction of full scale count as clipped
+CLIP_LEVEL = 0.99
+
+
+def read_wav(wav_file):
+    """
+    Returns (sample_rate, int16 samples) of a 16 bit mono wav file
+
+    """
+    with wave.open(wav_file) as f:
+        if f.getsampwidth() != 2 or f.getnchannels() != 1:
+            raise ValueError("{} is not 16 bit mono".format(wav_file))
+        return f.getframerate(), np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+
+
+def frame_rms(samples, sample_rate, frame_sec=FRAME_SEC):
+    """
+    RMS of consecutive frame_sec frames relative to full scale, the incomplete last frame is dropped
+
+    """
+    frame = max(int(sample_rate * frame_sec), 1)
+    num_frames = len(samples) // frame
+    frames = samples[:num_frames * frame].reshape(num_frames, frame).astype(np.float32) / 32768.0
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def audio_stats(samples, sample_rate, silence_threshold=SILENCE_THRESHOLD):
+    """
+    Duration, RMS, peak (both relative to full scale) and the ratio of silent frames
+
+    """
+    x = samples.astype(np.float32) / 32768.0
+    frames = frame_rms(samples, sample_rate)
+    return {"sample_rate": int(sample_rate),
+            "num_samples": int(len(x)),
+            "duration": len(x) / sample_rate,
+            "rms": float(np.sqrt(np.mean(x * x))) if len(x) else 0.0,
+            "peak": float(np.max(np.abs(x))) if len(x) else 0.0,
+            "silence_ratio": float(np.mean(frames < silence_threshold)) if len(frames) else 1.0}
+
+
+def file_stats(wav_file):
+    sample_rate, samples = read_wav(wav_file)
+    return audio_stats(samples, sample_rate)
+
+
+def frame_energy(samples, sample_rate, frame_sec=FRAME_SEC, clip_level=CLIP_LEVEL, chunk_frames=1 << 16):
+    """
+    Mean square (relative to full scale) and number of clipped samples of consecutive frame_sec
+    frames. Computed in chunks, so the audio of a whole video is never converted to float at once
+
+    """
+    frame = max(int(sample_rate * frame_sec), 1)
+    num_frames = len(samples) // frame
+    energy = np.empty(num_frames, dtype=np.float32)
+    clipped = np.empty(num_frames, dtype=np.int32)
+    for first in range(0, num_frames, chunk_frames):
+        last = min(first + chunk_frames, num_frames)
+        x = samples[first * frame:last * frame].reshape(last - first, frame).astype(np.float32) / 32768.0
+        energy[first:last] = np.mean(x * x, axis=1)
+        clipped[first:last] = np.count_nonzero(np.abs(x) >= clip_level, axis=1)
+    return energy, clipped
+
+
+def segment_quality(energy, clipped, start_sec, end_sec, frame_sec=FRAME_SEC, samples_per_frame=160,
+                    silence_threshold=SILENCE_THRESHOLD):
+    """
+    Statistics of all the segments (start_sec, end_sec arrays) of a recording from its frame_energy,
+    taken from cumulative sums instead of a pass over the audio of every segment:
+
+    rms, silence_ratio, clipping_ratio, leading_silence and trailing_silence in seconds, and
+    snr_db, the energy of the non silent frames relative to the silent ones. A segment without
+    silent frames is compared with the silence threshold, so its snr_db is a lower bound
+    """
+    num_frames = len(energy)
+    first = np.clip(np.floor(np.asarray(start_sec) / frame_sec).astype(np.int64), 0, num_frames)
+    last = np.clip(np.ceil(np.asarray(end_sec) / frame_sec).astype(np.int64), first, num_frames)
+    n = last - first
+    voiced = energy >= silence_threshold ** 2
+
+    def window_sum(values):
+        cumsum = np.concatenate([[0], np.cumsum(values, dtype=np.float64)])
+        return cumsum[last] - cumsum[first]
+
+    total_energy = window_sum(energy)
+    voiced_energy = window_sum(np.where(voiced, energy, 0))
+    num_voiced = window_sum(voiced)
+    num_silent = n - num_voiced
+    frames = np.maximum(n, 1)
+
+    # first and last non silent frame of every segment
+    voiced_idx = np.flatnonzero(voiced)
+    if len(voiced_idx):
+        first_voiced = voiced_idx[np.minimum(np.searchsorted(voiced_idx, first), len(voiced_idx) - 1)]
+        last_voiced = voiced_idx[np.maximum(np.searchsorted(voiced_idx, last) - 1, 0)]
+    else:
+        first_voiced, last_voiced = first, last - 1
+    has_voice = num_voiced > 0
+
+    speech = voiced_energy / np.maximum(num_voiced, 1)
+    noise = np.where(num_silent > 0, (total_energy - voiced_energy) / np.maximum(num_silent, 1),
+                     silence_threshold ** 2)
+    return {"rms": np.sqrt(total_energy / frames),
+            "silence_ratio": np.where(n > 0, num_silent / frames, 1.0),
+            "clipping_ratio": window_sum(clipped) / (frames * samples_per_frame),
+            "snr_db": np.where(has_voice, 10 * np.log10(np.maximum(speech, 1e-12) / np.maximum(noise, 1e-12)), 0.0),
+            "leading_silence": np.where(has_voice, first_voiced - first, n) * frame_sec,
+            "trailing_silence": np.where(has_voice, last - 1 - last_voiced, n) * frame_sec}
+
+
+def snap_to_silence(energy, start_sec, end_sec, tolerance_sec=0.3, frame_sec=FRAME_SEC,
+                    silence_threshold=SILENCE_THRESHOLD, min_silence_sec=0.05):
+    """
+    Energy VAD boundary refinement of all the segments of a recording from its frame_energy. Every
+    boundary is moved to the nearest frame of a pause (at least min_silence_sec of silent frames)
+    within tolerance_sec, preferring the earlier frame for a start and the later one for an end so
+    that words are not cut. Returns the new start and end, whether each boundary was at or moved
+    to a pause, and the ratio of speech frames between the new boundaries
+
+    """
+    num_frames = len(energy)
+    voiced = energy >= silence_threshold ** 2
+    # pauses shorter than min_silence_sec (between words, plosives) count as speech
+    half = max(int(round(min_silence_sec / frame_sec / 2)), 0)
+    if half:
+        padded = np.concatenate([np.zeros(half, dtype=bool), voiced, np.zeros(half, dtype=bool)])
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1)
+        voiced = windows.any(axis=1)
+    silent_idx = np.flatnonzero(~voiced)
+    tolerance = int(round(tolerance_sec / frame_sec))
+
+    def snap(frames, prefer_earlier):
+        if len(silent_idx) == 0:
+            return frames, np.zeros(len(frames), dtype=bool)
+        pos = np.searchsorted(silent_idx, frames)
+        before = silent_idx[np.maximum(pos - 1, 0)]
+        after = silent_idx[np.minimum(pos, len(silent_idx) - 1)]
+        # a silent frame itself is found as "after" at distance 0
+        dist_before = np.where(pos > 0, frames - before, np.iinfo(np.int64).max)
+        dist_after = np.where(after >= frames, after - frames, np.iinfo(np.int64).max)
+        use_before = dist_before <= dist_after if prefer_earlier else dist_before < dist_after
+        use_before &= dist_after > 0
+        nearest = np.where(use_before, before, after)
+        snapped = np.minimum(dist_before, dist_after) <= tolerance
+        return np.where(snapped, nearest, frames), snapped
+
+    first = np.clip(np.round(np.asarray(start_sec) / frame_sec).astype(np.int64), 0, num_frames)
+    last = np.clip(np.round(np.asarray(end_sec) / frame_sec).astype(np.int64), 0, num_frames)
+    new_first, start_snapped = snap(first, prefer_earlier=True)
+    new_last, end_snapped = snap(last, prefer_earlier=False)
+    # a segment is never turned inside out, its boundaries are kept instead
+    inverted = new_last <= new_first
+    new_first = np.where(inverted, first, new_first)
+    new_last = np.where(inverted, last, new_last)
+
+    cumsum = np.concatenate([[0], np.cumsum(voiced, dtype=np.int64)])
+    lo, hi = np.minimum(new_first, num_frames), np.minimum(new_last, num_frames)
+    speech_ratio = (cumsum[hi] - cumsum[lo]) / np.maximum(hi - lo, 1)
+    return {"start": np.where(start_snapped & ~inverted, new_first * frame_sec, start_sec),
+            "end": np.where(end_snapped & ~inverted, new_last * frame_sec, end_sec),
+            "start_snapped": start_snapped & ~inverted,
+            "end_snapped": end_snapped & ~inverted,
+            "speech_ratio": speech_ratio}
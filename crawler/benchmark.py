@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of subtitle parsing, the filters, the whole process.py pipeline and audio extraction
+on synthetic fixtures: generated .vtt files (plain captions, overlapping captions and rolling
+auto-captions) and a sine tone generated by ffmpeg's lavfi source.
+
+    python -m crawler.benchmark --output bench.json
+    python -m crawler.benchmark --output bench_new.json --compare bench.json
+
+Results are saved as JSON with the commit they were measured on. With --compare every
+throughput is also printed relative to an earlier run.
+
+The startup benchmark imports the worker entry points in fresh interpreters. It fails (exit code 1)
+when an import takes longer than --startup-budget-ms or loads one of the optional dependencies
+(ASR, Levenshtein, progress bars), which are imported by the filters using them:
+
+    python -m crawler.benchmark --startup-only
+"""
+import os
+import io
+import sys
+import copy
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import termcolor
+from crawler.youtube_helpers import load_all_subtitles, iter_vtt_cues
+from crawler.captions import CaptionBatch
+from crawler.utils import extract_audio_part_segment, format_ffmpeg_ts, DecodedAudio
+from crawler.process import pipeline, streaming_pipeline
+
+WORDS = ("the quick brown fox jumps over a lazy dog while we are talking about 12 things "
+         "it's really well-known that 100% of people don't know").split()
+FIXTURES = {
+    # name: (number of cues, probability of a cue overlapping the previous one, rolling auto-captions)
+    "plain_1k": (1000, 0.0, False),
+    "overlapping_1k": (1000, 0.3, False),
+    "rolling_1k": (1000, 0.0, True),
+    "plain_10k": (10000, 0.05, False),
+}
+# imported by every process.py run and worker process
+STARTUP_MODULES = ("crawler.process", "crawler.worker")
+# optional dependencies which must not be loaded by a pipeline without the ASR check
+LAZY_MODULES = ("tqdm", "Levenshtein", "speech_recognition", "path", "webvtt", "crawler.asr")
+# numpy is required by the caption columns, its import is measured separately from the budget
+STARTUP_CODE = """
+import sys, time, json
+started = time.perf_counter()
+import numpy
+imported = time.perf_counter()
+import {module}
+finished = time.perf_counter()
+json.dump({{"seconds": finished - imported, "numpy_seconds": imported - started,
+           "lazy_loaded": [m for m in {lazy!r} if m in sys.modules]}}, sys.stdout)
+"""
+
+
+def make_vtt(filename, num_cues, overlap_ratio=0.0, rolling=False, seed=0):
+    """
+    Writes a synthetic subtitle file. Rolling auto-captions repeat the previous line above the
+    new one with word timestamps, like YouTube's automatic captions
+
+    """
+    rnd = random.Random(seed)
+    lines = ["WEBVTT", "Kind: captions", "Language: en", ""]
+    t = 0.0
+    previous = ""
+    for _ in range(num_cues):
+        duration = rnd.choice([0.8, 1.5, 2.0, 3.0, 4.5, 6.0])
+        start = t - duration / 2 if rnd.random() < overlap_ratio and t > duration else t
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 12)))
+        lines.append("{} --> {}".format(format_ffmpeg_ts(start), format_ffmpeg_ts(start + duration)))
+        if rolling:
+            words = text.split()
+            step = duration / len(words)
+            timed = words[0] + "".join("<{}><c> {}</c>".format(format_ffmpeg_ts(start + (i + 1) * step), w)
+                                       for i, w in enumerate(words[1:]))
+            lines.extend([previous, timed] if previous else [timed])
+        else:
+            lines.append(text)
+        lines.append("")
+        previous = text
+        t = max(t, start + duration) + rnd.choice([0.0, 0.1, 0.3, 0.5, 1.0, 2.0])
+    with io.open(filename, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return t
+
+
+def make_audio(filename, duration, sample_rate=16000):
+    subprocess.run(["ffmpeg", "-nostdin", "-y", "-f", "lavfi", "-i",
+                    "sine=frequency=440:sample_rate={}:duration={:.3f}".format(sample_rate, duration),
+                    "-ac", "1", "-c:a", "aac", filename],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+def measure(func, repeat=3):
+    """
+    Best wall time of repeat calls of func, and its last result
+
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        res = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+def _result(seconds, num_captions=None, audio_sec=None):
+    res = {"seconds": round(seconds, 6)}
+    if num_captions is not None:
+        res["captions"] = num_captions
+        res["captions_per_sec"] = round(num_captions / seconds, 1) if seconds > 0 else None
+    if audio_sec is not None:
+        res["audio_sec"] = round(audio_sec, 3)
+        # hours of audio produced per hour of wall time
+        res["audio_hours_per_hour"] = round(audio_sec / seconds, 1) if seconds > 0 else None
+    return res
+
+
+def bench_subtitles(subtitle_file, repeat=3):
+    results = {}
+    seconds, subs = measure(lambda: load_all_subtitles(subtitle_file), repeat)
+    num_captions = len(subs)
+    results["load_all_subtitles"] = _result(seconds, num_captions)
+    seconds, _ = measure(lambda: CaptionBatch.from_file(subtitle_file), repeat)
+    results["CaptionBatch.from_file"] = _result(seconds, num_captions)
+
+    # every filter is timed on the captions it receives in the process.py pipeline
+    data = {"subtitles": CaptionBatch.from_file(subtitle_file), "video_file": ""}
+    for i, component in enumerate(pipeline.lst_components):
+        num_in = len(data["subtitles"])
+        seconds, res = measure(lambda: component(copy.deepcopy(data)), repeat)
+        results["{}.{}".format(i, type(component).__name__)] = _result(seconds, num_in)
+        data = res
+
+    seconds, _ = measure(lambda: pipeline({"subtitles": CaptionBatch.from_file(subtitle_file), "video_file": ""}),
+                         repeat)
+    results["pipeline"] = _result(seconds, num_captions)
+
+    def run_streaming():
+        with io.open(subtitle_file, encoding="utf-8-sig") as f:
+            return streaming_pipeline({"subtitles": iter_vtt_cues(f), "sub_file": subtitle_file, "video_file": ""})
+    seconds, _ = measure(run_streaming, repeat)
+    results["streaming_pipeline"] = _result(seconds, num_captions)
+    return results
+
+
+def bench_extraction(subtitle_file, audio_file, max_segments=20, repeat=1):
+    """
+    Extraction of the segments kept by the pipeline: one ffmpeg run per segment against decoding
+    the audio once and slicing the segments
+
+    """
+    timings = pipeline({"subtitles": CaptionBatch.from_file(subtitle_file),
+                        "video_file": audio_file})["subtitles"].to_dicts()[:max_segments]
+    audio_sec = sum(t["ts_end"] - t["ts_start"] for t in timings)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        def per_segment():
+            for i, t in enumerate(timings):
+                extract_audio_part_segment(audio_file, t["ts_start"], t["ts_end"], os.path.join(tmp_dir, "{}.wav".format(i)))
+
+        def decoded():
+            audio = DecodedAudio(audio_file)
+            for i, t in enumerate(timings):
+                audio.write_segment(t["ts_start"], t["ts_end"], os.path.join(tmp_dir, "{}.wav".format(i)))
+
+        results = {}
+        seconds, _ = measure(per_segment, repeat)
+        results["extract_audio_part_segment"] = _result(seconds, len(timings), audio_sec)
+        seconds, _ = measure(decoded, repeat)
+        results["DecodedAudio.write_segment"] = _result(seconds, len(timings), audio_sec)
+        return results
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_startup(modules=STARTUP_MODULES, repeat=5):
+    """
+    Best import time of every module in a fresh interpreter, on top of numpy, and the optional
+    dependencies it loaded
+
+    """
+    results = {}
+    for module in modules:
+        best = None
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, "-c", STARTUP_CODE.format(module=module, lazy=LAZY_MODULES)],
+                                 stdout=subprocess.PIPE, check=True).stdout
+            res = json.loads(out.decode())
+            best = res if best is None or res["seconds"] < best["seconds"] else best
+        results[module] = {"seconds": round(best["seconds"], 6), "numpy_seconds": round(best["numpy_seconds"], 6),
+                           "lazy_loaded": best["lazy_loaded"]}
+    return results
+
+
+def check_startup(results, budget_ms=100.0):
+    """
+    Returns the startup results exceeding the import time budget or loading optional dependencies
+
+    """
+    violations = []
+    for module, res in results.items():
+        if budget_ms is not None and res["seconds"] * 1000 > budget_ms:
+            violations.append("{} imports in {:.1f} ms, over the budget of {:.0f} ms".format(
+                module, res["seconds"] * 1000, budget_ms))
+        if res["lazy_loaded"]:
+            violations.append("{} loads {}".format(module, ", ".join(res["lazy_loaded"])))
+    return violations
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.decode().strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(fixtures=None, repeat=3, audio=True, fixture_dir=None, startup=True):
+    fixtures = fixtures if fixtures is not None else list(FIXTURES)
+    report = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": {}}
+    if startup:
+        termcolor.cprint("Benchmarking startup", color="yellow")
+        report["results"]["startup"] = bench_startup()
+    tmp_dir = fixture_dir or tempfile.mkdtemp()
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        for name in fixtures:
+            num_cues, overlap_ratio, rolling = FIXTURES[name]
+            subtitle_file = os.path.join(tmp_dir, "{}.en.vtt".format(name))
+            duration = make_vtt(subtitle_file, num_cues, overlap_ratio, rolling)
+            termcolor.cprint("Benchmarking {}".format(name), color="yellow")
+            report["results"][name] = bench_subtitles(subtitle_file, repeat)
+            if not audio:
+                continue
+            if shutil.which("ffmpeg") is None:
+                report["results"][name]["extraction"] = "skipped, ffmpeg not found"
+                continue
+            audio_file = os.path.join(tmp_dir, "{}.m4a".format(name))
+            make_audio(audio_file, duration)
+            report["results"][name].update(bench_extraction(subtitle_file, audio_file))
+    finally:
+        if fixture_dir is None:
+            shutil.rmtree(tmp_dir)
+    return report
+
+
+def compare(report, baseline):
+    """
+    Prints the throughput of every benchmark relative to the baseline report
+
+    """
+    for fixture, results in report["results"].items():
+        for name, res in results.items():
+            old = baseline.get("results", {}).get(fixture, {}).get(name)
+            if not isinstance(res, dict) or not isinstance(old, dict):
+                continue
+            ratio = old["seconds"] / res["seconds"] if res["seconds"] > 0 else float("inf")
+            color = "green" if ratio >= 1.0 else "red"
+            termcolor.cprint("{:>16} {:<40} {:>10.4f}s {:>6.2f}x".format(fixture, name, res["seconds"], ratio),
+                             color=color)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=str, default=None, help="JSON file with the results")
+    parser.add_argument("--compare", type=str, default=None, help="Results of an earlier run")
+    parser.add_argument("--fixtures", nargs="+", choices=list(FIXTURES), default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-audio", action="store_true", help="Skip the audio extraction benchmarks")
+    parser.add_argument("--fixture-dir", type=str, default=None, help="Keep the generated fixtures in this directory")
+    startup = parser.add_mutually_exclusive_group()
+    startup.add_argument("--no-startup", action="store_true", help="Skip the import time benchmark")
+    startup.add_argument("--startup-only", action="store_true", help="Only run the import time benchmark")
+    parser.add_argument("--startup-budget-ms", type=float, default=100.0,
+                        help="Maximum import time of the worker entry points on top of numpy")
+
+    opt = parser.parse_args()
+    report = run_benchmarks([] if opt.startup_only else opt.fixtures, repeat=opt.repeat, audio=not opt.no_audio,
+                            fixture_dir=opt.fixture_dir, startup=not opt.no_startup)
+    if opt.output:
+        with open(opt.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if opt.compare:
+        with open(opt.compare) as f:
+            compare(report, json.load(f))
+    else:
+        json.dump(report["results"], sys.stdout, indent=2)
+        print()
+    violations = check_startup(report["results"].get("startup", {}), opt.startup_budget_ms)
+    for violation in violations:
+        termcolor.cprint(violation, color="red")
+    if violations:
+        sys.exit(1)
@@ -0,0 +1,307 @@
+import io
+import heapq
+from collections import namedtuple
+import numpy as np
+from crawler.youtube_helpers import iter_vtt_cues
+
+# a single caption flowing through the streaming pipeline
+Caption = namedtuple("Caption", ["start", "end", "text", "idx"])
+
+
+class CaptionBatch:
+    """
+    Column oriented storage of the captions of a video. Timings are NumPy columns, texts are kept
+    in an object array and removed captions are only switched off in the keep mask, so the filters
+    work on whole columns instead of rebuilding lists of dicts. Dicts are built only by to_dicts()
+    when the segments are written.
+
+    """
+    def __init__(self, start, end, texts, idx=None, sub_file=None, keep=None, extra=None):
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.texts = np.empty(len(self.start), dtype=object)
+        self.texts[:] = list(texts)
+        self.idx = np.arange(len(self.start)) if idx is None else np.asarray(idx, dtype=np.int64)
+        self.keep = np.ones(len(self.start), dtype=bool) if keep is None else np.asarray(keep, dtype=bool)
+        self.sub_file = sub_file
+        # additional per caption columns, e.g. statistics computed by the filters
+        self.extra = extra or {}
+
+    @classmethod
+    def from_cues(cls, cues, sub_file=None):
+        start, end, texts = [], [], []
+        for cue_start, cue_end, text in cues:
+            start.append(cue_start)
+            end.append(cue_end)
+            texts.append(text.replace('\n', ' '))
+        return cls(start, end, texts, sub_file=sub_file)
+
+    @classmethod
+    def from_file(cls, subtitle_file):
+        with io.open(subtitle_file, encoding="utf-8-sig") as f:
+            return cls.from_cues(iter_vtt_cues(f), sub_file=subtitle_file)
+
+    @classmethod
+    def from_captions(cls, captions, sub_file=None):
+        start, end, texts, idx = [], [], [], []
+        for c in captions:
+            start.append(c.start)
+            end.append(c.end)
+            texts.append(c.text)
+            idx.append(c.idx)
+        return cls(start, end, texts, idx=idx, sub_file=sub_file)
+
+    @classmethod
+    def from_dicts(cls, subs, sub_file=None):
+        return cls([s["ts_start"] for s in subs], [s["ts_end"] for s in subs],
+                   [s["original_phrase"] for s in subs], idx=[s["idx"] for s in subs],
+                   sub_file=sub_file if sub_file is not None else (subs[0]["sub_file"] if subs else None))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.keep))
+
+    @property
+    def duration(self):
+        return np.round(self.end - self.start, 3)
+
+    def kept_indices(self):
+        return np.flatnonzero(self.keep)
+
+    def compact(self):
+        """
+        Returns a new batch containing only the kept captions
+
+        """
+        rows = self.kept_indices()
+        return CaptionBatch(self.start[rows], self.end[rows], self.texts[rows], idx=self.idx[rows],
+                            sub_file=self.sub_file, extra={k: v[rows] for k, v in self.extra.items()})
+
+    def filter(self, mask):
+        self.keep &= mask
+        return self
+
+    def filter_texts(self, predicate):
+        """
+        Removes the kept captions whose text does not satisfy the predicate
+
+        """
+        rows = self.kept_indices()
+        self.keep[rows] = np.fromiter((bool(predicate(t)) for t in self.texts[rows]), dtype=bool, count=len(rows))
+        return self
+
+    def map_texts(self, func):
+        rows = self.kept_indices()
+        self.texts[rows] = [func(t) for t in self.texts[rows]]
+        return self
+
+    def process_texts(self, func):
+        """
+        Replaces the text of every kept caption by func(text), the captions for which func returns
+        None are removed
+
+        """
+        rows = self.kept_indices()
+        for row, t in zip(rows.tolist(), self.texts[rows]):
+            t = func(t)
+            if t is None:
+                self.keep[row] = False
+            else:
+                self.texts[row] = t
+        return self
+
+    def word_counts(self):
+        """
+        Number of words of every caption, 0 for the removed ones
+
+        """
+        counts = np.zeros(len(self.texts), dtype=np.int64)
+        rows = self.kept_indices()
+        counts[rows] = np.fromiter((len(t.split()) for t in self.texts[rows]), dtype=np.int64, count=len(rows))
+        return counts
+
+    def remove_overlapping(self, width=None):
+        """
+        Removes the kept captions overlapping another kept caption and returns the overlap statistics
+
+        """
+        rows = self.kept_indices()
+        start, end = self.start[rows], self.end[rows]
+        bad = overlap_mask(start, end, width=width)
+        self.keep[rows[bad]] = False
+        return overlap_statistics(start, end, bad)
+
+    def merge(self, min_dist=1.5, max_dist=6.0):
+        """
+        Vectorized merge_subtitles: consecutive kept captions closer than min_dist seconds are merged
+        while the merged caption stays shorter than max_dist seconds. Returns a new batch
+
+        """
+        batch = self.compact()
+        n = len(batch.start)
+        if n == 0:
+            return batch
+        gaps = batch.start[1:] - batch.end[:-1]
+        assert (gaps >= 0.0).all()
+        close = (gaps < min_dist).tolist()
+        start, end = batch.start.tolist(), batch.end.tolist()
+        # the merged length depends on where the current group started, so the group boundaries
+        # are found in one pass over plain floats and the columns are then reduced per group
+        first = [0]
+        group_start = start[0]
+        for i in range(1, n):
+            if close[i - 1] and end[i] - group_start < max_dist:
+                continue
+            first.append(i)
+            group_start = start[i]
+        first = np.asarray(first)
+        last = np.append(first[1:] - 1, n - 1)
+        texts = [" ".join(batch.texts[f:l + 1]) for f, l in zip(first.tolist(), last.tolist())]
+        return CaptionBatch(batch.start[first], batch.end[last], texts, idx=batch.idx[first],
+                            sub_file=batch.sub_file, extra={k: v[first] for k, v in batch.extra.items()})
+
+    def freeze_timing(self):
+        """
+        Copies the caption timing to the caption_start and caption_end columns. Segments are named
+        and deduplicated by them, so the audio filters moving the written boundaries (trimming,
+        snapping to pauses) do not rename segments that were already extracted
+
+        """
+        self.extra.setdefault("caption_start", self.start.copy())
+        self.extra.setdefault("caption_end", self.end.copy())
+        return self
+
+    def iter_captions(self):
+        rows = self.kept_indices()
+        for start, end, text, idx in zip(self.start[rows].tolist(), self.end[rows].tolist(),
+                                         self.texts[rows].tolist(), self.idx[rows].tolist()):
+            yield Caption(start, end, text, idx)
+
+    def to_dicts(self):
+        rows = self.kept_indices()
+        columns = {k: v[rows].tolist() for k, v in self.extra.items()}
+        res = []
+        for i, (start, end, duration, text, idx) in enumerate(zip(self.start[rows].tolist(), self.end[rows].tolist(),
+                                                                   self.duration[rows].tolist(),
+                                                                   self.texts[rows].tolist(), self.idx[rows].tolist())):
+            s = {"ts_start": start, "ts_end": end,
+                 "original_phrase": text,
+                 "sub_file": self.sub_file,
+                 "duration": duration,
+                 "idx": idx}
+            for k, v in columns.items():
+                s[k] = v[i]
+            res.append(s)
+        return res
+
+
+def overlap_mask(start, end, width=None):
+    """
+    Marks the captions overlapping at least one other caption (start_a < end_b and start_b < end_a).
+    The captions are swept in start order keeping the running maximum of the end times, so every
+    overlapping pair is found in O(n log n) however long the captions are. With width set, a caption
+    is only compared with its width neighbours in start order on each side
+
+    """
+    n = len(start)
+    bad = np.zeros(n, dtype=bool)
+    if n < 2:
+        return bad
+    # ties on start are ordered by end, so a zero length caption never counts as overlapping
+    # a caption starting at the same time
+    order = np.lexsort((end, start))
+    start, end = start[order], end[order]
+    if width is None:
+        running_max_end = np.maximum.accumulate(end)
+        bad[1:] = start[1:] < running_max_end[:-1]
+        # the next caption in start order is the first one that can overlap a caption from the right
+        bad[:-1] |= start[1:] < end[:-1]
+    else:
+        for i in range(1, min(width, n - 1) + 1):
+            overlap = (start[i:] < end[:-i]) & (start[:-i] < end[i:])
+            bad[:-i] |= overlap
+            bad[i:] |= overlap
+    res = np.zeros(n, dtype=bool)
+    res[order] = bad
+    return res
+
+
+def overlap_statistics(start, end, bad):
+    """
+    Summary of the overlapping captions found by overlap_mask
+
+    """
+    return {"num_captions": int(len(start)),
+            "num_overlapping": int(np.count_nonzero(bad)),
+            "overlapping_sec": round(float(np.sum(end[bad] - start[bad])), 3)}
+
+
+def captions_from_cues(cues):
+    for idx, (start, end, text) in enumerate(cues):
+        yield Caption(start, end, text.replace('\n', ' '), idx)
+
+
+def caption_duration(caption):
+    # rounded like CaptionBatch.duration
+    return float(np.round(caption.end - caption.start, 3))
+
+
+def stream_remove_overlapping(captions, lookahead=64, stats=None):
+    """
+    Streaming overlap_mask: captions are reordered by start within a window of lookahead captions
+    and compared with the running maximum of the end times and the next caption, so the result
+    equals overlap_mask for any subtitle file whose cues are out of order by less than lookahead.
+    The kept captions are yielded in start order, the counters of overlap_statistics are
+    accumulated in stats
+
+    """
+    if stats is not None:
+        stats.update({"num_captions": 0, "num_overlapping": 0, "overlapping_sec": 0.0})
+
+    def in_start_order():
+        heap = []
+        for c in captions:
+            heapq.heappush(heap, (c.start, c.end, c.idx, c))
+            if len(heap) > lookahead:
+                yield heapq.heappop(heap)[-1]
+        while heap:
+            yield heapq.heappop(heap)[-1]
+
+    def finish(c, bad):
+        if stats is not None:
+            stats["num_captions"] += 1
+            if bad:
+                stats["num_overlapping"] += 1
+                stats["overlapping_sec"] = round(stats["overlapping_sec"] + c.end - c.start, 3)
+        return not bad
+
+    prev, prev_bad, max_end = None, False, None
+    for c in in_start_order():
+        bad = False
+        if prev is not None:
+            prev_bad |= c.start < prev.end
+            bad = c.start < max_end
+            if finish(prev, prev_bad):
+                yield prev
+        max_end = c.end if max_end is None else max(max_end, c.end)
+        prev, prev_bad = c, bad
+    if prev is not None and finish(prev, prev_bad):
+        yield prev
+
+
+def stream_merge(captions, min_dist=1.5, max_dist=6.0):
+    """
+    Streaming CaptionBatch.merge, only the current group of captions is kept in memory
+
+    """
+    group = []
+    for c in captions:
+        if group:
+            gap = c.start - group[-1].end
+            assert gap >= 0.0
+            if gap < min_dist and c.end - group[0].start < max_dist:
+                group.append(c)
+                continue
+            yield Caption(group[0].start, group[-1].end, " ".join(g.text for g in group), group[0].idx)
+        group = [c]
+    if group:
+        yield Caption(group[0].start, group[-1].end, " ".join(g.text for g in group), group[0].idx)
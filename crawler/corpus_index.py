@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Index of the written segments, <target_dir>/corpus.sqlite. The writers append to it, so the web demo
+can sample segments without walking the corpus tree.
+
+Building the index of a corpus written before it existed:
+    python -m crawler.corpus_index <dir_for_resulting_samples>
+"""
+import os
+import io
+import json
+import glob
+import wave
+import random
+import argparse
+import termcolor
+from crawler.db import connect
+
+INDEX_FILENAME = "corpus.sqlite"
+FILES_LOCATION = "files"
+
+
+class CorpusIndex:
+    """
+    Segments are stored with an integer primary key, so a random segment is found by an offset into
+    the primary key order instead of loading the list of all the segments
+
+    location is "files" for the wav/txt/metadata tree or the shard file name for the sharded format
+    """
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        os.makedirs(target_dir, exist_ok=True)
+        self.conn = connect(os.path.join(target_dir, INDEX_FILENAME))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY, key TEXT UNIQUE, "
+                          "duration REAL, video_id TEXT, location TEXT, sub_file TEXT)")
+        if "sub_file" not in [row[1] for row in self.conn.execute("PRAGMA table_info(segments)")]:
+            # indexed before the subtitle file was recorded, NULL for the existing segments
+            self.conn.execute("ALTER TABLE segments ADD COLUMN sub_file TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS segments_video ON segments (video_id)")
+        self.pending = []
+
+    def add(self, key, duration, video_id, location=FILES_LOCATION, sub_file=None):
+        self.pending.append((key, duration, video_id, location, sub_file))
+
+    def flush(self):
+        if self.pending:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany("INSERT OR REPLACE INTO segments (key, duration, video_id, location, sub_file) "
+                                      "VALUES (?, ?, ?, ?, ?)", self.pending)
+            self.pending = []
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def __contains__(self, key):
+        return self.conn.execute("SELECT 1 FROM segments WHERE key = ?", (key,)).fetchone() is not None
+
+    def video_segments(self, video_id):
+        """
+        Returns {key: (location, sub_file)} of the segments of a video, from all its subtitle files.
+        sub_file is None for the segments indexed before it was recorded
+
+        """
+        return {key: (location, sub_file) for key, location, sub_file in
+                self.conn.execute("SELECT key, location, sub_file FROM segments WHERE video_id = ?", (video_id,))}
+
+    def remove(self, keys):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM segments WHERE key = ?", [(key,) for key in keys])
+
+    def location(self, key):
+        row = self.conn.execute("SELECT location FROM segments WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def attach(self, filename, name):
+        if not name.isidentifier():
+            raise ValueError("Invalid database name {!r}".format(name))
+        self.conn.execute("ATTACH DATABASE ? AS {}".format(name), (filename,))
+
+    def random_sample(self, exclude=None):
+        """
+        Returns (key, duration, video_id, location) of a random segment, None if the index is empty
+
+        :param exclude: table with a key column, e.g. "annotations.annotations" of an attached database.
+                        A segment not listed there is returned, any segment once all of them are listed
+        """
+        conditions = [""]
+        if exclude is not None:
+            if not all(part.isidentifier() for part in exclude.split(".")):
+                raise ValueError("Invalid table name {!r}".format(exclude))
+            # NOT EXISTS is a lookup in the key index of the excluded table for every visited segment
+            conditions.insert(0, " WHERE NOT EXISTS (SELECT 1 FROM {} AS e WHERE e.key = segments.key)".format(exclude))
+        for condition in conditions:
+            # every segment is equally likely, ids have gaps after removals
+            count = self.conn.execute("SELECT COUNT(*) FROM segments" + condition).fetchone()[0]
+            if count > 0:
+                return self.conn.execute("SELECT key, duration, video_id, location FROM segments{} "
+                                         "ORDER BY id LIMIT 1 OFFSET ?".format(condition),
+                                         (random.randint(0, count - 1),)).fetchone()
+        return None
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def build_index(target_dir):
+    """
+    Adds the segments of an existing wav/txt/metadata tree and of the shards to the index
+
+    """
+    from tqdm import tqdm
+    index = CorpusIndex(target_dir)
+    for wav_file in tqdm(glob.glob(os.path.join(target_dir, "wav", "*", "*.wav"))):
+        key = os.path.splitext(os.path.basename(wav_file))[0]
+        metadata_file = os.path.join(target_dir, "metadata", key[:2], key + ".json")
+        if not os.path.exists(metadata_file):
+            continue
+        try:
+            with wave.open(wav_file) as f:
+                duration = f.getnframes() / f.getframerate()
+            with io.open(metadata_file, encoding='utf-8') as f:
+                t = json.load(f)
+        except Exception as e:
+            termcolor.cprint("Cannot read {}: {}".format(wav_file, e), color="red")
+            continue
+        index.add(key, duration, t["metadata"].get("id"), FILES_LOCATION, t.get("sub_file"))
+        if len(index.pending) >= 10000:
+            index.flush()
+
+    from crawler.writers import ShardReader
+    for sample in tqdm(ShardReader(target_dir).iter_headers()):
+        index.add(sample["key"], sample["duration"], sample["video_id"], sample["location"], sample["sub_file"])
+        if len(index.pending) >= 10000:
+            index.flush()
+    index.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_dir", type=str)
+
+    opt = parser.parse_args()
+    build_index(opt.target_dir)
+    termcolor.cprint("{} segments indexed".format(len(CorpusIndex(opt.target_dir))), color="cyan")
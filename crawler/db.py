@@ -0,0 +1,13 @@
+import sqlite3
+
+
+def connect(filename, timeout=60.0):
+    """
+    Opens an SQLite database shared by several worker processes: WAL journal so that readers do not
+    block the writer, and a busy timeout instead of failing when another process holds the lock
+
+    """
+    conn = sqlite3.connect(filename, timeout=timeout, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Corpus wide index of the extracted segments, consulted before extraction to skip segments that
+already exist under another name (re-uploads, mirrored channels, the same video downloaded twice).
+
+A segment is a duplicate of an indexed one if it has the same YouTube id and time range, or the same
+text fingerprint, on any channel: normalized transcript plus the duration rounded to 100 ms. Short
+phrases ("thank you very much") are common to unrelated videos, so transcripts of less than
+MIN_FINGERPRINT_WORDS words have no fingerprint and are only matched by time range.
+
+Removing the duplicates of an existing corpus and filling the index:
+    python -m crawler.dedup <dir_for_resulting_samples> --index ./dedup.sqlite --remove
+"""
+import os
+import io
+import json
+import glob
+import hashlib
+import argparse
+import termcolor
+from crawler.db import connect
+from crawler.youtube_helpers import parse_ts
+from crawler.corpus_index import CorpusIndex
+
+MIN_FINGERPRINT_WORDS = 8
+
+
+def text_fingerprint(text, duration):
+    """
+    Fingerprint of a transcript and its duration, None for transcripts too short to identify a segment
+
+    """
+    words = text.upper().split()
+    if len(words) < MIN_FINGERPRINT_WORDS:
+        return None
+    return hashlib.sha1("{}|{:.1f}".format(" ".join(words), duration).encode('utf-8')).hexdigest()
+
+
+class DedupIndex:
+    def __init__(self, filename):
+        self.conn = connect(filename)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS segments (key TEXT PRIMARY KEY, youtube_id TEXT, "
+                          "ts_start_ms INTEGER, ts_end_ms INTEGER, fingerprint TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS segments_range ON segments (youtube_id, ts_start_ms, ts_end_ms)")
+        self.conn.execute("DROP INDEX IF EXISTS segments_channel_fingerprint")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS segments_fingerprint ON segments (fingerprint)")
+
+    @staticmethod
+    def _row(key, youtube_id, ts_start, ts_end, text):
+        return (key, youtube_id, int(round(ts_start * 1000)), int(round(ts_end * 1000)),
+                text_fingerprint(text, ts_end - ts_start))
+
+    def find_duplicate(self, youtube_id, ts_start, ts_end, text):
+        """
+        Returns the key of an indexed segment with the same YouTube id and time range or the same
+        text fingerprint, None if there is none
+
+        """
+        _, youtube_id, start_ms, end_ms, fingerprint = self._row(None, youtube_id, ts_start, ts_end, text)
+        row = self.conn.execute("SELECT key FROM segments WHERE youtube_id = ? AND ts_start_ms = ? AND ts_end_ms = ? "
+                                "UNION ALL SELECT key FROM segments WHERE fingerprint = ? LIMIT 1",
+                                (youtube_id, start_ms, end_ms, fingerprint)).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, key, youtube_id, ts_start, ts_end, text):
+        self.conn.execute("INSERT OR IGNORE INTO segments (key, youtube_id, ts_start_ms, ts_end_ms, fingerprint) "
+                          "VALUES (?, ?, ?, ?, ?)", self._row(key, youtube_id, ts_start, ts_end, text))
+
+    def remove(self, keys):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM segments WHERE key = ?", [(key,) for key in keys])
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_metadata_files(target_dir):
+    for metadata_file in sorted(glob.glob(os.path.join(target_dir, "metadata", "*", "*.json"))):
+        yield metadata_file
+
+
+def segment_files(metadata_file):
+    """
+    wav, txt and json files of the segment described by metadata_file in the wav/txt/metadata tree
+
+    """
+    subdir, filename = os.path.split(metadata_file)
+    target_dir = os.path.dirname(os.path.dirname(subdir))
+    prefix = os.path.basename(subdir)
+    key = os.path.splitext(filename)[0]
+    return [os.path.join(target_dir, "wav", prefix, key + ".wav"),
+            os.path.join(target_dir, "txt", prefix, key + ".txt"),
+            metadata_file]
+
+
+def dedupe(target_dir, index, remove=False):
+    """
+    Registers every segment of an existing wav/txt/metadata tree in the index. Segments duplicating
+    an already indexed one are reported and, if remove is set, removed with their corpus index rows
+
+    """
+    from tqdm import tqdm
+    num_duplicates = 0
+    removed_keys = []
+    for metadata_file in tqdm(iter_metadata_files(target_dir)):
+        key = os.path.splitext(os.path.basename(metadata_file))[0]
+        try:
+            with io.open(metadata_file, encoding='utf-8') as f:
+                t = json.load(f)
+            youtube_id = t["metadata"]["id"]
+            # segments written since the audio filters may move the boundaries keep the caption timing
+            ts_start = parse_ts(t.get("caption_start", t["ts_start"]))
+            ts_end = parse_ts(t.get("caption_end", t["ts_end"]))
+        except Exception as e:
+            termcolor.cprint("Cannot read {}: {}".format(metadata_file, e), color="red")
+            continue
+        duplicate = index.find_duplicate(youtube_id, ts_start, ts_end, t["original_phrase"])
+        if duplicate is not None and duplicate != key:
+            num_duplicates += 1
+            termcolor.cprint("{} duplicates {}".format(key, duplicate), color="yellow")
+            if remove:
+                for filename in segment_files(metadata_file):
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                removed_keys.append(key)
+        else:
+            index.add(key, youtube_id, ts_start, ts_end, t["original_phrase"])
+    if removed_keys:
+        corpus_index = CorpusIndex(target_dir)
+        corpus_index.remove(removed_keys)
+        corpus_index.close()
+    return num_duplicates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_dir", type=str)
+    parser.add_argument("--index", type=str, required=True)
+    parser.add_argument("--remove", action="store_true", help="Remove the duplicated segments")
+
+    opt = parser.parse_args()
+    index = DedupIndex(opt.index)
+    num_duplicates = dedupe(opt.target_dir, index, remove=opt.remove)
+    index.close()
+    termcolor.cprint("{} duplicates found".format(num_duplicates), color="cyan")
@@ -3,13 +3,21 @@ trap "exit" INT
 
 target_dir=$1
 filter_dir=$2
+# optional: instead of running process.py per video, append the downloaded files to a queue file
+# consumed by a long running `python -m crawler.worker <filter_dir> --queue-file <queue_file>`
+queue_file=$3
+# optional: space separated languages to crawl, e.g. LANGUAGES="en de", see crawler/languages
+languages=${LANGUAGES:-en}
 
-declare -a arr=("and" "the" "on"  "in" "is" "to" "of" "a" "have" "it" "for" "not" "with" "as" "you" "do" "this" "but" "his" "by" "from" "they" "we" "say" "her" "she" "or" "an" "will"  "my"  "one"  "all" "would"  "there"  "their"  "what"  "up"  "if" "about"  "who"  "which"  "go"  "when" "make" "can" "like" "time"  "just" "him"  "take"  "people" "into" "good"  "some"  "could"  "them" "see" "other" "only"  "then" "come"  "its" "also" "over" "think" "also" "back" "after" "use" "two" "how" "our" "work" "first" "well" "way" "even" "new" "want" "because" "any" "these" "give" "day" "most" "us" "time" "person" "year" "get" "know" )
-for i in `seq 1 30`;
-do
-    echo "PAGE="$i
-    for kw in "${arr[@]}"
-    do
-        youtube-dl --download-archive ./en-downloaded.txt --no-overwrites -f 'bestaudio[ext=m4a]' --restrict-filenames --youtube-skip-dash-manifest --prefer-ffmpeg --socket-timeout 20  -iwc --write-info-json -k --write-srt --sub-format ttml --sub-lang en --convert-subs vtt  "https://www.youtube.com/results?sp=EgQIBCgB&q="$kw"&p="$i -o "$target_dir%(id)s%(title)s.%(ext)s" --exec "python ./crawler/process.py {} '$filter_dir'"
-    done
-done
+# searches the keywords of crawler/keywords/<lang>.txt page by page, see crawler/scheduler.py.
+# Progress is kept in ./crawl.sqlite, the ids of ./en-downloaded.txt of earlier crawls are skipped
+archive_args=()
+if [ -f ./en-downloaded.txt ]; then
+    archive_args=(--import-archive ./en-downloaded.txt)
+fi
+queue_args=()
+if [ -n "$queue_file" ]; then
+    queue_args=(--queue-file "$queue_file")
+fi
+python -m crawler.scheduler "$target_dir" "$filter_dir" --lang $languages --pages 30 \
+    --state ./crawl.sqlite "${archive_args[@]}" "${queue_args[@]}"
@@ -1,13 +1,35 @@
 import re
-from crawler.youtube_helpers import remove_overlapping_subtitles, \
-    normalize_subtitle, leave_alphanum_characters, merge_subtitles, _get_transcript_google_web_asr
+import time
+import itertools
+from crawler.youtube_helpers import segment_hash
+from crawler.utils import DecodedAudio
+from crawler.captions import CaptionBatch, captions_from_cues, caption_duration, stream_remove_overlapping, \
+    stream_merge
+from crawler.languages import get_normalizer, caption_regexp, get_language
+from crawler.audio_stats import frame_energy, segment_quality, snap_to_silence, FRAME_SEC, SILENCE_THRESHOLD
+import numpy as np
 import random
-from Levenshtein import ratio
+
+def _num_captions(data):
+    if isinstance(data, dict) and 'subtitles' in data:
+        return len(data['subtitles'])
+    return None
+
+
+def _stage_name(component):
+    # fused filters are named after the filters they run
+    return getattr(component, "name", type(component).__name__)
+
 
 class Pipeline:
     """
     Pipeline class storing and applying list of filters to the input video
 
+    Wall and CPU time and the captions entering and leaving every filter are recorded in
+    data['stats']['filters'], after the ones of an earlier pipeline run on the same data. The
+    remaining filters are skipped once a video level gate has rejected the video (data['rejected'])
+    or no caption is left
+
     """
     def __init__(self,  lst_components):
         super(Pipeline, self).__init__()
@@ -15,10 +37,85 @@ class Pipeline:
 
     def __call__(self, data):
         result = data
+        timings = []
         for component in self.lst_components:
+            captions_in = _num_captions(result)
+            wall, cpu = time.perf_counter(), time.process_time()
             result = component(result)
+            timings.append({"name": _stage_name(component),
+                            "wall_sec": round(time.perf_counter() - wall, 6),
+                            "cpu_sec": round(time.process_time() - cpu, 6),
+                            "captions_in": captions_in,
+                            "captions_out": _num_captions(result)})
+            if not isinstance(result, dict) or result.get('rejected') or _num_captions(result) == 0:
+                break
+        if isinstance(result, dict):
+            result.setdefault('stats', {}).setdefault('filters', []).extend(timings)
         return result
 
+
+class _StageTimer:
+    """
+    Counts the captions yielded by a stage of the streaming pipeline and the time spent producing
+    them, which includes the time of the upstream stages
+
+    """
+    def __init__(self, name, captions):
+        self.name = name
+        self.captions = captions
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __iter__(self):
+        it = iter(self.captions)
+        while True:
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                caption = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.wall += time.perf_counter() - wall
+                self.cpu += time.process_time() - cpu
+            self.count += 1
+            yield caption
+
+
+class StreamingPipeline(Pipeline):
+    """
+    Chains the stream() generators of the filters, so every caption flows through all the
+    filters before the next one is read. data['subtitles'] is a CaptionBatch or an iterable of
+    (start, end, text) cues, e.g. iter_vtt_cues of the open subtitle file, and is replaced by the
+    CaptionBatch of the kept captions. Video level gates stop reading the cues as soon as they
+    reject the video
+
+    """
+    def __call__(self, data):
+        subtitles = data['subtitles']
+        if isinstance(subtitles, CaptionBatch):
+            data.setdefault('sub_file', subtitles.sub_file)
+            captions = subtitles.iter_captions()
+        else:
+            captions = captions_from_cues(subtitles)
+        stages = [_StageTimer("source", captions)]
+        for component in self.lst_components:
+            stages.append(_StageTimer(_stage_name(component), component.stream(stages[-1], data)))
+        data['subtitles'] = CaptionBatch.from_captions(stages[-1], sub_file=data.get('sub_file'))
+
+        timings = []
+        for upstream, stage in zip(stages, stages[1:]):
+            # the time of a stage includes its upstream, the exclusive time is the difference
+            timings.append({"name": stage.name,
+                            "wall_sec": round(stage.wall - upstream.wall, 6),
+                            "cpu_sec": round(stage.cpu - upstream.cpu, 6),
+                            "captions_in": upstream.count,
+                            "captions_out": stage.count})
+        stats = data.setdefault('stats', {})
+        stats.setdefault('filters', []).extend(timings)
+        stats['num_captions_read'] = stages[0].count
+        return data
+
 class BaseFilter():
 
     def validate(self, input):
@@ -27,15 +124,45 @@ class BaseFilter():
     def __call__(self, input):
         raise NotImplementedError
 
+    def stream(self, captions, input):
+        """
+        Generator version of the filter used by StreamingPipeline. Filters without one collect
+        the captions into a CaptionBatch and run __call__ on it
+
+        """
+        input['subtitles'] = CaptionBatch.from_captions(captions, sub_file=input.get('sub_file'))
+        yield from self(input)['subtitles'].iter_captions()
+
+    def caption_op(self):
+        """
+        Stateless filters, which look at a single caption at a time, return (kind, func) so that
+        FusedCaptionFilter runs them in one pass: ("keep", text -> bool), ("map", text -> text) or
+        ("keep_duration", duration -> bool, also given a NumPy array). None for the other filters
+
+        """
+        return None
+
 class OverlappingSubtitlesRemover(BaseFilter):
-    def __init__(self):
+    def __init__(self, width=None):
+        """
+        :param width: number of neighbours (in start order) each caption is compared with,
+                      all the captions if None
+        """
         super(OverlappingSubtitlesRemover, self).__init__()
+        self.width = width
+        # captions out of start order by less than lookahead are handled by the streaming version
+        self.lookahead = 64
 
     def __call__(self, input):
-        subtitles = input['subtitles']
-        input['subtitles'] =  remove_overlapping_subtitles(subtitles)
+        input.setdefault('stats', {})['overlaps'] = input['subtitles'].remove_overlapping(width=self.width)
         return input
 
+    def stream(self, captions, input):
+        if self.width is not None:
+            return super(OverlappingSubtitlesRemover, self).stream(captions, input)
+        return stream_remove_overlapping(captions, lookahead=self.lookahead,
+                                         stats=input.setdefault('stats', {}).setdefault('overlaps', {}))
+
 
 class SubtitleMerger(BaseFilter):
     def __init__(self, min_gap_to_split_sec = 1.0, max_len_merged_sec = 15):
@@ -44,11 +171,13 @@ class SubtitleMerger(BaseFilter):
         self.max_len_merged_sec = max_len_merged_sec
 
     def __call__(self, input):
-        subtitles = input['subtitles']
-        input['subtitles'] = merge_subtitles(subtitles, min_dist=self.min_gap_to_split_sec,
-                                             max_dist=self.max_len_merged_sec)
+        input['subtitles'] = input['subtitles'].merge(min_dist=self.min_gap_to_split_sec,
+                                                      max_dist=self.max_len_merged_sec)
         return input
 
+    def stream(self, captions, input):
+        return stream_merge(captions, min_dist=self.min_gap_to_split_sec, max_dist=self.max_len_merged_sec)
+
 
 DEFAULT_BLACKLIST_CHARACTERS = set(["♪", "♬", "♫", ])
 
@@ -57,14 +186,25 @@ class SubtitleCaptionTextFilter(BaseFilter):
         super(SubtitleCaptionTextFilter, self).__init__()
         self.blacklist_chars = blacklisted_chars or DEFAULT_BLACKLIST_CHARACTERS
 
+    def _accept(self, t):
+        return all(t.find(c) == -1 for c in self.blacklist_chars)
+
     def __call__(self, input):
-        subtitles = input['subtitles']
-        input['subtitles'] = list(filter(lambda s: all(s['original_phrase'].find(c) == -1
-                                                  for c in self.blacklist_chars),
-                                                  subtitles))
+        input['subtitles'].filter_texts(self._accept)
         return input
 
+    def stream(self, captions, input):
+        return (c for c in captions if self._accept(c.text))
+
+    def caption_op(self):
+        return "keep", self._accept
+
 class MinNumberSubtitlesFilter(BaseFilter):
+    """
+    Video level gate rejecting the videos with at most threshold captions, the pipeline skips the
+    remaining filters of a rejected video
+
+    """
     def __init__(self, threshold=3):
         self.threshold = threshold
 
@@ -72,7 +212,20 @@ class MinNumberSubtitlesFilter(BaseFilter):
         assert 'subtitles' in input
 
     def __call__(self, input):
-        return len(input['subtitles']) > self.threshold
+        if len(input['subtitles']) <= self.threshold:
+            input['subtitles'].keep[:] = False
+            input['rejected'] = type(self).__name__
+        return input
+
+    def stream(self, captions, input):
+        # only threshold + 1 captions are read ahead to decide
+        captions = iter(captions)
+        head = list(itertools.islice(captions, self.threshold + 1))
+        if len(head) <= self.threshold:
+            input['rejected'] = type(self).__name__
+            return
+        yield from head
+        yield from captions
 
 
 class GoogleASRCheck(BaseFilter):
@@ -81,101 +234,344 @@ class GoogleASRCheck(BaseFilter):
 
 class CaptionRegexMatcher(BaseFilter):
 
-    def __init__(self, regexp):
+    def __init__(self, regexp=None, ignore_case=False, language="en"):
+        """
+        :param regexp: compiled regular expression or pattern, compiled with re.IGNORECASE if ignore_case.
+                       The letters of the language and punctuation if None, see crawler.languages
+        """
         super(CaptionRegexMatcher, self).__init__()
-        self.regexp = regexp
+        if regexp is None:
+            regexp = caption_regexp(language)
+        self.regexp = re.compile(regexp, re.IGNORECASE if ignore_case else 0) if isinstance(regexp, str) else regexp
+
+    def _accept(self, t):
+        return self.regexp.match(t) is not None
 
     def __call__(self, input):
-        subtitles = input['subtitles']
-        input['subtitles'] = list(filter(lambda s: re.match(self.regexp, s['original_phrase']) is not None, subtitles))
+        input['subtitles'].filter_texts(self._accept)
         return input
 
+    def stream(self, captions, input):
+        return (c for c in captions if self._accept(c.text))
+
+    def caption_op(self):
+        return "keep", self._accept
+
 
 class CaptionNormalizer(BaseFilter):
+    def __init__(self, normalizer=None, language="en"):
+        super(CaptionNormalizer, self).__init__()
+        self.normalizer = normalizer or get_normalizer(language)
+
     def __call__(self, input):
-        for sub_info in input['subtitles']:
-            sub_info['original_phrase'] =  normalize_subtitle(sub_info["original_phrase"])
+        input['subtitles'].map_texts(self.normalizer.normalize)
         return input
 
+    def stream(self, captions, input):
+        return (c._replace(text=self.normalizer.normalize(c.text)) for c in captions)
+
+    def caption_op(self):
+        return "map", self.normalizer.normalize
+
 class CaptionLengthFilter(BaseFilter):
 
     def __init__(self, min_length=None, max_length=None):
         super(CaptionLengthFilter, self).__init__()
-        self.min_filter_func = lambda x: len(x.split()) >= min_length if min_length else lambda x: True
-        self.max_filter_func = lambda x: len(x.split()) <= max_length if max_length else lambda x: True
-
+        self.min_length = min_length
+        self.max_length = max_length
 
     def __call__(self, input):
         subtitles = input['subtitles']
-        input['subtitles'] = list(filter(lambda s: self.min_filter_func(s['original_phrase'])
-                                  and self.max_filter_func(s['original_phrase']), subtitles))
+        num_words = subtitles.word_counts()
+        if self.min_length is not None:
+            subtitles.filter(num_words >= self.min_length)
+        if self.max_length is not None:
+            subtitles.filter(num_words <= self.max_length)
         return input
 
+    def _accept(self, t):
+        num_words = len(t.split())
+        return (self.min_length is None or num_words >= self.min_length) and \
+            (self.max_length is None or num_words <= self.max_length)
+
+    def stream(self, captions, input):
+        return (c for c in captions if self._accept(c.text))
+
+    def caption_op(self):
+        return "keep", self._accept
+
 class CaptionDurationFilter(BaseFilter):
     def __init__(self, min_length=None, max_length=None):
         super(CaptionDurationFilter, self).__init__()
-        self.min_filter_func = lambda x: x['duration'] >= min_length if min_length else lambda x: True
-        self.max_filter_func = lambda x: x['duration'] <= max_length if max_length else lambda x: True
-
+        self.min_length = min_length
+        self.max_length = max_length
 
     def __call__(self, input):
         subtitles = input['subtitles']
-        input['subtitles'] = list(filter(lambda s: self.min_filter_func(s)
-                                  and self.max_filter_func(s), subtitles))
+        duration = subtitles.duration
+        if self.min_length is not None:
+            subtitles.filter(duration >= self.min_length)
+        if self.max_length is not None:
+            subtitles.filter(duration <= self.max_length)
         return input
 
+    def _accept(self, duration):
+        keep = np.ones(np.shape(duration), dtype=bool)
+        if self.min_length is not None:
+            keep &= duration >= self.min_length
+        if self.max_length is not None:
+            keep &= duration <= self.max_length
+        return keep
+
+    def stream(self, captions, input):
+        return (c for c in captions if self._accept(caption_duration(c)))
+
+    def caption_op(self):
+        return "keep_duration", self._accept
+
 class CaptionLeaveOnlyAlphaNumCharacters(BaseFilter):
+    def __init__(self, normalizer=None, language="en"):
+        super(CaptionLeaveOnlyAlphaNumCharacters, self).__init__()
+        self.normalizer = normalizer or get_normalizer(language)
 
     def __call__(self, input):
-        for sub_info in input['subtitles']:
-            sub_info['original_phrase'] =  leave_alphanum_characters(sub_info["original_phrase"])
+        input['subtitles'].map_texts(self.normalizer.leave_alphanum)
         return input
 
+    def stream(self, captions, input):
+        return (c._replace(text=self.normalizer.leave_alphanum(c.text)) for c in captions)
+
+    def caption_op(self):
+        return "map", self.normalizer.leave_alphanum
+
 class GoogleRandomSubsetWERFilter(BaseFilter):
 
-    def __init__(self, num_samples_to_test=3, mean_wer_threshold = 0.3):
+    def __init__(self, num_samples_to_test=3, mean_wer_threshold = 0.3, asr=None, language="en",
+                 transcript_cache=None):
+        """
+        :param asr: crawler.asr.AsrClient, Google web speech API in the language if None
+        :param transcript_cache: crawler.asr.TranscriptCache file of that client, so that a re-run does not
+                                 query the API again. The tested subset is seeded by the subtitle file and
+                                 is the same on every run
+        """
         super(GoogleRandomSubsetWERFilter, self).__init__()
         self.num_samples_to_test = num_samples_to_test
         self.mean_wer_threshold = mean_wer_threshold
+        self.asr = asr
+        self.language = language
+        self.transcript_cache = transcript_cache
 
     def __call__(self, input):
+        # only the pipelines with the ASR check load the ASR client and Levenshtein
+        from Levenshtein import ratio
+        from crawler.asr import AsrClient, GoogleWebRecognizer
+        if self.asr is None:
+            self.asr = AsrClient(GoogleWebRecognizer(get_language(self.language).ASR_LANGUAGE),
+                                 cache=self.transcript_cache)
         subtitles = input["subtitles"]
-        subset = random.sample(subtitles, self.num_samples_to_test)
-
-        transcripts = [(s, _get_transcript_google_web_asr(s)) for s in subset]
+        candidates = subtitles.to_dicts()
+        subset = random.Random(subtitles.sub_file or "").sample(candidates,
+                                                               min(self.num_samples_to_test, len(candidates)))
+
+        # the segments are sliced from the audio decoded once for the whole video
+        if "audio" not in input:
+            input["audio"] = DecodedAudio(input["video_file"])
+        audio = input["audio"]
+        for s in subset:
+            s["hash"] = segment_hash(subtitles.sub_file or "", s["original_phrase"], s["ts_start"])
+        recognized = self.asr.transcribe_many([(s["hash"], audio.segment(s["ts_start"], s["ts_end"]), audio.sample_rate)
+                                               for s in subset])
+        transcripts = [(s, recognized.get(s["hash"])) for s in subset]
         transcripts = [(t, s) for (t, s) in transcripts if s is not None]
         if len(transcripts) == 0:
             #filter removes all the subtitles, as potentially unreliable sample
-            subtitles = []
+            subtitles.keep[:] = False
+            input['rejected'] = type(self).__name__
         else:
-            overlap_ratio = [ratio(t["phrase"].lower(), s.lower()) for (t, s) in transcripts]
+            overlap_ratio = [ratio(t["original_phrase"].lower(), s.lower()) for (t, s) in transcripts]
             passed_threshold =  sum(overlap_ratio) / len(overlap_ratio) > self.mean_wer_threshold
             if not passed_threshold:
                 #removing all subtitles, as potentially unreliable
-                subtitles = []
-        input["subtitles"] = subtitles
+                subtitles.keep[:] = False
+                input['rejected'] = type(self).__name__
+        return input
+
+def _frame_energy(input):
+    """
+    Frame energies of input['audio'], computed once per video and shared by the audio filters.
+    crawler.reprocess gives them from its cache, the audio is then not decoded here
+
+    """
+    if 'frame_energy' not in input:
+        audio = input['audio']
+        input['frame_energy'] = frame_energy(audio.samples, audio.sample_rate, FRAME_SEC)
+    return input['frame_energy']
+
+
+class BoundaryRefiner(BaseFilter):
+    """
+    Moves the boundaries of the captions, often shifted by hundreds of milliseconds on YouTube, to
+    the nearest pause of the audio within tolerance_sec, so that the segments do not cut words. An
+    energy VAD runs on the frame energies of the whole video and all the boundaries are snapped in
+    one pass, see crawler.audio_stats.snap_to_silence.
+
+    A caption is marked as mismatched ("boundary_mismatch" column of CaptionBatch.extra, and the
+    segment metadata) when a boundary has no pause within the tolerance or less than
+    min_speech_ratio of its span is speech, and removed if drop_mismatched is set.
+
+    Not part of the default pipelines, see crawler/pipelines/refine_boundaries.json. Only the written
+    timing changes, segments are named after the caption timing, see CaptionBatch.freeze_timing
+
+    """
+    def __init__(self, tolerance_sec=0.3, min_speech_ratio=0.3, min_silence_sec=0.05, drop_mismatched=False,
+                 silence_threshold=SILENCE_THRESHOLD):
+        super(BoundaryRefiner, self).__init__()
+        self.tolerance_sec = tolerance_sec
+        self.min_speech_ratio = min_speech_ratio
+        self.min_silence_sec = min_silence_sec
+        self.drop_mismatched = drop_mismatched
+        self.silence_threshold = silence_threshold
+
+    def __call__(self, input):
+        subtitles = input['subtitles']
+        rows = subtitles.kept_indices()
+        if 'audio' not in input or len(rows) == 0:
+            return input
+        energy, _ = _frame_energy(input)
+        start, end = subtitles.start[rows], subtitles.end[rows]
+        refined = snap_to_silence(energy, start, end, self.tolerance_sec, FRAME_SEC, self.silence_threshold,
+                                  self.min_silence_sec)
+        mismatch = ~refined["start_snapped"] | ~refined["end_snapped"] | \
+            (refined["speech_ratio"] < self.min_speech_ratio)
+        columns = {"boundary_shift_start": np.round(refined["start"] - start, 3),
+                   "boundary_shift_end": np.round(refined["end"] - end, 3),
+                   "boundary_speech_ratio": np.round(refined["speech_ratio"], 4),
+                   "boundary_mismatch": mismatch}
+        for name, values in columns.items():
+            column = subtitles.extra.setdefault(name, np.zeros(len(subtitles.keep), dtype=values.dtype))
+            column[rows] = values
+        subtitles.start[rows] = refined["start"]
+        subtitles.end[rows] = refined["end"]
+        stats = input.setdefault('stats', {}).setdefault('boundaries', {})
+        stats['snapped'] = stats.get('snapped', 0) + int(np.count_nonzero(refined["start_snapped"] & refined["end_snapped"]))
+        stats['mismatched'] = stats.get('mismatched', 0) + int(np.count_nonzero(mismatch))
+        if self.drop_mismatched:
+            subtitles.keep[rows[mismatch]] = False
         return input
 
+
+class AudioQualityFilter(BaseFilter):
+    """
+    Drops the captions whose audio is mostly silent, clipped or noisy and trims their leading and
+    trailing silence before the segments are written. The frame energies of the decoded audio
+    (input['audio']) are computed once per video and the statistics of all the captions are taken
+    from them in one pass, see crawler.audio_stats.segment_quality. They are kept as "audio_*"
+    columns of CaptionBatch.extra, so they end up in the segment metadata, and the number of
+    dropped captions per reason in input['stats']['audio_quality']
+
+    """
+    def __init__(self, max_silence_ratio=0.8, max_clipping_ratio=0.01, min_snr_db=6.0, min_duration=1.0,
+                 trim_silence=True, padding_sec=0.2, silence_threshold=SILENCE_THRESHOLD):
+        """
+        :param min_duration: minimum duration in seconds left after trimming
+        :param padding_sec: silence kept before and after the speech of a trimmed caption
+        """
+        super(AudioQualityFilter, self).__init__()
+        self.max_silence_ratio = max_silence_ratio
+        self.max_clipping_ratio = max_clipping_ratio
+        self.min_snr_db = min_snr_db
+        self.min_duration = min_duration
+        self.trim_silence = trim_silence
+        self.padding_sec = padding_sec
+        self.silence_threshold = silence_threshold
+
+    def __call__(self, input):
+        subtitles = input['subtitles']
+        rows = subtitles.kept_indices()
+        # without audio, e.g. in the subtitle benchmarks, or nothing to check: the audio is not decoded
+        if 'audio' not in input or len(rows) == 0:
+            return input
+        audio = input['audio']
+        energy, clipped = _frame_energy(input)
+        quality = segment_quality(energy, clipped, subtitles.start[rows], subtitles.end[rows], FRAME_SEC,
+                                  max(int(audio.sample_rate * FRAME_SEC), 1), self.silence_threshold)
+        for name, values in quality.items():
+            column = subtitles.extra.setdefault("audio_" + name, np.zeros(len(subtitles.keep)))
+            column[rows] = np.round(values, 4)
+
+        start, end = subtitles.start[rows], subtitles.end[rows]
+        if self.trim_silence:
+            start = start + np.maximum(quality["leading_silence"] - self.padding_sec, 0)
+            end = end - np.maximum(quality["trailing_silence"] - self.padding_sec, 0)
+        reasons = [("silence", quality["silence_ratio"] > self.max_silence_ratio),
+                   ("clipping", quality["clipping_ratio"] > self.max_clipping_ratio),
+                   ("snr", quality["snr_db"] < self.min_snr_db),
+                   ("duration", end - start < self.min_duration)]
+        stats = input.setdefault('stats', {}).setdefault('audio_quality', {})
+        bad = np.zeros(len(rows), dtype=bool)
+        for reason, mask in reasons:
+            # every dropped caption is counted once, for the first failed check
+            stats[reason] = stats.get(reason, 0) + int(np.count_nonzero(mask & ~bad))
+            bad |= mask
+        subtitles.keep[rows[bad]] = False
+        subtitles.start[rows[~bad]] = start[~bad]
+        subtitles.end[rows[~bad]] = end[~bad]
+        return input
+
+
+class FusedCaptionFilter(BaseFilter):
+    """
+    Consecutive stateless filters (see BaseFilter.caption_op) run as one pass over the captions:
+    every caption goes through the text filters and maps in order and stops at the first filter
+    rejecting it. The text filters and maps do not change the timings, so the duration checks
+    run first on the whole duration column. Built by crawler.pipeline_config
+
+    """
+    def __init__(self, components):
+        super(FusedCaptionFilter, self).__init__()
+        self.components = components
+        ops = [c.caption_op() for c in components]
+        self.duration_ops = [func for kind, func in ops if kind == "keep_duration"]
+        self.text_ops = [(kind == "map", func) for kind, func in ops if kind != "keep_duration"]
+        self.name = "+".join(type(c).__name__ for c in components)
+
+    def _process(self, text):
+        for is_map, func in self.text_ops:
+            if is_map:
+                text = func(text)
+            elif not func(text):
+                return None
+        return text
+
+    def __call__(self, input):
+        subtitles = input['subtitles']
+        for func in self.duration_ops:
+            subtitles.filter(func(subtitles.duration))
+        if self.text_ops:
+            subtitles.process_texts(self._process)
+        return input
+
+    def stream(self, captions, input):
+        for c in captions:
+            if not all(func(caption_duration(c)) for func in self.duration_ops):
+                continue
+            text = self._process(c.text)
+            if text is not None:
+                yield c._replace(text=text)
+
+
 if __name__ == "__main__":
-    from crawler.youtube_helpers import load_all_subtitles
-    subtitles = load_all_subtitles("./../video/2oNoBDMGGioHow_to_Make_a_Picnic_Table_-_Plans_and_Instructions.en.vtt")
+    import argparse
+    from crawler.pipeline_config import build_pipelines
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("subtitle_file", type=str)
+    parser.add_argument("--pipeline", type=str, default=None, help="Pipeline config, crawler/pipelines/default.json by default")
+
+    opt = parser.parse_args()
+    subtitles = CaptionBatch.from_file(opt.subtitle_file)
     print(len(subtitles))
-    input = {
-        'subtitles' : subtitles,
-        'video_file' : ''
-    }
-    good_chars_regexp = re.compile(r"^[A-Za-z0-9\,\.\-\?\"\'\’\!\“\s\;\:\“\”\–\‘\’\’\/\\]+$", re.IGNORECASE)
-    pipeline = Pipeline([
-        OverlappingSubtitlesRemover(),
-        SubtitleCaptionTextFilter(),
-        CaptionNormalizer(),
-        CaptionRegexMatcher(good_chars_regexp),
-        CaptionLengthFilter(min_length=5),
-        CaptionLeaveOnlyAlphaNumCharacters(),
-        SubtitleMerger(max_len_merged_sec=10),
-        CaptionDurationFilter(min_length=1, max_length=20.0)
-    ])
-    processed_subtitles = pipeline(input)
+    processed_subtitles = build_pipelines(opt.pipeline)["pipeline"]({'subtitles': subtitles, 'video_file': ''})
     print(len(processed_subtitles['subtitles']))
-    for s in processed_subtitles['subtitles']:
-        print(s["original_phrase"])
\ No newline at end of file
+    for s in processed_subtitles['subtitles'].to_dicts():
+        print(s["original_phrase"])
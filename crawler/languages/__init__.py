@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Language specific settings of the crawler. Every module of this package (en.py, de.py, ...)
+defines the letters kept in the transcripts besides a-z, the numbers-to-words conversion, the
+word for %, the Unicode normalization form and the language code of the ASR check. The search keywords of a
+language are in crawler/keywords/<code>.txt and its subtitles are downloaded as <video>.<code>.vtt.
+"""
+import os
+import re
+import glob
+import functools
+import importlib
+from crawler.normalizer import TextNormalizer
+
+SUPPORTED = ("en", "de", "es", "fr")
+KEYWORDS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "keywords")
+# besides the letters, characters allowed in a caption before the non-letters are removed
+PUNCTUATION = r"0-9\,\.\-\?\"\'\’\!\“\s\;\:\“\”\–\‘\’\’\/\\"
+
+
+def get_language(code):
+    if code not in SUPPORTED:
+        raise ValueError("Unsupported language {}, one of {}".format(code, ", ".join(SUPPORTED)))
+    return importlib.import_module("crawler.languages." + code)
+
+
+@functools.lru_cache(maxsize=None)
+def get_normalizer(code):
+    language = get_language(code)
+    return TextNormalizer(number_to_words=language.number_to_words, letters="a-z" + language.LETTERS + "'",
+                          unicode_form=language.UNICODE_FORM, percent=language.PERCENT)
+
+
+@functools.lru_cache(maxsize=None)
+def caption_regexp(code):
+    """
+    Captions made of other characters are dropped by CaptionRegexMatcher
+
+    """
+    letters = get_language(code).LETTERS
+    return re.compile(r"^[A-Za-z" + letters + letters.upper() + PUNCTUATION + r"]+$", re.IGNORECASE)
+
+
+def keywords_file(code):
+    get_language(code)
+    return os.path.join(KEYWORDS_DIR, "{}.txt".format(code))
+
+
+def subtitle_file(video_file, code, ext="m4a"):
+    return video_file.replace(f'.{ext}', f'.{code}.vtt')
+
+
+def detect_language(video_file, ext="m4a"):
+    """
+    Language of the subtitles downloaded with the video, the first supported one if there are
+    several, None if there are none
+
+    """
+    found = set(os.path.basename(f).rsplit(".", 2)[-2]
+                for f in glob.glob(glob.escape(video_file[:-len(ext) - 1]) + ".*.vtt"))
+    return next((code for code in SUPPORTED if code in found), None)
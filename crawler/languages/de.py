@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+ASR_LANGUAGE = "de-DE"
+LETTERS = "äöüß"
+UNICODE_FORM = "NFC"
+PERCENT = "prozent"
+
+ONES = ["null", "eins", "zwei", "drei", "vier", "fünf", "sechs", "sieben", "acht", "neun", "zehn", "elf", "zwölf",
+        "dreizehn", "vierzehn", "fünfzehn", "sechzehn", "siebzehn", "achtzehn", "neunzehn"]
+TENS = {2: "zwanzig", 3: "dreißig", 4: "vierzig", 5: "fünfzig", 6: "sechzig", 7: "siebzig", 8: "achtzig",
+        9: "neunzig"}
+
+
+def number_to_words(num):
+    assert 0 <= num < 1000
+    if num < 20:
+        return ONES[num]
+    if num < 100:
+        tens, ones = divmod(num, 10)
+        if ones == 0:
+            return TENS[tens]
+        return ("ein" if ones == 1 else ONES[ones]) + "und" + TENS[tens]
+    hundreds, rest = divmod(num, 100)
+    return ("" if hundreds == 1 else ONES[hundreds]) + "hundert" + (number_to_words(rest) if rest else "")
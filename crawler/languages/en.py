@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+from crawler.normalizer import int_to_en as number_to_words
+
+ASR_LANGUAGE = "en-US"
+# letters besides a-z, accented letters are decomposed and their accents removed
+LETTERS = ""
+UNICODE_FORM = "NFKD"
+PERCENT = "percent"
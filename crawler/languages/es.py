@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+ASR_LANGUAGE = "es-ES"
+LETTERS = "áéíóúñü"
+UNICODE_FORM = "NFC"
+PERCENT = "por ciento"
+
+ONES = ["cero", "uno", "dos", "tres", "cuatro", "cinco", "seis", "siete", "ocho", "nueve", "diez", "once", "doce",
+        "trece", "catorce", "quince", "dieciséis", "diecisiete", "dieciocho", "diecinueve", "veinte", "veintiuno",
+        "veintidós", "veintitrés", "veinticuatro", "veinticinco", "veintiséis", "veintisiete", "veintiocho",
+        "veintinueve"]
+TENS = {3: "treinta", 4: "cuarenta", 5: "cincuenta", 6: "sesenta", 7: "setenta", 8: "ochenta", 9: "noventa"}
+HUNDREDS = {1: "ciento", 2: "doscientos", 3: "trescientos", 4: "cuatrocientos", 5: "quinientos", 6: "seiscientos",
+            7: "setecientos", 8: "ochocientos", 9: "novecientos"}
+
+
+def number_to_words(num):
+    assert 0 <= num < 1000
+    if num < 30:
+        return ONES[num]
+    if num < 100:
+        tens, ones = divmod(num, 10)
+        return TENS[tens] + (" y " + ONES[ones] if ones else "")
+    if num == 100:
+        return "cien"
+    hundreds, rest = divmod(num, 100)
+    return HUNDREDS[hundreds] + (" " + number_to_words(rest) if rest else "")
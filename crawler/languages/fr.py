@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+ASR_LANGUAGE = "fr-FR"
+LETTERS = "àâæçéèêëîïôœùûüÿ"
+UNICODE_FORM = "NFC"
+PERCENT = "pour cent"
+
+ONES = ["zéro", "un", "deux", "trois", "quatre", "cinq", "six", "sept", "huit", "neuf", "dix", "onze", "douze",
+        "treize", "quatorze", "quinze", "seize"]
+TENS = {2: "vingt", 3: "trente", 4: "quarante", 5: "cinquante", 6: "soixante"}
+
+
+def number_to_words(num):
+    assert 0 <= num < 1000
+    if num < 17:
+        return ONES[num]
+    if num < 20:
+        return "dix-" + ONES[num - 10]
+    if num < 70:
+        tens, ones = divmod(num, 10)
+        if ones == 0:
+            return TENS[tens]
+        return TENS[tens] + (" et un" if ones == 1 else "-" + ONES[ones])
+    if num < 80:
+        # 70 to 79 count on from sixty
+        return "soixante et onze" if num == 71 else "soixante-" + number_to_words(num - 60)
+    if num < 100:
+        return "quatre-vingts" if num == 80 else "quatre-vingt-" + number_to_words(num - 80)
+    hundreds, rest = divmod(num, 100)
+    prefix = "cent" if hundreds == 1 else ONES[hundreds] + " cent"
+    if rest == 0:
+        return prefix + ("s" if hundreds > 1 else "")
+    return prefix + " " + number_to_words(rest)
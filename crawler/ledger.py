@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Job ledger of the processed videos, an SQLite database in WAL mode shared by all the workers.
+
+A video goes through pending -> parsed -> extracting -> done, or failed with the reason. The
+summary record of process_video is stored with the final state, and the keys of the written
+segments are recorded while they are extracted. A restarted crawler skips the done videos and
+the already written segments of an interrupted video without looking at the output files.
+
+The ledger is kept next to the segments, in <target_dir>/jobs.sqlite unless another file is given.
+
+    python -m crawler.ledger <target_dir>/jobs.sqlite [--state failed]
+"""
+import os
+import json
+import time
+import argparse
+import termcolor
+from crawler.db import connect
+
+LEDGER_FILENAME = "jobs.sqlite"
+
+
+class STATE:
+    PENDING = "pending"
+    PARSED = "parsed"
+    EXTRACTING = "extracting"
+    DONE = "done"
+    FAILED = "failed"
+
+
+def default_ledger(target_dir):
+    return os.path.join(target_dir, LEDGER_FILENAME)
+
+
+class JobLedger:
+    def __init__(self, filename):
+        # the target directory of a new corpus is only created by its writer
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.conn = connect(filename)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS jobs (video_file TEXT PRIMARY KEY, state TEXT, reason TEXT, "
+                          "num_subtitles INTEGER, num_segments INTEGER, num_written INTEGER, "
+                          "started REAL, updated REAL, elapsed_sec REAL, info TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS segments (key TEXT PRIMARY KEY, video_file TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS segments_video ON segments (video_file)")
+
+    @staticmethod
+    def job_id(video_file):
+        return os.path.abspath(video_file)
+
+    def add(self, video_file):
+        self.conn.execute("INSERT OR IGNORE INTO jobs (video_file, state, updated) VALUES (?, ?, ?)",
+                          (self.job_id(video_file), STATE.PENDING, time.time()))
+
+    def state(self, video_file):
+        row = self.conn.execute("SELECT state FROM jobs WHERE video_file = ?", (self.job_id(video_file),)).fetchone()
+        return row[0] if row is not None else None
+
+    def is_done(self, video_file):
+        return self.state(video_file) == STATE.DONE
+
+    def start(self, video_file):
+        now = time.time()
+        self.conn.execute("INSERT INTO jobs (video_file, state, reason, started, updated) VALUES (?, ?, NULL, ?, ?) "
+                          "ON CONFLICT (video_file) DO UPDATE SET state = excluded.state, reason = NULL, "
+                          "started = excluded.started, updated = excluded.updated",
+                          (self.job_id(video_file), STATE.PENDING, now, now))
+
+    def update(self, video_file, state, **fields):
+        """
+        :param fields: num_subtitles, num_segments, num_written or elapsed_sec
+        """
+        columns = ["state = ?", "updated = ?"] + ["{} = ?".format(k) for k in fields]
+        self.conn.execute("UPDATE jobs SET {} WHERE video_file = ?".format(", ".join(columns)),
+                          [state, time.time()] + list(fields.values()) + [self.job_id(video_file)])
+
+    def finish(self, video_file, info, reason=None):
+        """
+        Records the summary of process_video, failed if reason is given and done otherwise
+
+        """
+        self.conn.execute("UPDATE jobs SET state = ?, reason = ?, num_written = ?, elapsed_sec = ?, updated = ?, "
+                          "info = ? WHERE video_file = ?",
+                          (STATE.FAILED if reason else STATE.DONE, reason, info.get("num_written"),
+                           info.get("elapsed_sec"), time.time(), json.dumps(info), self.job_id(video_file)))
+
+    def segment_keys(self, video_file):
+        return set(k for k, in self.conn.execute("SELECT key FROM segments WHERE video_file = ?",
+                                                 (self.job_id(video_file),)))
+
+    def add_segments(self, video_file, keys):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR REPLACE INTO segments VALUES (?, ?)",
+                                  [(key, self.job_id(video_file)) for key in keys])
+
+    def remove_segments(self, keys):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM segments WHERE key = ?", [(key,) for key in keys])
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def iter_jobs(self, state=None):
+        query = "SELECT video_file, state, reason, num_subtitles, num_segments, num_written, elapsed_sec FROM jobs"
+        rows = self.conn.execute(query + " WHERE state = ?", (state,)) if state else self.conn.execute(query)
+        for row in rows:
+            yield dict(zip(("video_file", "state", "reason", "num_subtitles", "num_segments", "num_written",
+                            "elapsed_sec"), row))
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ledger", type=str)
+    parser.add_argument("--state", type=str, default=None, help="List the videos in this state")
+
+    opt = parser.parse_args()
+    ledger = JobLedger(opt.ledger)
+    if opt.state:
+        for job in ledger.iter_jobs(opt.state):
+            print(json.dumps(job))
+    for state, count in sorted(ledger.counts().items()):
+        termcolor.cprint("{:>12} {}".format(state, count), color="red" if state == STATE.FAILED else "cyan")
+    ledger.close()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Training manifest ("wav,txt" per line) of a wav/txt/metadata tree.
+
+The audio statistics of every segment are computed by a pool of processes and kept in an SQLite
+cache keyed by path and modification time, <target_dir>/audio_stats.sqlite by default. An
+interrupted dump resumes from the cache and regenerating a manifest only reads the new segments.
+
+    python -m crawler.manifest <dir_for_resulting_samples> manifest.csv --processes 16
+"""
+import os
+import io
+import glob
+import argparse
+import termcolor
+from multiprocessing import Pool
+from tqdm import tqdm
+from crawler.db import connect
+from crawler.audio_stats import file_stats
+
+STATS_FILENAME = "audio_stats.sqlite"
+MIN_SUM_AMPLITUTDE = 1e-2
+STATS_COLUMNS = ("sample_rate", "num_samples", "duration", "rms", "peak", "silence_ratio", "phrase_len")
+
+
+class StatsCache:
+    """
+    Audio statistics and transcript length of a segment, valid while neither the wav nor the txt
+    file is modified
+
+    """
+    def __init__(self, filename):
+        self.conn = connect(filename)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stats (path TEXT PRIMARY KEY, mtime REAL, txt_mtime REAL, "
+                          "sample_rate INTEGER, num_samples INTEGER, duration REAL, rms REAL, peak REAL, "
+                          "silence_ratio REAL, phrase_len INTEGER)")
+
+    def get(self, path, mtime, txt_mtime):
+        row = self.conn.execute("SELECT {} FROM stats WHERE path = ? AND mtime = ? AND txt_mtime = ?".format(
+            ", ".join(STATS_COLUMNS)), (path, mtime, txt_mtime)).fetchone()
+        return dict(zip(STATS_COLUMNS, row)) if row is not None else None
+
+    def put_many(self, rows):
+        """
+        :param rows: (path, mtime, txt_mtime, stats dict)
+        """
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  [(path, mtime, txt_mtime) + tuple(stats[c] for c in STATS_COLUMNS)
+                                   for path, mtime, txt_mtime, stats in rows])
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_segments(target_dir):
+    """
+    wav and txt files of the segments of the tree having all of wav, txt and metadata files
+
+    """
+    for wav_file in sorted(glob.glob(os.path.join(target_dir, "wav", "*", "*.wav"))):
+        prefix, filename = os.path.split(wav_file)
+        prefix = os.path.basename(prefix)
+        key = os.path.splitext(filename)[0]
+        txt_file = os.path.join(target_dir, "txt", prefix, key + ".txt")
+        if os.path.exists(txt_file) and os.path.exists(os.path.join(target_dir, "metadata", prefix, key + ".json")):
+            yield wav_file, txt_file
+
+
+def _compute_stats(item):
+    wav_file, txt_file, mtime, txt_mtime = item
+    try:
+        with io.open(txt_file, encoding='utf-8') as f:
+            phrase_len = len(f.read().strip())
+        stats = file_stats(wav_file)
+    except (OSError, ValueError, EOFError) as e:
+        # unreadable or truncated segment, skipped
+        return item, None, str(e)
+    stats["phrase_len"] = phrase_len
+    return item, stats, None
+
+
+def is_valid(stats, sample_rate=16000, min_phrase_len=10):
+    return (stats["phrase_len"] >= min_phrase_len and stats["sample_rate"] == sample_rate
+            and stats["num_samples"] >= sample_rate // 2 and stats["peak"] * 32768 >= MIN_SUM_AMPLITUTDE)
+
+
+def dump_manifest(target_dir, filename, cache_file=None, processes=None, sample_rate=16000, min_phrase_len=10,
+                  chunksize=64, commit_every=1000):
+    """
+    Writes the "wav,txt" lines of the valid segments of target_dir: transcript of at least
+    min_phrase_len characters, sample_rate audio of at least half a second which is not all zeros.
+    Returns the total duration in seconds
+
+    """
+    cache = StatsCache(cache_file or os.path.join(target_dir, STATS_FILENAME))
+    segments = []
+    missing = []
+    for wav_file, txt_file in tqdm(iter_segments(target_dir), desc="listing"):
+        try:
+            mtime, txt_mtime = os.stat(wav_file).st_mtime, os.stat(txt_file).st_mtime
+        except OSError:
+            continue
+        stats = cache.get(wav_file, mtime, txt_mtime)
+        segments.append([wav_file, txt_file, stats])
+        if stats is None:
+            missing.append((wav_file, txt_file, mtime, txt_mtime, len(segments) - 1))
+
+    termcolor.cprint("{} segments, {} cached".format(len(segments), len(segments) - len(missing)), color="yellow")
+    if missing:
+        rows = []
+        with Pool(processes) as pool:
+            for (wav_file, txt_file, mtime, txt_mtime), stats, error in tqdm(
+                    pool.imap_unordered(_compute_stats, [m[:4] for m in missing], chunksize=chunksize),
+                    total=len(missing), desc="stats"):
+                if error is not None:
+                    termcolor.cprint("Cannot read {}: {}".format(wav_file, error), color="red")
+                    continue
+                rows.append((wav_file, mtime, txt_mtime, stats))
+                if len(rows) >= commit_every:
+                    cache.put_many(rows)
+                    rows = []
+        cache.put_many(rows)
+        for wav_file, txt_file, mtime, txt_mtime, i in missing:
+            segments[i][2] = cache.get(wav_file, mtime, txt_mtime)
+    cache.close()
+
+    total_length = 0.0
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        for wav_file, txt_file, stats in segments:
+            if stats is None or not is_valid(stats, sample_rate, min_phrase_len):
+                continue
+            f.write("{},{}\n".format(wav_file, txt_file))
+            total_length += stats["duration"]
+    os.replace(tmp_filename, filename)
+    return total_length
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_dir", type=str)
+    parser.add_argument("manifest", type=str)
+    parser.add_argument("--cache", type=str, default=None,
+                        help="Audio statistics cache, <target_dir>/{} by default".format(STATS_FILENAME))
+    parser.add_argument("--processes", type=int, default=None)
+
+    opt = parser.parse_args()
+    total_length = dump_manifest(opt.target_dir, opt.manifest, cache_file=opt.cache, processes=opt.processes)
+    print("total duration: {:.2f}h".format(total_length / 60 / 60))
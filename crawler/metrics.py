@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Counters aggregated over the per-video records returned by process_video, exported in the
+Prometheus text format or as JSON.
+
+Every video adds its filter timings (wall and CPU seconds), the captions entering and leaving
+every filter, the written segments and the bytes and seconds of audio they contain.
+"""
+import os
+import json
+import threading
+
+PREFIX = "crawler_"
+HELP = {
+    "videos_total": "Processed videos by result",
+    "captions_total": "Captions parsed from the subtitle files",
+    "segments_written_total": "Segments written to the corpus",
+    "segments_duplicate_total": "Segments skipped as duplicates",
+    "segments_low_quality_total": "Segments dropped by the audio quality checks",
+    "segments_boundaries_total": "Segments with both boundaries at a pause (snapped) or not matching the speech",
+    "audio_bytes_total": "Bytes of PCM audio written",
+    "audio_seconds_total": "Seconds of audio written",
+    "video_seconds_total": "Wall time spent processing videos",
+    "filter_seconds_total": "Wall time spent in a filter",
+    "filter_cpu_seconds_total": "CPU time of the process spent in a filter",
+    "filter_captions_in_total": "Captions entering a filter",
+    "filter_captions_out_total": "Captions kept by a filter",
+}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {name: {sorted label items: value}}
+        self.counters = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe_video(self, info):
+        """
+        Adds the record of a processed video (the dict returned by process_video)
+
+        """
+        self.inc("videos_total", result=str(info.get("result")))
+        self.inc("captions_total", info.get("num_subtitles", 0))
+        self.inc("segments_written_total", info.get("num_written", 0))
+        self.inc("segments_duplicate_total", info.get("num_duplicates", 0))
+        self.inc("audio_bytes_total", info.get("audio_bytes", 0))
+        self.inc("audio_seconds_total", info.get("audio_sec", 0.0))
+        self.inc("video_seconds_total", info.get("elapsed_sec", 0.0))
+        for reason, count in info.get("stats", {}).get("audio_quality", {}).items():
+            self.inc("segments_low_quality_total", count, reason=reason)
+        for kind, count in info.get("stats", {}).get("boundaries", {}).items():
+            self.inc("segments_boundaries_total", count, kind=kind)
+        for f in info.get("stats", {}).get("filters", []):
+            self.inc("filter_seconds_total", f["wall_sec"], filter=f["name"])
+            self.inc("filter_cpu_seconds_total", f["cpu_sec"], filter=f["name"])
+            if f.get("captions_in") is not None:
+                self.inc("filter_captions_in_total", f["captions_in"], filter=f["name"])
+                self.inc("filter_captions_out_total", f["captions_out"], filter=f["name"])
+
+    def to_json(self):
+        with self.lock:
+            return {name: [{"labels": dict(key), "value": value} for key, value in sorted(series.items())]
+                    for name, series in sorted(self.counters.items())}
+
+    def to_prometheus(self):
+        lines = []
+        for name, series in self.to_json().items():
+            if name in HELP:
+                lines.append("# HELP {}{} {}".format(PREFIX, name, HELP[name]))
+            lines.append("# TYPE {}{} counter".format(PREFIX, name))
+            for s in series:
+                labels = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                                  for k, v in sorted(s["labels"].items()))
+                lines.append("{}{}{} {}".format(PREFIX, name, "{" + labels + "}" if labels else "", s["value"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        """
+        Replaces filename with the current values, JSON for a .json file and the Prometheus text
+        format otherwise (e.g. for the textfile collector of node_exporter)
+
+        """
+        content = json.dumps(self.to_json(), indent=2) if filename.endswith(".json") else self.to_prometheus()
+        tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmp_filename, "w") as f:
+            f.write(content)
+        os.replace(tmp_filename, filename)
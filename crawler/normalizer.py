@@ -0,0 +1,121 @@
+import re
+import contextlib
+import unicodedata
+
+
+def int_to_en(num):
+    d = {0: 'zero', 1: 'one', 2: 'two', 3: 'three', 4: 'four', 5: 'five',
+         6: 'six', 7: 'seven', 8: 'eight', 9: 'nine', 10: 'ten',
+         11: 'eleven', 12: 'twelve', 13: 'thirteen', 14: 'fourteen',
+         15: 'fifteen', 16: 'sixteen', 17: 'seventeen', 18: 'eighteen',
+         19: 'nineteen', 20: 'twenty',
+         30: 'thirty', 40: 'forty', 50: 'fifty', 60: 'sixty',
+         70: 'seventy', 80: 'eighty', 90: 'ninety'}
+    k = 1000
+    m = k * 1000
+    b = m * 1000
+    t = b * 1000
+
+    assert (0 <= num)
+
+    if (num < 20):
+        return d[num]
+
+    if (num < 100):
+        if num % 10 == 0:
+            return d[num]
+        else:
+            return d[num // 10 * 10] + ' ' + d[num % 10]
+    if (num < k):
+        if num % 100 == 0:
+            return d[num // 100] + ' hundred'
+        else:
+            return d[num // 100] + ' hundred and ' + int_to_en(num % 100)
+
+
+class TextNormalizer:
+    """
+    Precompiled caption normalizer shared by CaptionNormalizer and CaptionLeaveOnlyAlphaNumCharacters.
+    The single character replacements are done by one str.translate, the markup that can be removed
+    in one left to right scan (dashes, &nbsp;, cue tags, speaker names) by one alternation regex, and
+    the greedy bracket patterns only run when the caption contains the opening character.
+
+    Numbers are converted only when they are a whole whitespace separated token of at most 3 digits.
+    The former normalize_numbers replaced every occurrence of the digits in the caption
+    (" 5 25 " became " five 2five ") and skipped a number directly following another one.
+
+    """
+    def __init__(self, number_to_words=int_to_en, max_number_digits=3, letters="a-z'", unicode_form='NFKD',
+                 percent="percent"):
+        """
+        :param letters: regexp character class of the characters kept by leave_alphanum (ignoring case)
+        :param unicode_form: normalization of non ASCII captions, NFKD removes the accents with
+                             the default letters, NFC keeps the accented letters
+        :param percent: word replacing %
+        """
+        self.number_to_words = number_to_words
+        self.unicode_form = unicode_form
+        self.percent = " {} ".format(percent)
+        self.translation = str.maketrans({',': ' ', '.': ' ', '’': '\'', '‘': '\'', 'ʻ': '\'', '´': '\''})
+        self.hyphenated_word = re.compile(r"([a-z])\-([a-z])", re.IGNORECASE)
+        # the alternatives never overlap in a way that makes the order of the former sequential
+        # passes matter, "—- " is matched as a whole as the "- " and "— " replacements did in turn
+        self.markup = re.compile(r"—?- |— |&nbsp;|<[^<]+?>|[A-Z]\w+\:")
+        self.markup_chars = set("-—&<:")
+        self.greedy_brackets = [('[', re.compile(r'\[.*\]')),
+                                ('(', re.compile(r'\(.*\)')),
+                                ('*', re.compile(r'\*.*\*'))]
+        self.digit = re.compile(r'\d')
+        self.numbers = re.compile(r'(?<=\s)\d{1,%d}(?=\s)' % max_number_digits)
+        self.not_allowed = re.compile(r"[^%s]+" % letters, re.IGNORECASE)
+        self.ascii_not_allowed = str.maketrans({chr(c): ' ' for c in range(128)
+                                                if self.not_allowed.match(chr(c))})
+        self.known = None
+
+    @contextlib.contextmanager
+    def known_texts(self, texts, normalized):
+        """
+        Within the context, the texts normalized earlier (e.g. cached by crawler.reprocess) are
+        looked up instead of normalized again
+
+        """
+        self.known = dict(zip(texts, normalized))
+        try:
+            yield self
+        finally:
+            self.known = None
+
+    def _replace_number(self, m):
+        return self.number_to_words(int(m.group(0)))
+
+    def normalize(self, input_str):
+        if self.known is not None:
+            known = self.known.get(input_str)
+            if known is not None:
+                return known
+        input_str = (' ' + input_str + ' ').translate(self.translation)
+        if '-' in input_str and self.hyphenated_word.search(input_str):
+            input_str = self.hyphenated_word.sub(r"\1\2", input_str)
+        if not self.markup_chars.isdisjoint(input_str):
+            input_str = self.markup.sub(' ', input_str)
+        for opening, pattern in self.greedy_brackets:
+            if opening in input_str:
+                input_str = pattern.sub(' ', input_str)
+        if not input_str.isascii():
+            input_str = unicodedata.normalize(self.unicode_form, input_str)
+        if '%' in input_str:
+            input_str = input_str.replace('%', self.percent)
+        if self.digit.search(input_str):
+            input_str = self.numbers.sub(self._replace_number, input_str)
+        return input_str.strip()
+
+    def leave_alphanum(self, input_string):
+        if input_string.isascii():
+            return " ".join(input_string.lower().translate(self.ascii_not_allowed).split()).upper()
+        return self.not_allowed.sub(' ', input_string.lower()).upper().strip()
+
+    def __call__(self, input_str):
+        return self.leave_alphanum(self.normalize(input_str))
+
+
+default_normalizer = TextNormalizer()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Filter pipelines defined in JSON (or YAML, with PyYAML installed) config files, by default
+crawler/pipelines/default.json:
+
+    {
+      "pipeline": [{"filter": "OverlappingSubtitlesRemover"}, {"filter": "CaptionLengthFilter", "min_length": 5}, ...],
+      "audio_pipeline": [{"filter": "AudioQualityFilter"}]
+    }
+
+Every stage names a filter of crawler/filters.py and the keyword arguments of its constructor.
+The filters depending on the language (normalizers, allowed characters, ASR check) get the
+language the pipelines are built for unless the stage sets it.
+"pipeline" runs on the captions, "audio_pipeline" on the kept captions with the decoded audio.
+Runs of consecutive stateless filters are compiled into one FusedCaptionFilter pass, the
+other stages keep their order.
+"""
+import os
+import io
+import json
+import inspect
+import functools
+from crawler import filters
+
+PIPELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipelines")
+DEFAULT_CONFIG = os.path.join(PIPELINES_DIR, "default.json")
+
+
+def load_config(filename=None):
+    filename = filename or DEFAULT_CONFIG
+    with io.open(filename, encoding="utf-8") as f:
+        if filename.endswith((".yaml", ".yml")):
+            # optional dependency, only needed for YAML configs
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def build_filter(stage, lang="en"):
+    params = dict(stage)
+    name = params.pop("filter")
+    cls = getattr(filters, name, None)
+    if not isinstance(cls, type) or not issubclass(cls, filters.BaseFilter):
+        raise ValueError("Unknown filter {}".format(name))
+    if "language" in inspect.signature(cls.__init__).parameters:
+        params.setdefault("language", lang)
+    return cls(**params)
+
+
+def plan(components):
+    """
+    Replaces every run of at least two consecutive stateless filters by a FusedCaptionFilter
+
+    """
+    planned = []
+    run = []
+    for component in components + [None]:
+        if component is not None and component.caption_op() is not None:
+            run.append(component)
+            continue
+        if len(run) > 1:
+            planned.append(filters.FusedCaptionFilter(run))
+        else:
+            planned.extend(run)
+        run = []
+        if component is not None:
+            planned.append(component)
+    return planned
+
+
+@functools.lru_cache(maxsize=None)
+def build_pipelines(filename=None, fuse=True, lang="en"):
+    """
+    Returns {"pipeline": Pipeline, "streaming_pipeline": StreamingPipeline, "audio_pipeline": Pipeline}
+    of a config file for a language, built once per process
+
+    """
+    config = load_config(filename)
+    components = [build_filter(stage, lang) for stage in config["pipeline"]]
+    if fuse:
+        components = plan(components)
+    return {"pipeline": filters.Pipeline(components),
+            "streaming_pipeline": filters.StreamingPipeline(components),
+            "audio_pipeline": filters.Pipeline([build_filter(stage, lang) for stage in config.get("audio_pipeline", [])])}
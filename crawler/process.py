@@ -1,48 +1,87 @@
 # -*- coding: utf-8 -*-
-import sys
 import os
 import json
 import io
 import termcolor
-import re
-from tqdm import tqdm
-from crawler.youtube_helpers import get_hash, getsize
-from crawler.utils import extract_audio_part_segment
-from crawler.filters import Pipeline, OverlappingSubtitlesRemover, SubtitleCaptionTextFilter, SubtitleMerger,\
-    CaptionLengthFilter, CaptionRegexMatcher, CaptionDurationFilter, CaptionLeaveOnlyAlphaNumCharacters, CaptionNormalizer
-from crawler.youtube_helpers import load_all_subtitles
+import time
+from crawler.youtube_helpers import segment_hash, format_ts, iter_vtt_cues
+from crawler.utils import DecodedAudio
+from crawler.pipeline_config import build_pipelines
+from crawler.captions import CaptionBatch
+from crawler.dedup import DedupIndex
+from crawler.writers import get_writer
+from crawler.metrics import Metrics
+from crawler.ledger import JobLedger, STATE, default_ledger
+from crawler.languages import SUPPORTED, detect_language, subtitle_file as language_subtitle_file
 
 
 class RESULT:
     GOOGLE_TEST_NOT_PASSED = 0
     OK = 1
-
-
-good_chars_regexp = re.compile(r"^[A-Za-z0-9\,\.\-\?\"\'\’\!\“\s\;\:\“\”\–\‘\’\’\/\\]+$", re.IGNORECASE)
-pipeline = Pipeline([
-    OverlappingSubtitlesRemover(),
-    SubtitleCaptionTextFilter(),
-    CaptionNormalizer(),
-    CaptionRegexMatcher(good_chars_regexp),
-    CaptionLengthFilter(min_length=5),
-    CaptionLeaveOnlyAlphaNumCharacters(),
-    SubtitleMerger(max_len_merged_sec=10),
-    CaptionDurationFilter(min_length=1, max_length=20.0)
-])
-
-
-if __name__ == "__main__":
-    video_file = sys.argv[1]
-    target_dir = sys.argv[2]
-
-    ext = "m4a"
-
-    subtitle_file = video_file.replace(f'.{ext}', '.en.vtt')
+    ERROR = 2
+    REJECTED = 3
+
+
+# crawler/pipelines/default.json, the consecutive stateless filters run as one fused pass
+pipeline = build_pipelines()["pipeline"]
+streaming_pipeline = build_pipelines()["streaming_pipeline"]
+audio_pipeline = build_pipelines()["audio_pipeline"]
+
+
+def process_video(video_file, target_dir, ext="m4a", log_filename=None, verbose=True, dedup_index=None,
+                  output_format="files", shard_size=1 << 30, streaming=False, ledger=True,
+                  segments_per_checkpoint=100, remove_source=False, pipeline_config=None, lang=None,
+                  partition_by_language=False, audio_memmap_dir=None):
+    """
+    Runs the filter pipeline on the subtitles of a downloaded video and writes the kept segments
+    to target_dir. The audio quality of the kept captions is checked before writing, see
+    AudioQualityFilter. Returns the summary dict that is also stored in the job ledger: result, caption
+    counts, per filter timings in stats["filters"], written segments and their audio bytes and
+    seconds, see crawler.metrics
+
+    :param log_filename: optional file the summary is appended to as a JSON line
+    :param dedup_index: optional DedupIndex file, segments duplicating an indexed one are not extracted
+    :param output_format: "files" or "shards", see crawler.writers
+    :param streaming: run streaming_pipeline on the cues while they are read from the subtitle file
+    :param ledger: JobLedger file, <target_dir>/jobs.sqlite if True, no ledger if None. Done videos are
+                   skipped and the segments written before an interruption are not extracted again
+    :param segments_per_checkpoint: written segments are flushed and recorded in the ledger in
+                                    batches of this size
+    :param remove_source: remove the video, subtitle and info files once the video is processed
+    :param pipeline_config: pipeline config file, see crawler.pipeline_config, the default pipelines if None
+    :param lang: language of the subtitles (<video>.<lang>.vtt) and of the pipelines, see crawler.languages.
+                 Detected from the downloaded subtitle files if None, English if there are none
+    :param partition_by_language: write the segments to target_dir/<lang>
+    :param audio_memmap_dir: decode the audio to a memory mapped file of this directory instead of
+                             into memory, see DecodedAudio
+    """
+    lang = lang or detect_language(video_file, ext) or "en"
+    subtitle_file = language_subtitle_file(video_file, lang, ext)
     info_file = video_file.replace(f'.{ext}', '.info.json')
-    overall_info = {"sub_file" : subtitle_file, "info" : info_file}
-    log_file = open("./log.json", "a+")
+    overall_info = {"sub_file" : subtitle_file, "info" : info_file, "lang": lang}
+    pipelines = build_pipelines(pipeline_config, lang=lang)
+    if ledger is True:
+        # the same ledger for all the languages of a partitioned corpus
+        ledger = default_ledger(target_dir)
+    if partition_by_language:
+        target_dir = os.path.join(target_dir, lang)
+    ledger = JobLedger(ledger) if ledger else None
+    if ledger is not None and ledger.is_done(video_file):
+        termcolor.cprint("Already processed {}".format(video_file), color="yellow")
+        ledger.close()
+        overall_info["result"] = RESULT.OK
+        overall_info["skipped"] = True
+        return overall_info
+    dedup = DedupIndex(dedup_index) if dedup_index else None
+    writer = None
+    written_keys = []
+    started = time.perf_counter()
+    if ledger is not None:
+        ledger.start(video_file)
 
     result = RESULT.OK
+    # not set when interrupted (KeyboardInterrupt, SystemExit), the video is then not recorded as done
+    finished = False
     try:
         if not os.path.exists(subtitle_file) or not os.path.exists(info_file):
             termcolor.cprint("Subtitle file or Info files do not exist. {}".format(video_file), color="red" )
@@ -52,62 +91,151 @@ if __name__ == "__main__":
         with open(info_file) as f:
             metadata = json.load(f)
         #youtube_link = metadata['webpage_url']
-        print("Parsing subtitle")
-        subtitles = load_all_subtitles(subtitle_file)
-        print(len(subtitles))
+        # decoded lazily on the first segment to cut, every segment is then sliced from memory
+        audio = DecodedAudio(video_file, memmap_dir=audio_memmap_dir)
         input = {
-            'subtitles': subtitles,
-            'video_file': video_file
+            'sub_file': subtitle_file,
+            'video_file': video_file,
+            'audio': audio
         }
-        overall_info["num_subtitles"] = len(subtitles)
-        termcolor.cprint("Got {} candidates".format(len(subtitles)), color="yellow")
-
-
-        filtered_input = pipeline(input)
-        filtered_subtitles = filtered_input["subtitles"]
+        if streaming:
+            with io.open(subtitle_file, encoding="utf-8-sig") as f:
+                input['subtitles'] = iter_vtt_cues(f)
+                filtered_input = pipelines["streaming_pipeline"](input)
+            overall_info["num_subtitles"] = filtered_input["stats"]["num_captions_read"]
+        else:
+            print("Parsing subtitle")
+            subtitles = CaptionBatch.from_file(subtitle_file)
+            print(len(subtitles))
+            input['subtitles'] = subtitles
+            overall_info["num_subtitles"] = len(subtitles)
+            termcolor.cprint("Got {} candidates".format(len(subtitles)), color="yellow")
+            filtered_input = pipelines["pipeline"](input)
+        filtered_input["subtitles"].freeze_timing()
+        if not filtered_input.get("rejected"):
+            filtered_input = pipelines["audio_pipeline"](filtered_input)
+        filtered_subtitles = filtered_input["subtitles"].to_dicts()
+        overall_info["stats"] = filtered_input.get("stats", {})
+        if filtered_input.get("rejected"):
+            result = RESULT.REJECTED
+            overall_info["rejected"] = filtered_input["rejected"]
+        if ledger is not None:
+            ledger.update(video_file, STATE.PARSED, num_subtitles=overall_info["num_subtitles"])
 
         termcolor.cprint("Writing {} samples".format(len(filtered_subtitles)), color="cyan")
-        for t in tqdm(filtered_subtitles):
-            hash = get_hash(subtitle_file + t["original_phrase"] + str(t["ts_start"]))
-            wav_file_dir = os.path.join(target_dir, "wav", hash[:2])
-            txt_file_dir = os.path.join(target_dir, "txt", hash[:2])
-            metadata_dir = os.path.join(target_dir, "metadata", hash[:2])
-
-            os.makedirs(wav_file_dir, exist_ok=True)
-            os.makedirs(txt_file_dir, exist_ok=True)
-            os.makedirs(metadata_dir, exist_ok=True)
-
-            target_wav_file = os.path.join(wav_file_dir, hash + ".wav")
-            target_txt_file = os.path.join(txt_file_dir, hash + ".txt")
-            target_metadata_file = os.path.join(metadata_dir, hash + ".json")
+        writer = get_writer(target_dir, output_format, max_shard_size=shard_size)
+        if ledger is not None:
+            ledger.update(video_file, STATE.EXTRACTING, num_segments=len(filtered_subtitles))
+            # written before an interruption, known without looking at the output files. Segments
+            # written before the ledger existed are still found by the writer
+            done_keys = ledger.segment_keys(video_file)
+            exists = lambda key: key in done_keys or writer.exists(key)
+        else:
+            exists = writer.exists
+        num_duplicates = 0
+        num_written = 0
+        audio_bytes = 0
+        audio_sec = 0.0
+        if verbose:
+            # tqdm is slow to import, the workers (verbose=False) do without it
+            from tqdm import tqdm
+            filtered_subtitles = tqdm(filtered_subtitles)
+        for t in filtered_subtitles:
+            # named after the caption timing, ts_start and ts_end may be trimmed by the audio filters
+            caption_start, caption_end = t["caption_start"], t["caption_end"]
+            hash = segment_hash(subtitle_file, t["original_phrase"], caption_start)
+            ts_start, ts_end = t["ts_start"], t["ts_end"]
+            if dedup is not None:
+                duplicate = dedup.find_duplicate(metadata["id"], caption_start, caption_end, t["original_phrase"])
+                if duplicate is not None and duplicate != hash:
+                    num_duplicates += 1
+                    continue
 
             text = t["original_phrase"]
             if len(text) == 0:
                 continue
-            if not os.path.exists(target_wav_file) or not os.path.exists(target_txt_file):
-                extract_audio_part_segment(video_file, t["ts_start"], t["ts_end"], target_wav_file)
-
-                with io.open(target_txt_file, "w", encoding='utf-8') as f:
-                    f.write(text)
-
-                with io.open(target_metadata_file, "w", encoding='utf-8') as f:
-                    t["ts_start"] = str(t["ts_start"])
-                    t["ts_end"] = str(t["ts_end"])
-                    t["metadata"] = metadata
-                    json.dump(t, f)
-
-                assert os.path.exists(target_txt_file) and os.path.exists(target_wav_file) \
-                       and getsize(target_wav_file) > 4 * 1024, "{} not created".format(target_wav_file)
+            if not exists(hash):
+                t["lang"] = lang
+                t["ts_start"] = format_ts(ts_start)
+                t["ts_end"] = format_ts(ts_end)
+                t["caption_start"] = format_ts(caption_start)
+                t["caption_end"] = format_ts(caption_end)
+                samples = audio.segment(ts_start, ts_end)
+                writer.write(hash, samples, audio.sample_rate, text, t, metadata)
+                num_written += 1
+                audio_bytes += samples.nbytes
+                audio_sec += len(samples) / audio.sample_rate
+                written_keys.append(hash)
+                if ledger is not None and len(written_keys) >= segments_per_checkpoint:
+                    writer.flush()
+                    ledger.add_segments(video_file, written_keys)
+                    written_keys = []
+            if dedup is not None:
+                dedup.add(hash, metadata["id"], caption_start, caption_end, text)
+        overall_info["num_duplicates"] = num_duplicates
+        overall_info["num_written"] = num_written
+        overall_info["audio_bytes"] = audio_bytes
+        overall_info["audio_sec"] = round(audio_sec, 3)
+        finished = True
     except Exception as e:
         termcolor.cprint(e, color="red")
+        result = RESULT.ERROR
+        overall_info["error"] = str(e)
+        finished = True
     finally:
         overall_info["result"] = result
-        log_file.write(json.dumps(overall_info) + "\n")
-        log_file.flush()
-        log_file.close()
-        #if os.path.exists(video_file):
-        #    os.remove(video_file)
-            #if os.path.exists(subtitle_file):
-            #    os.remove(subtitle_file)
-            #if os.path.exists(info_file):
-            #    os.remove(info_file)
+        overall_info["elapsed_sec"] = round(time.perf_counter() - started, 3)
+        # the segments are flushed before the video is recorded as done
+        if writer is not None:
+            writer.flush()
+        if ledger is not None:
+            if written_keys:
+                ledger.add_segments(video_file, written_keys)
+            if finished:
+                ledger.finish(video_file, overall_info, reason=overall_info.get("error"))
+            ledger.close()
+        if log_filename and finished:
+            with open(log_filename, "a+") as log_file:
+                log_file.write(json.dumps(overall_info) + "\n")
+        if dedup is not None:
+            dedup.close()
+        if remove_source and finished and result != RESULT.ERROR:
+            for filename in (video_file, subtitle_file, info_file):
+                if os.path.exists(filename):
+                    os.remove(filename)
+    return overall_info
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("video_file", type=str)
+    parser.add_argument("target_dir", type=str)
+    parser.add_argument("--dedup-index", type=str, default=None,
+                        help="Index of the extracted segments used to skip duplicates")
+    parser.add_argument("--output-format", choices=["files", "shards"], default="files")
+    parser.add_argument("--shard-size", type=int, default=1 << 30, help="Maximum shard size in bytes")
+    parser.add_argument("--metrics-file", type=str, default=None,
+                        help="Counters of the run, JSON for a .json file and Prometheus text format otherwise")
+    parser.add_argument("--streaming", action="store_true", help="Filter the captions while reading the subtitles")
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="Job ledger, <target_dir>/jobs.sqlite by default, see crawler.ledger")
+    parser.add_argument("--log-file", type=str, default=None, help="Also append the summary to this JSON lines file")
+    parser.add_argument("--remove-source", action="store_true", help="Remove the downloaded files once processed")
+    parser.add_argument("--pipeline", type=str, default=None, help="Pipeline config, see crawler.pipeline_config")
+    parser.add_argument("--lang", choices=SUPPORTED, default=None,
+                        help="Language of the subtitles, detected from the downloaded files by default")
+    parser.add_argument("--partition-by-language", action="store_true", help="Write to <target_dir>/<lang>")
+    parser.add_argument("--audio-memmap-dir", type=str, default=None,
+                        help="Decode the audio to a memory mapped file of this directory instead of into memory")
+
+    opt = parser.parse_args()
+    info = process_video(opt.video_file, opt.target_dir, dedup_index=opt.dedup_index,
+                         output_format=opt.output_format, shard_size=opt.shard_size, streaming=opt.streaming,
+                         ledger=opt.ledger or True, log_filename=opt.log_file, remove_source=opt.remove_source,
+                         pipeline_config=opt.pipeline, lang=opt.lang,
+                         partition_by_language=opt.partition_by_language, audio_memmap_dir=opt.audio_memmap_dir)
+    if opt.metrics_file:
+        metrics = Metrics()
+        metrics.observe_video(info)
+        metrics.write(opt.metrics_file)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Re-runs the filter pipelines (crawler/pipelines/default.json or --pipeline) over the downloaded videos (.m4a, .<lang>.vtt and .info.json)
+without downloading them again, e.g. after changing the regexp or the filter settings. The language
+of a video is detected from its subtitle files unless --lang is given, see crawler.languages.
+
+The segments kept by the new settings are compared with the segments of the video in the corpus
+index: only the new ones are extracted and the ones which no longer pass are removed (tombstoned
+in the shards, see ShardWriter.remove). The job ledger and the dedup index (--dedup-index) are
+updated with the written and removed segments, and new segments duplicating an indexed one are not
+extracted. The parsed captions, their normalized texts and the frame energies of the audio are cached
+per video in <cache_dir>/<video>.<lang>.npz, so a repeated run neither parses nor normalizes the
+subtitles, nor decodes the audio of a video it has nothing to extract from.
+
+    python -m crawler.reprocess <dir_with_intermediate_results> <dir_for_resulting_samples> --processes 16 [--dry-run]
+"""
+import os
+import io
+import json
+import glob
+import argparse
+import termcolor
+from multiprocessing import Pool
+import numpy as np
+from tqdm import tqdm
+from crawler.captions import CaptionBatch
+from crawler.utils import DecodedAudio
+from crawler.youtube_helpers import segment_hash, format_ts
+from crawler.corpus_index import CorpusIndex, FILES_LOCATION
+from crawler.writers import get_writer, ShardReader
+from crawler.pipeline_config import build_pipelines
+from crawler.dedup import DedupIndex
+from crawler.ledger import JobLedger, default_ledger
+from crawler.languages import SUPPORTED, detect_language, get_normalizer, subtitle_file as language_subtitle_file
+
+CACHE_VERSION = 3
+
+
+def load_captions(subtitle_file, cache_file, video_file=None, lang=None):
+    """
+    Returns the CaptionBatch of the subtitle file, the cached frame energies of the audio (or None),
+    the cached normalized texts of the captions (or None) and whether they were read from the cache.
+    The captions are used if they were cached for the current version of the subtitle file, the
+    energies if they were also cached for the current version of the audio file, the normalized
+    texts if they were normalized for lang
+
+    """
+    stat = os.stat(subtitle_file)
+    if os.path.exists(cache_file):
+        try:
+            with np.load(cache_file, allow_pickle=False) as cache:
+                if int(cache["version"]) == CACHE_VERSION and int(cache["size"]) == stat.st_size \
+                        and float(cache["mtime"]) == stat.st_mtime:
+                    batch = CaptionBatch(cache["start"], cache["end"], cache["texts"].tolist(), idx=cache["idx"],
+                                         sub_file=subtitle_file)
+                    energy = normalized = None
+                    if "normalized" in cache and lang is not None and str(cache["normalized_lang"]) == lang:
+                        normalized = cache["normalized"].tolist()
+                    if "energy" in cache and video_file is not None:
+                        audio_stat = os.stat(video_file)
+                        if int(cache["audio_size"]) == audio_stat.st_size \
+                                and float(cache["audio_mtime"]) == audio_stat.st_mtime:
+                            energy = (cache["energy"], cache["clipped"])
+                    return batch, energy, normalized, True
+        except (OSError, ValueError, KeyError):
+            termcolor.cprint("Ignoring the broken cache {}".format(cache_file), color="yellow")
+    return CaptionBatch.from_file(subtitle_file), None, None, False
+
+
+def save_captions(subtitle_file, cache_file, batch, energy=None, video_file=None, normalized=None, lang=None):
+    stat = os.stat(subtitle_file)
+    columns = {"version": CACHE_VERSION, "size": stat.st_size, "mtime": stat.st_mtime,
+               "start": batch.start, "end": batch.end, "texts": batch.texts.astype(str), "idx": batch.idx}
+    if normalized is not None and lang is not None:
+        columns["normalized"] = np.array(normalized, dtype=str)
+        columns["normalized_lang"] = lang
+    if energy is not None and video_file is not None:
+        audio_stat = os.stat(video_file)
+        columns["energy"], columns["clipped"] = energy
+        columns["audio_size"], columns["audio_mtime"] = audio_stat.st_size, audio_stat.st_mtime
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = "{}.{}.tmp.npz".format(cache_file[:-len(".npz")], os.getpid())
+    np.savez(tmp_file, **columns)
+    os.replace(tmp_file, cache_file)
+
+
+def _recorded_sub_file(target_dir, key, location):
+    """
+    Subtitle path the segment was extracted with. It is part of the segment names, so the new
+    segments are named like the ones written by the crawler
+
+    """
+    if location == FILES_LOCATION:
+        with io.open(os.path.join(target_dir, "metadata", key[:2], key + ".json"), encoding='utf-8') as f:
+            return json.load(f)["sub_file"]
+    return json.loads(ShardReader(target_dir).read_member(key, "json", shard_name=location).decode('utf-8'))["sub_file"]
+
+
+def reprocess_video(video_file, target_dir, cache_dir, ext="m4a", output_format="files", dry_run=False,
+                    pipeline_config=None, lang=None, partition_by_language=False, audio_memmap_dir=None,
+                    dedup_index=None, ledger=True):
+    """
+    :param dedup_index: DedupIndex file, new segments duplicating an indexed one are not extracted
+    :param ledger: JobLedger file, <target_dir>/jobs.sqlite if True, no ledger if None
+    """
+    lang = lang or detect_language(video_file, ext) or "en"
+    subtitle_file = language_subtitle_file(video_file, lang, ext)
+    if ledger is True:
+        ledger = default_ledger(target_dir)
+    if partition_by_language:
+        target_dir = os.path.join(target_dir, lang)
+    info_file = video_file.replace(f'.{ext}', '.info.json')
+    cache_file = os.path.join(cache_dir, os.path.basename(video_file)[:-len(ext)] + lang + ".npz")
+    info = {"video_file": video_file, "lang": lang}
+    dedup = DedupIndex(dedup_index) if dedup_index else None
+    job_ledger = None
+    try:
+        with open(info_file) as f:
+            metadata = json.load(f)
+        subtitles, energy, normalized, info["cached"] = load_captions(subtitle_file, cache_file, video_file, lang)
+        normalizer = get_normalizer(lang)
+        normalized_now = normalized is None
+        if normalized_now:
+            normalized = [normalizer.normalize(text) for text in subtitles.texts]
+
+        # only the segments of this subtitle file, those of the other languages and of other
+        # downloads of the video are left alone
+        corpus_index = CorpusIndex(target_dir)
+        existing = {}
+        for key, (location, recorded_sub_file) in corpus_index.video_segments(metadata["id"]).items():
+            recorded_sub_file = recorded_sub_file or _recorded_sub_file(target_dir, key, location)
+            if os.path.basename(recorded_sub_file) == os.path.basename(subtitle_file):
+                existing[key] = location
+                naming_sub_file = recorded_sub_file
+        corpus_index.close()
+        if existing:
+            subtitle_file = naming_sub_file
+
+        audio = DecodedAudio(video_file, memmap_dir=audio_memmap_dir)
+        input = {'sub_file': subtitle_file, 'video_file': video_file, 'audio': audio,
+                 'subtitles': CaptionBatch(subtitles.start.copy(), subtitles.end.copy(), subtitles.texts,
+                                           idx=subtitles.idx, sub_file=subtitle_file)}
+        if energy is not None:
+            input['frame_energy'] = energy
+        pipelines = build_pipelines(pipeline_config, lang=lang)
+        # the normalizer of the pipeline looks the cached texts up
+        with normalizer.known_texts(subtitles.texts, normalized):
+            filtered_input = pipelines["pipeline"](input)
+        filtered_input["subtitles"].freeze_timing()
+        if not filtered_input.get("rejected"):
+            filtered_input = pipelines["audio_pipeline"](filtered_input)
+        if not info["cached"] or normalized_now or (energy is None and 'frame_energy' in filtered_input):
+            save_captions(subtitles.sub_file, cache_file, subtitles, filtered_input.get('frame_energy'), video_file,
+                          normalized, lang)
+
+        kept = {}
+        if not filtered_input.get("rejected"):
+            for t in filtered_input["subtitles"].to_dicts():
+                if t["original_phrase"]:
+                    kept[segment_hash(subtitle_file, t["original_phrase"], t["caption_start"])] = t
+        new_keys = [key for key in kept if key not in existing]
+        stale_keys = [key for key in existing if key not in kept]
+        num_new = len(new_keys)
+        if dedup is not None:
+            new_keys = [key for key in new_keys
+                        if dedup.find_duplicate(metadata["id"], kept[key]["caption_start"], kept[key]["caption_end"],
+                                                kept[key]["original_phrase"]) in (None, key)]
+        info.update(num_kept=len(kept), num_written=len(new_keys), num_removed=len(stale_keys),
+                    num_unchanged=len(kept) - num_new, num_duplicates=num_new - len(new_keys))
+        if dry_run or not (new_keys or stale_keys):
+            return info
+
+        writer = get_writer(target_dir, output_format)
+        for key in new_keys:
+            t = kept[key]
+            if dedup is not None:
+                dedup.add(key, metadata["id"], t["caption_start"], t["caption_end"], t["original_phrase"])
+            t["lang"] = lang
+            samples = audio.segment(t["ts_start"], t["ts_end"])
+            t["ts_start"] = format_ts(t["ts_start"])
+            t["ts_end"] = format_ts(t["ts_end"])
+            t["caption_start"] = format_ts(t["caption_start"])
+            t["caption_end"] = format_ts(t["caption_end"])
+            writer.write(key, samples, audio.sample_rate, t["original_phrase"], t, metadata)
+        for key in stale_keys:
+            writer.remove(key)
+        # completes the shard, pool processes exit without closing the writer
+        writer.flush()
+        if dedup is not None:
+            dedup.remove(stale_keys)
+        if ledger:
+            job_ledger = JobLedger(ledger)
+            job_ledger.add_segments(video_file, new_keys)
+            job_ledger.remove_segments(stale_keys)
+    except Exception as e:
+        info["error"] = str(e)
+    finally:
+        if dedup is not None:
+            dedup.close()
+        if job_ledger is not None:
+            job_ledger.close()
+    return info
+
+
+def _reprocess(args):
+    return reprocess_video(*args)
+
+
+def reprocess(download_dir, target_dir, cache_dir=None, ext="m4a", output_format="files", processes=None,
+              dry_run=False, pipeline_config=None, lang=None, partition_by_language=False, audio_memmap_dir=None,
+              dedup_index=None, ledger=True):
+    """
+    Reprocesses the downloaded videos of download_dir which have subtitles and info files in a pool
+    of processes and returns the totals. Only the videos with subtitles in lang are reprocessed
+    if it is given. With audio_memmap_dir, the audio is decoded to memory mapped files of that
+    directory, see crawler.utils.DecodedAudio. The dedup index and the ledger are updated as in
+    reprocess_video
+
+    """
+    cache_dir = cache_dir or os.path.join(download_dir, ".captions")
+    videos = [video_file for video_file in sorted(glob.glob(os.path.join(download_dir, "*.{}".format(ext))))
+              if (detect_language(video_file, ext) if lang is None
+                  else os.path.exists(language_subtitle_file(video_file, lang, ext)))
+              and os.path.exists(video_file.replace(f'.{ext}', '.info.json'))]
+    totals = {"videos": 0, "failed": 0, "cached": 0, "num_kept": 0, "num_written": 0, "num_removed": 0,
+              "num_unchanged": 0, "num_duplicates": 0}
+    with Pool(processes) as pool:
+        tasks = [(video_file, target_dir, cache_dir, ext, output_format, dry_run, pipeline_config, lang,
+                  partition_by_language, audio_memmap_dir, dedup_index, ledger) for video_file in videos]
+        for info in tqdm(pool.imap_unordered(_reprocess, tasks), total=len(tasks)):
+            totals["videos"] += 1
+            if "error" in info:
+                totals["failed"] += 1
+                termcolor.cprint("Failed {}: {}".format(info["video_file"], info["error"]), color="red")
+                continue
+            totals["cached"] += int(info["cached"])
+            for name in ("num_kept", "num_written", "num_removed", "num_unchanged", "num_duplicates"):
+                totals[name] += info[name]
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("download_dir", type=str)
+    parser.add_argument("target_dir", type=str)
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Cache of the parsed captions, <download_dir>/.captions by default")
+    parser.add_argument("--output-format", choices=["files", "shards"], default="files")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--pipeline", type=str, default=None, help="Pipeline config, see crawler.pipeline_config")
+    parser.add_argument("--lang", choices=SUPPORTED, default=None,
+                        help="Language of the subtitles, detected per video by default")
+    parser.add_argument("--partition-by-language", action="store_true", help="Write to <target_dir>/<lang>")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the segments to write and to remove")
+    parser.add_argument("--audio-memmap-dir", type=str, default=None,
+                        help="Decode the audio to memory mapped files of this directory instead of into memory")
+    parser.add_argument("--dedup-index", type=str, default=None,
+                        help="Index of the extracted segments, updated and used to skip duplicates")
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="Job ledger updated with the segments, <target_dir>/jobs.sqlite by default")
+
+    opt = parser.parse_args()
+    totals = reprocess(opt.download_dir, opt.target_dir, cache_dir=opt.cache_dir, output_format=opt.output_format,
+                       processes=opt.processes, dry_run=opt.dry_run, pipeline_config=opt.pipeline,
+                       lang=opt.lang, partition_by_language=opt.partition_by_language,
+                       audio_memmap_dir=opt.audio_memmap_dir, dedup_index=opt.dedup_index,
+                       ledger=opt.ledger or True)
+    termcolor.cprint(json.dumps(totals), color="cyan")
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+Crawl scheduler replacing the keyword x page loops of en_corpus.sh.
+
+The (keyword, page) search queries form a frontier ordered by page, so that the first pages of
+all the keywords are crawled before the deeper ones. The deeper pages of a keyword are dropped
+once one of its pages returns no results. Searches and downloads run concurrently in a thread
+pool, and every host has its own rate limit. Progress is kept in an SQLite database. It holds
+the state of every query and the set of seen video ids, which replaces the youtube-dl download
+archive. An interrupted crawl resumes where it stopped.
+
+Every query has a language: its keywords come from crawler/keywords/<lang>.txt and the videos it
+finds are downloaded with the subtitles of that language, see crawler.languages. Several languages
+are crawled in one frontier.
+
+Searching and downloading are done by an executor: YoutubeDLExecutor keeps one youtube-dl
+instance per thread instead of starting youtube-dl for every query, FakeExecutor serves canned
+search results and media for testing.
+
+    python -m crawler.scheduler <dir_with_intermediate_results> <dir_for_resulting_samples> \
+        --lang en de --pages 30 --concurrency 8
+"""
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import urllib.parse
+import threading
+import subprocess
+import termcolor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from crawler.db import connect
+from crawler.spool import Spool, Backpressure
+from crawler.languages import SUPPORTED, keywords_file
+
+SEARCH_URL = "https://www.youtube.com/results?sp=EgQIBCgB&q={}&p={}"
+VIDEO_URL = "https://www.youtube.com/watch?v={}"
+DEFAULT_KEYWORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keywords", "en.txt")
+
+
+def load_keywords(filename):
+    with open(filename, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class CrawlState:
+    """
+    Frontier of search queries and set of seen video ids
+
+    """
+    def __init__(self, filename):
+        self.conn = connect(filename)
+        self._migrate()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS queries (keyword TEXT, page INTEGER, priority INTEGER, "
+                          "state TEXT, num_results INTEGER, lang TEXT, PRIMARY KEY (lang, keyword, page))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS queries_frontier ON queries (state, priority)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS videos (id TEXT PRIMARY KEY, state TEXT, keyword TEXT, "
+                          "page INTEGER, video_file TEXT, lang TEXT DEFAULT 'en')")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS videos_state ON videos (state)")
+        # the queries of an interrupted crawl and the failed ones are run again
+        self.conn.execute("UPDATE queries SET state = 'pending' WHERE state IN ('running', 'failed')")
+
+    def _migrate(self):
+        """
+        Adds the language to the tables of a crawl started before languages were supported, its
+        queries and videos are English
+
+        """
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(queries)")]
+        if columns and "lang" not in columns:
+            # the language is part of the primary key, so the table is rebuilt
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.execute("ALTER TABLE queries RENAME TO queries_old")
+                self.conn.execute("DROP INDEX IF EXISTS queries_frontier")
+                self.conn.execute("CREATE TABLE queries (keyword TEXT, page INTEGER, priority INTEGER, state TEXT, "
+                                  "num_results INTEGER, lang TEXT, PRIMARY KEY (lang, keyword, page))")
+                self.conn.execute("INSERT INTO queries SELECT keyword, page, priority, state, num_results, 'en' "
+                                  "FROM queries_old")
+                self.conn.execute("DROP TABLE queries_old")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(videos)")]
+        if columns and "lang" not in columns:
+            self.conn.execute("ALTER TABLE videos ADD COLUMN lang TEXT DEFAULT 'en'")
+
+    def add_queries(self, keywords, pages, lang="en"):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO queries VALUES (?, ?, ?, 'pending', NULL, ?)",
+                                  [(kw, page, page * len(keywords) + i, lang)
+                                   for page in range(1, pages + 1) for i, kw in enumerate(keywords)])
+
+    def next_query(self):
+        """
+        Returns (keyword, page, lang) of the next pending query, None if there are none
+
+        """
+        row = self.conn.execute("SELECT keyword, page, lang FROM queries WHERE state = 'pending' "
+                                "ORDER BY priority LIMIT 1").fetchone()
+        if row is not None:
+            self.conn.execute("UPDATE queries SET state = 'running' WHERE keyword = ? AND page = ? AND lang = ?",
+                              row)
+        return row
+
+    def finish_query(self, keyword, page, lang="en", num_results=None, failed=False):
+        self.conn.execute("UPDATE queries SET state = ?, num_results = ? WHERE keyword = ? AND page = ? AND lang = ?",
+                          ("failed" if failed else "done", num_results, keyword, page, lang))
+        if not failed and num_results == 0:
+            # there are no results after the last page
+            self.conn.execute("UPDATE queries SET state = 'exhausted' WHERE keyword = ? AND page > ? "
+                              "AND lang = ? AND state = 'pending'", (keyword, page, lang))
+
+    def add_videos(self, video_ids, keyword=None, page=None, lang="en"):
+        """
+        Adds the unseen video ids and returns them. A video is downloaded in the language of the
+        first query finding it
+
+        """
+        new_ids = []
+        for video_id in video_ids:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO videos VALUES (?, 'queued', ?, ?, NULL, ?)",
+                                       (video_id, keyword, page, lang))
+            if cursor.rowcount:
+                new_ids.append(video_id)
+        return new_ids
+
+    def queued_videos(self):
+        """
+        Returns (video id, lang) of the videos to download
+
+        """
+        return self.conn.execute("SELECT id, lang FROM videos WHERE state = 'queued'").fetchall()
+
+    def finish_video(self, video_id, video_file, failed=False):
+        self.conn.execute("UPDATE videos SET state = ?, video_file = ? WHERE id = ?",
+                          ("failed" if failed else "downloaded", video_file, video_id))
+
+    def import_archive(self, archive_file):
+        """
+        Adds the ids of a youtube-dl download archive ("youtube <id>" lines) as downloaded
+
+        """
+        with open(archive_file) as f:
+            ids = [line.split()[-1] for line in f if line.strip()]
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO videos VALUES (?, 'downloaded', NULL, NULL, NULL, NULL)",
+                                  [(video_id,) for video_id in ids])
+        return len(ids)
+
+    def counts(self):
+        return {"queries": dict(self.conn.execute("SELECT state, COUNT(*) FROM queries GROUP BY state").fetchall()),
+                "videos": dict(self.conn.execute("SELECT state, COUNT(*) FROM videos GROUP BY state").fetchall()),
+                "downloaded": dict(self.conn.execute("SELECT lang, COUNT(*) FROM videos WHERE state = 'downloaded' "
+                                                     "AND lang IS NOT NULL GROUP BY lang").fetchall())}
+
+    def close(self):
+        self.conn.close()
+
+
+class RateLimiter:
+    """
+    At most rate requests per second per host, in bursts of at most burst requests
+
+    """
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        # host: (tokens, time of the last update)
+        self.buckets = {}
+
+    def acquire(self, host):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                tokens, last = self.buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1.0:
+                    self.buckets[host] = (tokens - 1.0, now)
+                    return
+                self.buckets[host] = (tokens, now)
+                wait_sec = (1.0 - tokens) / self.rate
+            time.sleep(wait_sec)
+
+
+class QueryExecutor:
+    host = None
+
+    def search(self, keyword, page):
+        """
+        Returns the video ids of a page of search results
+
+        """
+        raise NotImplementedError
+
+    def download(self, video_id, target_dir, lang="en"):
+        """
+        Downloads audio, subtitles in lang and info.json of the video to target_dir and returns the
+        audio file, None if the video has no usable subtitles
+
+        """
+        raise NotImplementedError
+
+
+class YoutubeDLExecutor(QueryExecutor):
+    host = "www.youtube.com"
+
+    def __init__(self, socket_timeout=20):
+        self.socket_timeout = socket_timeout
+        self.local = threading.local()
+
+    def _options(self, target_dir, lang):
+        # the options en_corpus.sh passed on the youtube-dl command line
+        return {"format": "bestaudio[ext=m4a]", "restrictfilenames": True, "youtube_include_dash_manifest": False,
+                "prefer_ffmpeg": True, "socket_timeout": self.socket_timeout, "ignoreerrors": True,
+                "nooverwrites": True, "continuedl": True, "writeinfojson": True, "keepvideo": True,
+                "writesubtitles": True, "subtitlesformat": "ttml", "subtitleslangs": [lang],
+                "postprocessors": [{"key": "FFmpegSubtitlesConvertor", "format": "vtt"}],
+                "outtmpl": os.path.join(target_dir, "%(id)s%(title)s.%(ext)s"), "quiet": True}
+
+    def _ydl(self, target_dir=None, lang="en"):
+        import youtube_dl
+        key = (target_dir or "", lang)
+        ydls = self.local.__dict__.setdefault("ydls", {})
+        if key not in ydls:
+            options = self._options(target_dir, lang) if target_dir else {"quiet": True, "ignoreerrors": True,
+                                                                    "extract_flat": "in_playlist"}
+            ydls[key] = youtube_dl.YoutubeDL(options)
+        return ydls[key]
+
+    def search(self, keyword, page):
+        info = self._ydl().extract_info(SEARCH_URL.format(urllib.parse.quote_plus(keyword), page), download=False)
+        return [e["id"] for e in (info or {}).get("entries") or [] if e and e.get("id")]
+
+    def download(self, video_id, target_dir, lang="en"):
+        self._ydl(target_dir, lang).download([VIDEO_URL.format(video_id)])
+        audio_files = glob.glob(os.path.join(glob.escape(target_dir), glob.escape(video_id) + "*.m4a"))
+        subtitle_files = glob.glob(os.path.join(glob.escape(target_dir), glob.escape(video_id) + "*.{}.vtt".format(lang)))
+        return audio_files[0] if audio_files and subtitle_files else None
+
+
+class FakeExecutor(QueryExecutor):
+    """
+    Serves canned search results {(keyword, page): [video ids]} and copies the media of a video
+    (<id>.m4a, <id>.<lang>.vtt, <id>.info.json) from media_dir, or writes empty placeholders
+
+    """
+    host = "fake"
+
+    def __init__(self, results, media_dir=None, latency=0.0):
+        self.results = results
+        self.media_dir = media_dir
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.searches = []
+        self.downloads = []
+
+    def search(self, keyword, page):
+        time.sleep(self.latency)
+        with self.lock:
+            self.searches.append((keyword, page))
+        return list(self.results.get((keyword, page), []))
+
+    def download(self, video_id, target_dir, lang="en"):
+        time.sleep(self.latency)
+        with self.lock:
+            self.downloads.append(video_id)
+        os.makedirs(target_dir, exist_ok=True)
+        for ext in ("m4a", "{}.vtt".format(lang), "info.json"):
+            target = os.path.join(target_dir, "{}.{}".format(video_id, ext))
+            source = os.path.join(self.media_dir, "{}.{}".format(video_id, ext)) if self.media_dir else None
+            if source and os.path.exists(source):
+                shutil.copy(source, target)
+            elif ext == "info.json":
+                with open(target, "w") as f:
+                    json.dump({"id": video_id}, f)
+            else:
+                open(target, "w").close()
+        return os.path.join(target_dir, video_id + ".m4a")
+
+
+def process_command(filter_dir, queue_file=None, spool=None, partition_by_language=False):
+    """
+    Callback handing a downloaded video over for processing like the --exec of en_corpus.sh:
+    put into the spool or appended to the queue file of crawler.worker, or processed by process.py.
+    The language is detected from the downloaded subtitles
+
+    """
+    lock = threading.Lock()
+
+    def callback(video_file):
+        if spool is not None:
+            spool.put(video_file)
+        elif queue_file:
+            with lock, open(queue_file, "a") as f:
+                f.write(video_file + "\n")
+        else:
+            subprocess.run([sys.executable, "-m", "crawler.process", video_file, filter_dir]
+                           + (["--partition-by-language"] if partition_by_language else []))
+    return callback
+
+
+class Scheduler:
+    def __init__(self, state, executor, download_dir, on_downloaded=None, concurrency=8, rate_limiter=None,
+                 backpressure=None, poll_interval=5.0):
+        """
+        :param state: CrawlState
+        :param executor: QueryExecutor
+        :param on_downloaded: called with the audio file of every downloaded video, from a pool thread
+        :param backpressure: crawler.spool.Backpressure, no new searches and downloads are started
+                             while it gives a reason to pause
+        """
+        self.state = state
+        self.executor = executor
+        self.download_dir = download_dir
+        self.on_downloaded = on_downloaded
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter or RateLimiter(rate=None)
+        self.backpressure = backpressure
+        self.poll_interval = poll_interval
+
+    def _search(self, keyword, page):
+        self.rate_limiter.acquire(self.executor.host)
+        return self.executor.search(keyword, page)
+
+    def _download(self, video_id, lang):
+        self.rate_limiter.acquire(self.executor.host)
+        video_file = self.executor.download(video_id, self.download_dir, lang)
+        if video_file is not None and self.on_downloaded is not None:
+            self.on_downloaded(video_file)
+        return video_file
+
+    def run(self):
+        """
+        Runs until the frontier and the download queue are empty. The database is only accessed
+        from this thread, the pool threads search and download
+
+        """
+        downloads = deque(self.state.queued_videos())
+        futures = {}
+        paused = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while True:
+                pause = self.backpressure.reason() if self.backpressure is not None else None
+                if bool(pause) != bool(paused):
+                    termcolor.cprint("Downloads paused: {}".format(pause) if pause else "Downloads resumed",
+                                     color="yellow")
+                    paused = pause
+                # downloads go first, the frontier is only expanded when they are all running
+                while not pause and len(futures) < self.concurrency:
+                    if downloads:
+                        video_id, lang = downloads.popleft()
+                        futures[pool.submit(self._download, video_id, lang)] = ("download", video_id)
+                        continue
+                    query = self.state.next_query()
+                    if query is None:
+                        break
+                    futures[pool.submit(self._search, *query[:2])] = ("search", query)
+                if not futures:
+                    if pause:
+                        time.sleep(self.poll_interval)
+                        continue
+                    break
+                done, _ = wait(futures, timeout=self.poll_interval if pause else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, job = futures.pop(future)
+                    try:
+                        res = future.result()
+                    except Exception as e:
+                        termcolor.cprint("{} {} failed: {}".format(kind, job, e), color="red")
+                        if kind == "search":
+                            self.state.finish_query(*job, num_results=None, failed=True)
+                        else:
+                            self.state.finish_video(job, None, failed=True)
+                        continue
+                    if kind == "search":
+                        new_ids = self.state.add_videos(res, *job)
+                        self.state.finish_query(*job, num_results=len(res))
+                        termcolor.cprint("{} ({}) page {}: {} results, {} new".format(job[0], job[2], job[1], len(res),
+                                                                                      len(new_ids)), color="yellow")
+                        downloads.extend((video_id, job[2]) for video_id in new_ids)
+                    else:
+                        self.state.finish_video(job, res, failed=res is None)
+        return self.state.counts()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("download_dir", type=str)
+    parser.add_argument("filter_dir", type=str)
+    parser.add_argument("--lang", choices=SUPPORTED, nargs="+", default=["en"],
+                        help="Languages to crawl, with the keywords of crawler/keywords/<lang>.txt")
+    parser.add_argument("--keywords", type=str, default=None,
+                        help="File with one keyword per line, instead of the keywords of the language")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1.0, help="Maximum requests per second per host")
+    parser.add_argument("--burst", type=int, default=4)
+    parser.add_argument("--state", type=str, default="./crawl.sqlite", help="Progress of the crawl")
+    parser.add_argument("--import-archive", type=str, default=None,
+                        help="Mark the videos of a youtube-dl download archive (en-downloaded.txt) as seen")
+    parser.add_argument("--queue-file", type=str, default=None,
+                        help="Append the downloaded videos to the queue file of crawler.worker "
+                             "instead of running process.py")
+    parser.add_argument("--spool", type=str, default=None,
+                        help="Put the downloaded videos into this spool consumed by crawler.worker --spool")
+    parser.add_argument("--max-backlog", type=int, default=200,
+                        help="Pause the downloads while the spool holds this many unprocessed videos")
+    parser.add_argument("--partition-by-language", action="store_true",
+                        help="Write the segments to <filter_dir>/<lang>, when processed by process.py")
+    parser.add_argument("--min-free-gb", type=float, default=10.0,
+                        help="Pause the downloads while the download directory has less free space")
+
+    opt = parser.parse_args()
+    if opt.keywords and len(opt.lang) > 1:
+        parser.error("--keywords can only be given for a single language")
+    spool = Spool(opt.spool) if opt.spool else None
+    backpressure = Backpressure(spool, opt.download_dir, max_backlog=opt.max_backlog if spool else None,
+                                min_free_bytes=int(opt.min_free_gb * (1 << 30)))
+    state = CrawlState(opt.state)
+    if opt.import_archive:
+        termcolor.cprint("Imported {} seen videos".format(state.import_archive(opt.import_archive)), color="cyan")
+    for lang in opt.lang:
+        state.add_queries(load_keywords(opt.keywords or keywords_file(lang)), opt.pages, lang)
+    scheduler = Scheduler(state, YoutubeDLExecutor(), opt.download_dir,
+                          on_downloaded=process_command(opt.filter_dir, opt.queue_file, spool,
+                                                        opt.partition_by_language),
+                          concurrency=opt.concurrency, rate_limiter=RateLimiter(opt.rate, opt.burst),
+                          backpressure=backpressure)
+    termcolor.cprint(json.dumps(scheduler.run()), color="cyan")
+    state.close()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk queue of downloaded videos between the crawl scheduler (producer) and the processing
+workers (consumers), an SQLite database in WAL mode shared by the processes.
+
+The scheduler pauses the downloads while the backlog of queued and processing videos, or the
+free disk space of the download directory, crosses a threshold, so downloading and processing
+run at the same time without filling the disk:
+
+    python -m crawler.scheduler <download_dir> <target_dir> --spool ./spool.sqlite --max-backlog 200
+    python -m crawler.worker <target_dir> --spool ./spool.sqlite --remove-source
+"""
+import os
+import time
+import shutil
+import threading
+from crawler.db import connect
+
+
+class STATE:
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Spool:
+    def __init__(self, filename):
+        self.conn = connect(filename)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY, video_file TEXT UNIQUE, "
+                          "state TEXT, updated REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS spool_state ON spool (state, id)")
+        # the connection is shared by the download threads of the scheduler
+        self.lock = threading.Lock()
+
+    def put(self, video_file):
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO spool (video_file, state, updated) VALUES (?, ?, ?)",
+                              (video_file, STATE.QUEUED, time.time()))
+
+    def claim(self):
+        """
+        Returns the oldest queued video and marks it as processing, None if the spool is empty.
+        Safe with several consumers
+
+        """
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT id, video_file FROM spool WHERE state = ? ORDER BY id LIMIT 1",
+                                    (STATE.QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE spool SET state = ?, updated = ? WHERE id = ?",
+                              (STATE.PROCESSING, time.time(), row[0]))
+        return row[1]
+
+    def finish(self, video_file, failed=False):
+        with self.lock:
+            self.conn.execute("UPDATE spool SET state = ?, updated = ? WHERE video_file = ?",
+                              (STATE.FAILED if failed else STATE.DONE, time.time(), video_file))
+
+    def requeue_stale(self, older_than_sec=3600.0):
+        """
+        Queues again the videos claimed by consumers which stopped before finishing them
+
+        """
+        with self.lock:
+            return self.conn.execute("UPDATE spool SET state = ?, updated = ? WHERE state = ? AND updated < ?",
+                                     (STATE.QUEUED, time.time(), STATE.PROCESSING,
+                                      time.time() - older_than_sec)).rowcount
+
+    def backlog(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM spool WHERE state IN (?, ?)",
+                                     (STATE.QUEUED, STATE.PROCESSING)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_spool(spool, poll_interval=5.0, once=False):
+    """
+    Yields the claimed videos of the spool, waiting for new ones unless once is set
+
+    """
+    while True:
+        video_file = spool.claim()
+        if video_file is not None:
+            yield video_file
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+class Backpressure:
+    """
+    Tells the producer to pause while the spool holds max_backlog unfinished videos or the disk
+    of download_dir has less than min_free_bytes left
+
+    """
+    def __init__(self, spool, download_dir, max_backlog=200, min_free_bytes=10 << 30):
+        self.spool = spool
+        self.download_dir = download_dir
+        self.max_backlog = max_backlog
+        self.min_free_bytes = min_free_bytes
+
+    def reason(self):
+        """
+        Why the downloads have to pause, None if they can go on
+
+        """
+        if self.max_backlog is not None:
+            backlog = self.spool.backlog()
+            if backlog >= self.max_backlog:
+                return "backlog of {} videos".format(backlog)
+        if self.min_free_bytes is not None:
+            os.makedirs(self.download_dir, exist_ok=True)
+            free = shutil.disk_usage(self.download_dir).free
+            if free < self.min_free_bytes:
+                return "{:.1f} GB free".format(free / (1 << 30))
+        return None
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Long running worker processing downloaded videos in a pool of processes.
+Imports and pipeline construction are paid once per pool process instead of once per video.
+
+Watching the youtube-dl output directory:
+    python -m crawler.worker <target_dir> --watch <download_dir> --concurrency 32
+
+Following a queue file with one video path per line (see en_corpus.sh):
+    python -m crawler.worker <target_dir> --queue-file ./queue.txt
+
+Consuming the spool of the crawl scheduler, see crawler/spool.py:
+    python -m crawler.worker <target_dir> --spool ./spool.sqlite --remove-source
+"""
+import os
+import time
+import glob
+import argparse
+import threading
+import functools
+import termcolor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from crawler.process import process_video, RESULT
+from crawler.metrics import Metrics
+from crawler.ledger import JobLedger, default_ledger
+from crawler.spool import Spool, iter_spool
+from crawler.languages import SUPPORTED, detect_language
+
+
+def watch_directory(download_dir, ext="m4a", poll_interval=5.0, once=False):
+    """
+    Yields downloaded videos of download_dir as soon as they are complete: the audio is renamed
+    from .part when it is downloaded, but the subtitles are converted to .vtt after that, so a
+    video is only yielded once its .<lang>.vtt and .info.json files exist too and the downloaded
+    .<lang>.ttml is removed by the conversion. Incomplete videos are checked again on the next poll
+
+    """
+    seen = set()
+    while True:
+        for video_file in sorted(glob.glob(os.path.join(download_dir, "*.{}".format(ext)))):
+            if video_file in seen:
+                continue
+            prefix = video_file[:-len(ext)]
+            lang = detect_language(video_file, ext)
+            if lang is None or os.path.exists(prefix + lang + ".ttml") or not os.path.exists(prefix + "info.json"):
+                continue
+            seen.add(video_file)
+            yield video_file
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+def follow_queue_file(queue_file, poll_interval=5.0, once=False):
+    """
+    Yields video paths appended to queue_file, like `tail -f`
+
+    """
+    with open(queue_file, "a+") as f:
+        f.seek(0)
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if line.endswith("\n"):
+                video_file = line.strip()
+                if video_file:
+                    yield video_file
+                continue
+            if once:
+                return
+            # partial lines are re-read once the writer has finished them
+            f.seek(position)
+            time.sleep(poll_interval)
+
+
+def run(videos, target_dir, concurrency=os.cpu_count(), max_backlog=None, log_filename=None,
+        dedup_index=None, output_format="files", shard_size=1 << 30, metrics=None, metrics_file=None,
+        metrics_interval=60.0, streaming=False, ledger=True, remove_source=False, on_processed=None,
+        pipeline_config=None, lang=None, partition_by_language=False, audio_memmap_dir=None):
+    """
+    Processes the videos yielded by the iterator in a process pool. At most max_backlog videos are
+    submitted but not finished, so the source iterator is only consumed as fast as the pool works.
+    Videos recorded as done in the ledger are not submitted
+
+    :param metrics: Metrics aggregating the records of the processed videos
+    :param metrics_file: file the metrics are written to every metrics_interval seconds and at the end
+    :param ledger: JobLedger file, <target_dir>/jobs.sqlite if True, no ledger if None
+    :param remove_source: remove the downloaded files of the successfully processed videos
+    :param pipeline_config: pipeline config file, see crawler.pipeline_config
+    :param lang: language of the subtitles, detected per video if None, see process_video
+    :param partition_by_language: write the segments to target_dir/<lang>
+    :param audio_memmap_dir: decode the audio to memory mapped files of this directory, see process_video
+    :param on_processed: called with the video file and the summary of process_video (None if
+                         processing crashed) for every video, including the skipped ones
+    """
+    max_backlog = max_backlog or 2 * concurrency
+    metrics = metrics or Metrics()
+    pending = set()
+    lock = threading.Lock()
+    num_done = [0]
+    last_write = time.monotonic()
+    if ledger is True:
+        ledger = default_ledger(target_dir)
+    job_ledger = JobLedger(ledger) if ledger else None
+
+    # reported as soon as they finish, also while the source waits for new videos
+    def finished(video_file, future):
+        with lock:
+            pending.discard(future)
+            num_done[0] += 1
+        _report(future, video_file, metrics, on_processed)
+
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        for video_file in videos:
+            if job_ledger is not None:
+                if job_ledger.is_done(video_file):
+                    if on_processed is not None:
+                        on_processed(video_file, {"result": RESULT.OK, "skipped": True})
+                    continue
+                job_ledger.add(video_file)
+            while len(pending) >= max_backlog:
+                with lock:
+                    running = list(pending)
+                # the finished futures are removed here, their callbacks may not have run yet
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                with lock:
+                    pending.difference_update(done)
+            if metrics_file and time.monotonic() - last_write >= metrics_interval:
+                metrics.write(metrics_file)
+                last_write = time.monotonic()
+            future = executor.submit(process_video, video_file, target_dir,
+                                     log_filename=log_filename, verbose=False, dedup_index=dedup_index,
+                                     output_format=output_format, shard_size=shard_size,
+                                     streaming=streaming, ledger=ledger, remove_source=remove_source,
+                                     pipeline_config=pipeline_config, lang=lang,
+                                     partition_by_language=partition_by_language,
+                                     audio_memmap_dir=audio_memmap_dir)
+            with lock:
+                pending.add(future)
+            future.add_done_callback(functools.partial(finished, video_file))
+    if job_ledger is not None:
+        job_ledger.close()
+    if metrics_file:
+        metrics.write(metrics_file)
+    return num_done[0]
+
+
+def _report(future, video_file, metrics, on_processed=None):
+    info = None
+    try:
+        info = future.result()
+        metrics.observe_video(info)
+        if info["result"] == RESULT.ERROR:
+            termcolor.cprint("Failed {}: {}".format(info["sub_file"], info.get("error")), color="red")
+        else:
+            termcolor.cprint("Processed {}".format(info["sub_file"]), color="green")
+    except Exception as e:
+        metrics.inc("videos_total", result="crashed")
+        termcolor.cprint(e, color="red")
+    if on_processed is not None:
+        on_processed(video_file, info)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("target_dir", type=str)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--watch", type=str, default=None, help="Directory with downloaded videos")
+    source.add_argument("--queue-file", type=str, default=None, help="File with one video path per line")
+    source.add_argument("--spool", type=str, default=None, help="Spool filled by crawler.scheduler --spool")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count())
+    parser.add_argument("--max-backlog", type=int, default=None,
+                        help="Maximum number of queued videos, 2 * concurrency by default")
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--log-file", type=str, default=None, help="Also append the summaries to this JSON lines file")
+    parser.add_argument("--ledger", type=str, default=None,
+                        help="Job ledger, <target_dir>/jobs.sqlite by default, see crawler.ledger")
+    parser.add_argument("--dedup-index", type=str, default=None,
+                        help="Index of the extracted segments used to skip duplicates")
+    parser.add_argument("--output-format", choices=["files", "shards"], default="files")
+    parser.add_argument("--shard-size", type=int, default=1 << 30, help="Maximum shard size in bytes")
+    parser.add_argument("--once", action="store_true", help="Exit when no new videos are left")
+    parser.add_argument("--remove-source", action="store_true",
+                        help="Remove the downloaded files of the successfully processed videos")
+    parser.add_argument("--metrics-file", type=str, default=None,
+                        help="Counters of the run, JSON for a .json file and Prometheus text format otherwise")
+    parser.add_argument("--metrics-interval", type=float, default=60.0)
+    parser.add_argument("--streaming", action="store_true", help="Filter the captions while reading the subtitles")
+    parser.add_argument("--pipeline", type=str, default=None, help="Pipeline config, see crawler.pipeline_config")
+    parser.add_argument("--lang", choices=SUPPORTED, default=None,
+                        help="Language of the subtitles, detected per video by default")
+    parser.add_argument("--partition-by-language", action="store_true", help="Write to <target_dir>/<lang>")
+    parser.add_argument("--audio-memmap-dir", type=str, default=None,
+                        help="Decode the audio to memory mapped files of this directory instead of into memory")
+
+    opt = parser.parse_args()
+    on_processed = None
+    if opt.watch:
+        videos = watch_directory(opt.watch, poll_interval=opt.poll_interval, once=opt.once)
+    elif opt.queue_file:
+        videos = follow_queue_file(opt.queue_file, poll_interval=opt.poll_interval, once=opt.once)
+    else:
+        spool = Spool(opt.spool)
+        spool.requeue_stale()
+        videos = iter_spool(spool, poll_interval=opt.poll_interval, once=opt.once)
+        on_processed = lambda video_file, info: spool.finish(video_file,
+                                                             failed=info is None or info["result"] == RESULT.ERROR)
+    num_done = run(videos, opt.target_dir, concurrency=opt.concurrency, max_backlog=opt.max_backlog,
+                   log_filename=opt.log_file, dedup_index=opt.dedup_index, output_format=opt.output_format,
+                   shard_size=opt.shard_size, metrics_file=opt.metrics_file, metrics_interval=opt.metrics_interval,
+                   streaming=opt.streaming, ledger=opt.ledger or True, remove_source=opt.remove_source,
+                   on_processed=on_processed, pipeline_config=opt.pipeline, lang=opt.lang,
+                   partition_by_language=opt.partition_by_language, audio_memmap_dir=opt.audio_memmap_dir)
+    termcolor.cprint("Processed {} videos".format(num_done), color="cyan")
@@ -0,0 +1,369 @@
+"""
+Output formats of the extracted segments.
+
+files:  target_dir/{wav,txt,metadata}/<hash[:2]>/<hash>.{wav,txt,json}, one json per segment
+        repeating the youtube-dl info.json of the video.
+shards: target_dir/shards/<host>-<pid>-<n>.tar archives of about max_shard_size bytes, containing
+        <hash>.wav, <hash>.txt and <hash>.json per segment and videos/<youtube id>.json once per
+        video and shard. The segment json references the video by "video_id". A sidecar
+        <shard>.idx lists "key, member, offset, size" of every member for random access.
+        Shards are never rewritten: removed samples are listed as "key, wav offset" in a
+        <shard>.del sidecar and skipped by the readers. A shard is a complete archive after
+        every flush, the end-of-archive blocks are overwritten by the next segment.
+"""
+import os
+import io
+import json
+import glob
+import re
+import socket
+import contextlib
+import functools
+import wave
+import tarfile
+import multiprocessing.util
+from crawler.utils import write_wav
+from crawler.youtube_helpers import getsize
+from crawler.corpus_index import CorpusIndex, FILES_LOCATION
+
+
+@contextlib.contextmanager
+def _atomic_file(filename, mode):
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        with io.open(tmp_filename, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            yield f
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+class FileTreeWriter:
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        self.corpus_index = CorpusIndex(target_dir)
+
+    def _files(self, key):
+        return (os.path.join(self.target_dir, "wav", key[:2], key + ".wav"),
+                os.path.join(self.target_dir, "txt", key[:2], key + ".txt"),
+                os.path.join(self.target_dir, "metadata", key[:2], key + ".json"))
+
+    def exists(self, key):
+        target_wav_file, target_txt_file, _ = self._files(key)
+        return os.path.exists(target_wav_file) and os.path.exists(target_txt_file)
+
+    def write(self, key, samples, sample_rate, text, segment_info, video_metadata):
+        target_wav_file, target_txt_file, target_metadata_file = self._files(key)
+        for filename in (target_wav_file, target_txt_file, target_metadata_file):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # written to temporary files and renamed, so an interrupted write never leaves a partial file
+        with _atomic_file(target_wav_file, "wb") as f:
+            write_wav(f, samples, sample_rate)
+
+        with _atomic_file(target_txt_file, "w") as f:
+            f.write(text)
+
+        with _atomic_file(target_metadata_file, "w") as f:
+            segment_info["metadata"] = video_metadata
+            json.dump(segment_info, f)
+
+        assert os.path.exists(target_txt_file) and os.path.exists(target_wav_file) \
+               and getsize(target_wav_file) > 4 * 1024, "{} not created".format(target_wav_file)
+        self.corpus_index.add(key, len(samples) / sample_rate, video_metadata.get("id"), FILES_LOCATION,
+                              segment_info.get("sub_file"))
+
+    def remove(self, key):
+        for filename in self._files(key):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.corpus_index.remove([key])
+
+    def flush(self):
+        self.corpus_index.flush()
+
+    def close(self):
+        self.corpus_index.close()
+
+
+class ShardWriter:
+    def __init__(self, target_dir, max_shard_size=1 << 30, prefix=None):
+        self.target_dir = target_dir
+        self.shard_dir = os.path.join(target_dir, "shards")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.max_shard_size = max_shard_size
+        self.prefix = prefix or "{}-{}".format(socket.gethostname(), os.getpid())
+        # after the last shard of a previous process with the same pid, the shards before it may
+        # have been removed
+        shard_regexp = re.compile(re.escape(self.prefix) + r"-(\d+)\.tar$")
+        numbers = [int(m.group(1)) for m in map(shard_regexp.match, os.listdir(self.shard_dir)) if m is not None]
+        self.shard_num = max(numbers, default=-1) + 1
+        self.tar = None
+        self.index_file = None
+        self.shard_videos = set()
+        self.keys = None
+        self.corpus_index = CorpusIndex(target_dir)
+
+    def _open_shard(self):
+        while True:
+            shard_file = os.path.join(self.shard_dir, "{}-{:06d}.tar".format(self.prefix, self.shard_num))
+            self.shard_num += 1
+            try:
+                # never truncates an existing shard
+                self.tar = tarfile.open(shard_file, "x", format=tarfile.USTAR_FORMAT)
+                break
+            except FileExistsError:
+                continue
+        self.shard_name = os.path.basename(shard_file)
+        self.index_file = open(shard_file[:-len(".tar")] + ".idx", "w")
+        self.shard_videos = set()
+
+    def _add_member(self, key, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        offset = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+        self.tar.addfile(info, io.BytesIO(data))
+        self.index_file.write("{}\t{}\t{}\t{}\n".format(key, name, offset, len(data)))
+
+    def exists(self, key):
+        if self.keys is None:
+            self.keys = set(load_shard_index(self.target_dir))
+        return key in self.keys
+
+    def write(self, key, samples, sample_rate, text, segment_info, video_metadata):
+        wav_data = io.BytesIO()
+        write_wav(wav_data, samples, sample_rate)
+        wav_data = wav_data.getvalue()
+        assert len(wav_data) > 4 * 1024, "{} not created".format(key)
+
+        if self.tar is None or self.tar.offset >= self.max_shard_size:
+            self._close_shard()
+            self._open_shard()
+        video_id = video_metadata["id"]
+        if video_id not in self.shard_videos:
+            self._add_member(video_id, "videos/{}.json".format(video_id), json.dumps(video_metadata).encode('utf-8'))
+            self.shard_videos.add(video_id)
+        segment_info["video_id"] = video_id
+        self._add_member(key, key + ".wav", wav_data)
+        self._add_member(key, key + ".txt", text.encode('utf-8'))
+        self._add_member(key, key + ".json", json.dumps(segment_info).encode('utf-8'))
+        if self.keys is not None:
+            self.keys.add(key)
+        self.corpus_index.add(key, len(samples) / sample_rate, video_id, self.shard_name, segment_info.get("sub_file"))
+
+    def remove(self, key):
+        """
+        Shards are not rewritten: the members of the sample stay in its shard and a tombstone is
+        appended to the <shard>.del sidecar, so the readers skip it
+
+        """
+        # the shard of a sample written by this writer may not be flushed yet
+        self.corpus_index.flush()
+        if self.index_file is not None:
+            self.index_file.flush()
+        shard_name = self.corpus_index.location(key)
+        location = load_shard_index(self.target_dir, shard_name).get(key) \
+            if shard_name not in (None, FILES_LOCATION) else None
+        if location is not None:
+            shard_file, members = location
+            if key + ".wav" in members:
+                with open(shard_file[:-len(".tar")] + ".del", "a") as f:
+                    f.write("{}\t{}\n".format(key, members[key + ".wav"][0]))
+        if self.keys is not None:
+            self.keys.discard(key)
+        self.corpus_index.remove([key])
+
+    def flush(self):
+        """
+        Makes everything written so far readable, called after every video. The end-of-archive
+        blocks are written after the last member and the next member overwrites them, so the
+        shard is a complete tar even if the process exits without closing it
+
+        """
+        if self.tar is not None:
+            fileobj = self.tar.fileobj
+            fileobj.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+            fileobj.flush()
+            fileobj.seek(self.tar.offset)
+            self.index_file.flush()
+        self.corpus_index.flush()
+
+    def _close_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.index_file.close()
+            self.tar = None
+            self.index_file = None
+
+    def close(self):
+        self._close_shard()
+        self.corpus_index.close()
+
+
+_writers = {}
+
+
+def get_writer(target_dir, output_format="files", max_shard_size=1 << 30):
+    """
+    Writer shared by all the videos processed in this process, so that shards are filled across videos.
+    It is closed when the process exits, also in the workers of a process pool, which do not run
+    the atexit handlers
+
+    """
+    key = (target_dir, output_format)
+    if key not in _writers:
+        if output_format == "files":
+            _writers[key] = FileTreeWriter(target_dir)
+        elif output_format == "shards":
+            _writers[key] = ShardWriter(target_dir, max_shard_size=max_shard_size)
+        else:
+            raise ValueError("Unknown output format {}".format(output_format))
+        multiprocessing.util.Finalize(None, _writers[key].close, exitpriority=10)
+    return _writers[key]
+
+
+def load_tombstones(shard_file):
+    """
+    Returns {(key, wav offset)} of the samples removed from a shard
+
+    """
+    tombstones = set()
+    removed_file = shard_file[:-len(".tar")] + ".del"
+    if os.path.exists(removed_file):
+        with open(removed_file) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 2:
+                    tombstones.add((fields[0], int(fields[1])))
+    return tombstones
+
+
+def load_shard_index(target_dir, shard_name="*"):
+    """
+    Reads the sidecar indices of all the shards (or the given one): {key: (shard file, {member: (offset, size)})}.
+    Removed samples are left out
+
+    """
+    index = {}
+    for index_file in sorted(glob.glob(os.path.join(target_dir, "shards", os.path.splitext(shard_name)[0] + ".idx"))):
+        shard_file = index_file[:-len(".idx")] + ".tar"
+        tombstones = load_tombstones(shard_file)
+        with open(index_file) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 4:
+                    # last line of a shard whose writer was interrupted
+                    continue
+                key, name, offset, size = fields
+                # a video spanning several shards is indexed with the last of them
+                if key not in index or index[key][0] != shard_file:
+                    index[key] = (shard_file, {})
+                index[key][1][name] = (int(offset), int(size))
+        for key, offset in tombstones:
+            if key in index and index[key][0] == shard_file and index[key][1].get(key + ".wav", (None,))[0] == offset:
+                del index[key]
+    return index
+
+
+class ShardReader:
+    """
+    Reads the samples written by ShardWriter, sequentially shard by shard or by key
+
+    """
+    def __init__(self, target_dir, max_cached_shards=64):
+        self.target_dir = target_dir
+        self._index = None
+        self.shard_index = functools.lru_cache(maxsize=max_cached_shards)(
+            lambda shard_name: load_shard_index(self.target_dir, shard_name))
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = load_shard_index(self.target_dir)
+        return self._index
+
+    def __iter__(self):
+        for shard_file in sorted(glob.glob(os.path.join(self.target_dir, "shards", "*.tar"))):
+            tombstones = load_tombstones(shard_file)
+            videos = {}
+            sample = None
+            with tarfile.open(shard_file, "r|") as tar:
+                for member in tar:
+                    data = tar.extractfile(member).read()
+                    if member.name.startswith("videos/"):
+                        videos[member.name[len("videos/"):-len(".json")]] = json.loads(data.decode('utf-8'))
+                        continue
+                    key, ext = member.name.split(".", 1)
+                    if sample is not None and sample["key"] != key:
+                        if not sample.pop("removed"):
+                            yield self._finish(sample, videos)
+                        sample = None
+                    if sample is None:
+                        sample = {"key": key, "removed": False}
+                    if ext == "wav" and (key, member.offset_data) in tombstones:
+                        sample["removed"] = True
+                    sample[ext] = data
+            if sample is not None and not sample.pop("removed"):
+                yield self._finish(sample, videos)
+
+    @staticmethod
+    def _finish(sample, videos):
+        sample["txt"] = sample["txt"].decode('utf-8')
+        sample["json"] = json.loads(sample["json"].decode('utf-8'))
+        sample["info"] = videos.get(sample["json"]["video_id"])
+        return sample
+
+    def member_range(self, key, ext, name=None, shard_name=None):
+        """
+        Returns (shard file, offset, size) of a member, e.g. to stream it without reading it whole
+
+        """
+        index = self.index if shard_name is None else self.shard_index(shard_name)
+        shard_file, members = index[key]
+        offset, size = members[name or "{}.{}".format(key, ext)]
+        return shard_file, offset, size
+
+    def read_member(self, key, ext, name=None, shard_name=None):
+        shard_file, offset, size = self.member_range(key, ext, name, shard_name)
+        with open(shard_file, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def iter_headers(self):
+        """
+        Key, duration, video id, shard and subtitle file of every sample, read from the sidecar
+        indices, the wav headers and the segment json without reading the audio
+
+        """
+        for key, (shard_file, members) in self.index.items():
+            if key + ".wav" not in members:
+                continue
+            offset, size = members[key + ".wav"]
+            with open(shard_file, "rb") as f:
+                f.seek(offset)
+                with wave.open(io.BytesIO(f.read(min(size, 64)))) as w:
+                    duration = w.getnframes() / w.getframerate()
+            segment_info = json.loads(self.read_member(key, "json").decode('utf-8'))
+            yield {"key": key, "duration": duration, "video_id": segment_info["video_id"],
+                   "location": os.path.basename(shard_file), "sub_file": segment_info.get("sub_file")}
+
+    def __getitem__(self, key):
+        return self.read_sample(key)
+
+    def read_sample(self, key, shard_name=None):
+        """
+        Reads a sample by key. Given the shard name (e.g. from the corpus index) only the index of
+        that shard is loaded instead of the indices of the whole corpus
+
+        """
+        sample = self._finish({"key": key, "wav": self.read_member(key, "wav", shard_name=shard_name),
+                               "txt": self.read_member(key, "txt", shard_name=shard_name),
+                               "json": self.read_member(key, "json", shard_name=shard_name)}, {})
+        video_id = sample["json"]["video_id"]
+        sample["info"] = json.loads(self.read_member(video_id, "json", name="videos/{}.json".format(video_id),
+                                                     shard_name=shard_name))
+        return sample
@@ -2,24 +2,16 @@ import hashlib
 import json
 import os
 import io
-from webvtt import WebVTT
 import copy
-import tempfile
 import shutil
-from crawler.utils import extract_audio_part_segment, get_ts_seconds
-from path import Path
-import datetime
-# from datetime import datetime
+from crawler.normalizer import int_to_en
+from crawler.languages import get_normalizer, caption_regexp
 import re
 import random
-import numpy as np
-import unicodedata
-import speech_recognition as sr
-from Levenshtein import *
-from tqdm import tqdm
-
-everything_cool = re.compile(r"^[A-Za-z0-9\,\.\-\?\"\'\’\!\“\s\;\:\“\”\–\‘\’\’\/\\]+$", re.IGNORECASE)
-leave_chars = re.compile(r"[^a-z\s\']", re.IGNORECASE)
+# numpy, path, Levenshtein and the ASR client are imported by the functions using them, so that
+# the parsing helpers imported by every worker process do not load them
+
+everything_cool = caption_regexp("en")
 # numbers are ignored
 html_tags = re.compile(r'<.*?>')
 
@@ -31,20 +23,73 @@ def striphtml(data):
 YT_PREFIX = "YTgenerated___"
 
 
-def get_all_subtitles(dir):
+def get_all_subtitles(dir, lang="en"):
+    from path import Path
     # entries = os.listdir(dir)
-    for filename in Path(dir).walkfiles("*.en.vtt"):
+    for filename in Path(dir).walkfiles("*.{}.vtt".format(lang)):
         # if filename.find(".vtt") != -1:
         if filename.find(YT_PREFIX) != -1:
             continue
         yield os.path.join(dir, filename)
 
 
+vtt_ts = re.compile(r"(?:(\d+):)?(\d{2}):(\d{2})(?:[\.,](\d+))?")
+vtt_timing = re.compile(r"^\s*((?:\d+:)?\d{2}:\d{2}[\.,]\d{3})\s+-->\s+((?:\d+:)?\d{2}:\d{2}[\.,]\d{3})")
+vtt_cue_tags = re.compile(r"<.*?>")
+
+
 def parse_ts(ts_string):
-    if ' ' in ts_string:
-        ts_string = ts_string.split()[0]
-    ts = datetime.datetime.strptime(ts_string, '%H:%M:%S.%f')
-    return ts
+    """
+    Parses [hh:]mm:ss[.ttt] timestamp (WebVTT or format_ts) into seconds
+
+    """
+    m = vtt_ts.match(ts_string.strip())
+    if m is None:
+        raise ValueError("Wrong timestamp {}".format(ts_string))
+    hours, minutes, seconds, fraction = m.groups()
+    msec = int((fraction or "0").ljust(3, "0")[:3])
+    return (int(hours or 0) * 3600000 + int(minutes) * 60000 + int(seconds) * 1000 + msec) / 1000
+
+
+def format_ts(seconds):
+    """
+    Formats seconds the way str(datetime.time) does (hh:mm:ss[.ffffff]), which is how the timestamps
+    are stored in the metadata files and hashed into the segment names
+
+    """
+    msec = int(round(seconds * 1000))
+    hours, msec = divmod(msec, 3600000)
+    minutes, msec = divmod(msec, 60000)
+    secs, msec = divmod(msec, 1000)
+    if msec == 0:
+        return "{:02d}:{:02d}:{:02d}".format(hours, minutes, secs)
+    return "{:02d}:{:02d}:{:02d}.{:06d}".format(hours, minutes, secs, msec * 1000)
+
+
+def iter_vtt_cues(lines):
+    """
+    Streaming WebVTT parser yielding (start_sec, end_sec, text) for every cue. Cue tags are
+    removed and the text lines are joined with a newline, as webvtt-py does
+
+    """
+    start = end = None
+    text_lines = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if start is None:
+            if "-->" in line:
+                m = vtt_timing.match(line)
+                if m is not None:
+                    start, end = parse_ts(m.group(1)), parse_ts(m.group(2))
+            continue
+        if line.strip():
+            text_lines.append(line)
+        else:
+            yield start, end, vtt_cue_tags.sub("", "\n".join(text_lines))
+            start = end = None
+            text_lines = []
+    if start is not None:
+        yield start, end, vtt_cue_tags.sub("", "\n".join(text_lines))
 
 
 def if_phrase_is_bad(phrase):
@@ -61,40 +106,37 @@ def get_hash(content):
     return hashlib.sha224(content.encode('utf-8')).hexdigest()
 
 
-def timedelta_dt(t1, t2):
-    dt1 = datetime.timedelta(hours=t1.hour, minutes=t1.minute, seconds=t1.second, microseconds=t1.microsecond)
-    dt2 = datetime.timedelta(hours=t2.hour, minutes=t2.minute, seconds=t2.second, microseconds=t2.microsecond)
-    return dt2 - dt1
+def segment_hash(subtitle_file, phrase, ts_start):
+    """
+    Name of an extracted segment in the corpus
 
+    """
+    return get_hash(subtitle_file + phrase + format_ts(ts_start))
 
-#        video_file = get_video_file(subtitle_file)
 
 def load_all_subtitles(subtitle_file):
-    subs = WebVTT().read(subtitle_file).captions  # pysrt.open(subtitle_file)
     res = []
-    for s_idx, s in enumerate(subs):
-        start_ts = parse_ts(s.start).time()
-        end_ts = parse_ts(s.end).time()
-        phrase = s.text
-        phrase = phrase.replace('\n', ' ')
-        delta = timedelta_dt(start_ts, end_ts)
-        res.append(
-            {"ts_start": start_ts, "ts_end": end_ts,
-             "original_phrase": phrase,
-             "sub_file": subtitle_file,
-             "duration": delta.total_seconds(),
-             "idx" : s_idx}
-        )
+    with io.open(subtitle_file, encoding="utf-8-sig") as f:
+        for s_idx, (start_ts, end_ts, phrase) in enumerate(iter_vtt_cues(f)):
+            phrase = phrase.replace('\n', ' ')
+            res.append(
+                {"ts_start": start_ts, "ts_end": end_ts,
+                 "original_phrase": phrase,
+                 "sub_file": subtitle_file,
+                 "duration": round(end_ts - start_ts, 3),
+                 "idx" : s_idx}
+            )
     return res
 
 
-def get_video_file(subtitle_file):
-    naive_video_file = subtitle_file.replace(".en.vtt", ".mp4")
-    webm_video_file = subtitle_file.replace(".en.vtt", ".webm")
+def get_video_file(subtitle_file, lang="en"):
+    suffix = ".{}.vtt".format(lang)
+    naive_video_file = subtitle_file.replace(suffix, ".mp4")
+    webm_video_file = subtitle_file.replace(suffix, ".webm")
     if os.path.exists(naive_video_file) or os.path.exists(webm_video_file):
         return naive_video_file
     else:
-        dumb_youtube_file = subtitle_file.replace(".en.vtt", "")
+        dumb_youtube_file = subtitle_file.replace(suffix, "")
         if os.path.exists(dumb_youtube_file):
             print("Renaming file {} --> {}".format(dumb_youtube_file, naive_video_file))
             shutil.move(dumb_youtube_file, naive_video_file)
@@ -111,45 +153,54 @@ def merge_subtitles(subs, min_dist=1.5, max_dist=6.0):
             res.append(s)
         else:
             prev_s = res[-1]
-            distance = timedelta_dt(prev_s["ts_end"], s["ts_start"])
-            distance_sec = distance.total_seconds()
+            distance_sec = s["ts_start"] - prev_s["ts_end"]
             assert distance_sec >= 0.0
-            merged_dist = timedelta_dt(prev_s["ts_start"], s["ts_end"], )
-            if distance_sec < min_dist and merged_dist.total_seconds() < max_dist:
+            merged_dist = s["ts_end"] - prev_s["ts_start"]
+            if distance_sec < min_dist and merged_dist < max_dist:
                 # merge
                 new_s = copy.deepcopy(prev_s)
                 new_s["ts_end"] = s["ts_end"]
                 new_s["original_phrase"] = prev_s["original_phrase"] + " " + s["original_phrase"]
-                new_delta = timedelta_dt(new_s["ts_start"], new_s["ts_end"])
-                new_s["duration"] = new_delta.total_seconds()
+                new_s["duration"] = round(new_s["ts_end"] - new_s["ts_start"], 3)
                 res[-1] = new_s
             else:
                 res.append(s)
     return res
 
 
-def check_sub_overlap(sub1, sub2):
-    sub1_start, sub1_end = sub1["ts_start"], sub1["ts_end"]
-    sub2_start, sub2_end = sub2["ts_start"], sub2["ts_end"]
-    if sub1_end > sub2_start and sub1_end < sub2_end:
-        return True
-    if sub2_end > sub1_start and sub2_end < sub1_end:
-        return True
-    return False
-
+def find_overlapping_subtitles(subs):
+    """
+    Sweep line over the subtitles sorted by start time keeping the running maximum end time.
+    Returns the indices of all subtitles overlapping another one
 
-def remove_overlapping_subtitles(subs, width=3):
-    bad_indices = set([])
-    for s_idx in range(len(subs)):
+    """
+    order = sorted(range(len(subs)), key=lambda i: (subs[i]["ts_start"], subs[i]["ts_end"]))
+    bad_indices = set()
+    max_end = None
+    for pos, s_idx in enumerate(order):
         s = subs[s_idx]
-        for i in range(-width, width + 1):
-            if s_idx + i >= 0 and s_idx + i < len(subs) and i != 0:
-                candidate_sub = subs[s_idx + i]
-                if check_sub_overlap(candidate_sub, s):
-                    bad_indices.add(s_idx)
-                    bad_indices.add(s_idx + i)
-    if len(bad_indices) > 0:
-        print("bad indices: {}".format(len(bad_indices)))
+        if max_end is not None and s["ts_start"] < max_end:
+            bad_indices.add(s_idx)
+        if pos + 1 < len(order) and subs[order[pos + 1]]["ts_start"] < s["ts_end"]:
+            bad_indices.add(s_idx)
+        max_end = s["ts_end"] if max_end is None else max(max_end, s["ts_end"])
+    return bad_indices
+
+
+def remove_overlapping_subtitles(subs, width=None):
+    """
+    Removes the subtitles overlapping another one. With width set, a subtitle is only compared with
+    its width neighbours in start order on each side, see crawler.captions.overlap_mask
+
+    """
+    if width is None:
+        bad_indices = find_overlapping_subtitles(subs)
+    else:
+        import numpy as np
+        from crawler.captions import overlap_mask
+        bad = overlap_mask(np.array([s["ts_start"] for s in subs], dtype=float),
+                           np.array([s["ts_end"] for s in subs], dtype=float), width=width)
+        bad_indices = set(np.flatnonzero(bad).tolist())
     return [s for s_idx, s in enumerate(subs) if s_idx not in bad_indices]
 
 
@@ -158,7 +209,7 @@ def filter_too_close_subtitles(subtitles, min_threshold=1.5):
     for i, s in enumerate(subtitles):
         if i > 0:
             prev_s = subtitles[i - 1]
-            distance = get_ts_seconds(s["ts_start"]) - get_ts_seconds(prev_s["ts_end"])
+            distance = s["ts_start"] - prev_s["ts_end"]
             if distance > min_threshold:
                 res.append(s)
         else:
@@ -166,72 +217,12 @@ def filter_too_close_subtitles(subtitles, min_threshold=1.5):
     return res
 
 
-def int_to_en(num):
-    d = {0: 'zero', 1: 'one', 2: 'two', 3: 'three', 4: 'four', 5: 'five',
-         6: 'six', 7: 'seven', 8: 'eight', 9: 'nine', 10: 'ten',
-         11: 'eleven', 12: 'twelve', 13: 'thirteen', 14: 'fourteen',
-         15: 'fifteen', 16: 'sixteen', 17: 'seventeen', 18: 'eighteen',
-         19: 'nineteen', 20: 'twenty',
-         30: 'thirty', 40: 'forty', 50: 'fifty', 60: 'sixty',
-         70: 'seventy', 80: 'eighty', 90: 'ninety'}
-    k = 1000
-    m = k * 1000
-    b = m * 1000
-    t = b * 1000
+def normalize_subtitle(input_str, lang="en"):
+    return get_normalizer(lang).normalize(input_str)
 
-    assert (0 <= num)
 
-    if (num < 20):
-        return d[num]
-
-    if (num < 100):
-        if num % 10 == 0:
-            return d[num]
-        else:
-            return d[num // 10 * 10] + ' ' + d[num % 10]
-    if (num < k):
-        if num % 100 == 0:
-            return d[num // 100] + ' hundred'
-        else:
-            return d[num // 100] + ' hundred and ' + int_to_en(num % 100)
-
-
-def normalize_numbers(input_str):
-    input_str = input_str.replace('%', " percent ")
-    numbers = re.findall(r'\s([\d]+)\s', input_str)
-    for number in numbers:
-        if len(number) <= 3:
-            number_str = int_to_en(int(number))
-            input_str = input_str.replace(number, number_str)
-
-    return input_str
-
-
-def normalize_subtitle(input_str):
-    input_str = ' ' + input_str + ' '
-    input_str = input_str.replace(',', ' ').replace('.', ' ')
-    input_str = re.sub(r"([a-z])\-([a-z])", r"\1\2", input_str, 0, re.IGNORECASE)
-    input_str = input_str.replace("- ", " ")
-    input_str = input_str.replace("— ", " ")
-    input_str = input_str.replace('’', '\'').replace('‘', '\'').replace('ʻ', '\'').replace('´', '\'').replace("&nbsp;",
-                                                                                                              ' ')
-    # substitute speaker info
-    input_str = re.sub('<[^<]+?>', ' ', input_str)
-    input_str = re.sub(r"[A-Z]\w+\:", " ", input_str)
-    input_str = re.sub(r'\[.*\]', ' ', input_str)
-    input_str = re.sub(r'\(.*\)', ' ', input_str)
-    input_str = re.sub(r'\*.*\*', ' ', input_str)
-    input_str = unicodedata.normalize('NFKD', input_str)
-
-    input_str = normalize_numbers(input_str)
-    return input_str.strip()
-
-
-def leave_alphanum_characters(input_string):
-    input_string = re.sub(leave_chars, ' ', input_string.lower())
-    input_string = re.sub('\s+', ' ', input_string)
-    input_string = input_string.upper()
-    return input_string.strip()
+def leave_alphanum_characters(input_string, lang="en"):
+    return get_normalizer(lang).leave_alphanum(input_string)
 
 
 def if_contain_bad_symbols(phrase):
@@ -241,7 +232,9 @@ def if_contain_bad_symbols(phrase):
     return False
 
 
-def parse_subtitle(subtitle_file, max_duration=15, min_duration=3, min_threshold=1.5, min_transcript_len=3):
+def parse_subtitle(subtitle_file, max_duration=15, min_duration=3, min_threshold=1.5, min_transcript_len=3,
+                   lang="en"):
+    regexp = caption_regexp(lang)
     all_subtitles = load_all_subtitles(subtitle_file)
     print("{} overall subtitles".format(len(all_subtitles)))
     all_subtitles = remove_overlapping_subtitles(all_subtitles)
@@ -249,12 +242,12 @@ def parse_subtitle(subtitle_file, max_duration=15, min_duration=3, min_threshold
     # filter bad
     all_subtitles = [s for s in all_subtitles if not if_contain_bad_symbols(s["original_phrase"])]
     for s in all_subtitles:
-        s["phrase"] = normalize_subtitle(s["original_phrase"])
-    not_cool = [s for s in all_subtitles if not re.match(everything_cool, s["phrase"])]
-    all_subtitles = [s for s in all_subtitles if re.match(everything_cool, s["phrase"])
+        s["phrase"] = normalize_subtitle(s["original_phrase"], lang)
+    not_cool = [s for s in all_subtitles if not re.match(regexp, s["phrase"])]
+    all_subtitles = [s for s in all_subtitles if re.match(regexp, s["phrase"])
                      and len(s["phrase"].strip()) >= min_transcript_len]
     for s in all_subtitles:
-        s["phrase"] = leave_alphanum_characters(s["phrase"])
+        s["phrase"] = leave_alphanum_characters(s["phrase"], lang)
     print("{} after filtering".format(len(all_subtitles)))
 
     all_subtitles = merge_subtitles(all_subtitles, min_dist=1.0, max_dist=max_duration)
@@ -270,7 +263,7 @@ def parse_subtitle(subtitle_file, max_duration=15, min_duration=3, min_threshold
 
     for idx in range(len(all_subtitles)):
         s = all_subtitles[idx]
-        s["hash"] = get_hash(subtitle_file + s["phrase"] + str(s["ts_start"]))
+        s["hash"] = segment_hash(subtitle_file, s["phrase"], s["ts_start"])
     return all_subtitles
 
 
@@ -300,29 +293,31 @@ def get_closest_captions(src_caption, lst_dest_captions):
     return res
 
 
-def _get_transcript_google_web_asr(t):
-    import tempfile
-    try:
-        with tempfile.NamedTemporaryFile(suffix=".wav") as f:
-            extract_audio_part_segment(t["video_file"], t["ts_start"], t["ts_end"], f.name)
-
-            r = sr.Recognizer()
-            with sr.AudioFile(f.name) as source:
-                audio = r.record(source)
-
-                return r.recognize_google(audio)
-    except Exception as e:
-        print(e)
-        return None
-
+def google_speech_test(timings, threshold=0.65, samples=2, min_duration=2.5, asr=None):
+    """
+    Cross checks a random subset of the parsed subtitles with speech recognition
 
-def google_speech_test(timings, threshold=0.65, samples=2, min_duration=2.5):
+    :param asr: crawler.asr.AsrClient, Google web speech API without cache if None
+    """
+    import numpy as np
+    from Levenshtein import ratio
+    from crawler.asr import AsrClient
+    from crawler.utils import DecodedAudio
     timings = [t for t in timings if t["duration"] > min_duration]
     if len(timings) < samples:
         return False
     subset = random.sample(timings, samples)
 
-    transcripts = [(s, _get_transcript_google_web_asr(s)) for s in subset]
+    asr = asr or AsrClient()
+    audio = {}
+    segments = []
+    for s in subset:
+        if s["video_file"] not in audio:
+            audio[s["video_file"]] = DecodedAudio(s["video_file"])
+        a = audio[s["video_file"]]
+        segments.append((s["hash"], a.segment(s["ts_start"], s["ts_end"]), a.sample_rate))
+    recognized = asr.transcribe_many(segments)
+    transcripts = [(t, recognized.get(t["hash"])) for t in subset]
     transcripts = [(t, s) for (t, s) in transcripts if s is not None]
 
     if len(transcripts) == 0:
@@ -0,0 +1,68 @@
+import json
+import random
+import numpy as np
+import pytest
+import crawler.utils
+
+WORDS = ["quick", "brown", "fox", "jumps", "over", "lazy", "dog", "again", "today", "here"]
+
+
+def write_video(tmp_path, num_captions=8):
+    """
+    Subtitles of num_captions captions of 4 seconds, 2 seconds apart, with the info file and an
+    empty audio file, the audio is served by fake_decode_audio
+
+    """
+    cues = ["WEBVTT", ""]
+    for i in range(num_captions):
+        start = i * 6
+        cues += ["00:00:{:02d}.000 --> 00:00:{:02d}.000".format(start, start + 4),
+                 " ".join(WORDS[(i + j) % len(WORDS)] for j in range(5)), ""]
+    video_file = tmp_path / "video.m4a"
+    video_file.write_bytes(b"")
+    (tmp_path / "video.en.vtt").write_text("\n".join(cues), encoding="utf-8")
+    (tmp_path / "video.info.json").write_text(json.dumps({"id": "abc123", "channel_id": "channel"}))
+    return str(video_file)
+
+
+CAPTION_TEXTS = ["quick brown fox", "lazy dog", "♪ music ♪", "jumps over", "JOHN: hello there", "[laughs] okay",
+                 "I have 5 apples", "café au lait", "hi", "what #hashtag", "co-op meeting", "it is 100% sure"]
+
+
+def vtt_ts(seconds):
+    msec = int(round(seconds * 1000))
+    return "{:02d}:{:02d}:{:02d}.{:03d}".format(msec // 3600000, msec // 60000 % 60, msec // 1000 % 60, msec % 1000)
+
+
+def write_subtitles(tmp_path, num_captions=300, seed=0):
+    """
+    Captions of random length and random gaps, some of them overlapping the previous one, with texts
+    rejected or changed by the different caption filters
+
+    """
+    rng = random.Random(seed)
+    cues = ["WEBVTT", ""]
+    start = 0.0
+    for i in range(num_captions):
+        start = round(start + rng.uniform(-0.5, 2.5), 3)
+        end = round(start + rng.uniform(0.5, 5.0), 3)
+        cues += ["{} --> {}".format(vtt_ts(start), vtt_ts(end)), "{} {}".format(rng.choice(CAPTION_TEXTS), i), ""]
+        start = end
+    subtitle_file = tmp_path / "video.en.vtt"
+    subtitle_file.write_text("\n".join(cues), encoding="utf-8")
+    return str(subtitle_file)
+
+
+def fake_decode_audio(movie_file, sample_rate=16000):
+    return (np.random.RandomState(0).randn(sample_rate * 60) * 3000).astype(np.int16)
+
+
+@pytest.fixture
+def video_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(crawler.utils, "decode_audio", fake_decode_audio)
+    return write_video(tmp_path)
+
+
+@pytest.fixture
+def subtitle_file(tmp_path):
+    return write_subtitles(tmp_path)
@@ -0,0 +1,41 @@
+import io
+import numpy as np
+import pytest
+
+pytest.importorskip("flask")
+from crawler.annotations import AnnotationStore, STATUS
+from crawler.utils import write_wav
+from webdemo import server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    store = AnnotationStore(str(tmp_path / "annotations.sqlite"))
+    monkeypatch.setattr(server, "annotation_store", store)
+    yield server.app.test_client()
+    store.close()
+
+
+def test_annotations_are_recorded_under_the_annotator(client):
+    assert client.post("/annotate", data={"wav": "a.wav", "status": STATUS.OK, "annotator": "alice"}).status_code == 200
+    assert client.post("/annotate", data={"wav": "b.wav", "status": STATUS.NOT_OK, "annotator": " "}).status_code == 200
+    assert client.post("/annotate", data={"wav": "c.wav", "status": "maybe"}).status_code == 400
+    assert client.get("/export/accepted?annotator=alice").data == b"a\n"
+    # without an annotator, the client address is recorded
+    assert client.get("/export/rejected?annotator=127.0.0.1").data == b"b\n"
+
+
+def test_quiet_segments_can_be_annotated(monkeypatch):
+    def wav_bytes(samples):
+        data = io.BytesIO()
+        write_wav(data, samples, 16000)
+        return data.getvalue()
+
+    samples = {"quiet": np.zeros(16000, dtype=np.int16), "silent": np.zeros(16000, dtype=np.int16)}
+    samples["quiet"][::1000] = 1
+    monkeypatch.setattr(server, "load_sample", lambda key, location: {"wav": wav_bytes(samples[key]),
+                                                                      "txt": "a long enough phrase"})
+    server.validate_sample.cache_clear()
+    assert server.validate_sample("quiet", "files")
+    assert not server.validate_sample("silent", "files")
+    server.validate_sample.cache_clear()
@@ -0,0 +1,104 @@
+import time
+import pytest
+import numpy as np
+from crawler.asr import AsrClient, MockRecognizer, TranscriptCache
+
+SAMPLES = np.zeros(1600, dtype=np.int16)
+
+
+def segments(*keys):
+    return [(key, SAMPLES, 16000) for key in keys]
+
+
+def test_transcripts_are_cached(tmp_path):
+    cache_file = str(tmp_path / "transcripts.sqlite")
+    backend = MockRecognizer(transcript=lambda samples, sample_rate: "{} samples".format(len(samples)))
+    client = AsrClient(backend, cache=cache_file)
+    assert client.transcribe_many(segments("a", "b")) == {"a": "1600 samples", "b": "1600 samples"}
+    assert backend.num_requests == 2
+    client.close()
+
+    client = AsrClient(backend, cache=cache_file)
+    assert client.transcribe_many(segments("a", "b", "c")) == {"a": "1600 samples", "b": "1600 samples",
+                                                              "c": "1600 samples"}
+    assert backend.num_requests == 3
+    assert client.stats["cached"] == 2
+    client.close()
+
+
+def test_no_speech_is_cached_failures_are_not(tmp_path):
+    cache = TranscriptCache(str(tmp_path / "transcripts.sqlite"))
+    client = AsrClient(MockRecognizer(transcript=None), cache=cache)
+    assert client.transcribe_many(segments("silent")) == {"silent": None}
+    assert cache.get_many(["silent"], "mock") == {"silent": None}
+
+    client = AsrClient(MockRecognizer(failure_rate=1.0), retries=2, backoff=0.0, cache=cache)
+    assert client.transcribe_many(segments("failed")) == {"failed": None}
+    assert client.stats["requests"] == 3
+    assert client.stats["retries"] == 2
+    assert client.stats["failures"] == 1
+    assert cache.get_many(["failed"], "mock") == {}
+    client.close()
+
+
+def test_retries_until_a_request_succeeds():
+    backend = MockRecognizer(transcript="hello", failure_rate=0.5, seed=1)
+    client = AsrClient(backend, retries=10, backoff=0.0)
+    res = client.transcribe_many(segments(*"abcdefgh"))
+    assert res == {key: "hello" for key in "abcdefgh"}
+    assert client.stats["retries"] > 0
+    assert backend.num_requests == client.stats["requests"] == 8 + client.stats["retries"]
+    client.close()
+
+
+def test_slow_requests_time_out():
+    client = AsrClient(MockRecognizer(transcript="late", latency=0.5), max_workers=1, timeout=0.1)
+    started = time.monotonic()
+    assert client.transcribe_many(segments("a", "b")) == {"a": None, "b": None}
+    assert time.monotonic() - started < 0.4
+    assert client.stats["timeouts"] == 2
+    # the queued request is cancelled, only the running one was sent
+    assert client.backend.num_requests == 1
+    client.close()
+
+
+def test_no_retry_after_the_timeout():
+    backend = MockRecognizer(failure_rate=1.0)
+    client = AsrClient(backend, retries=5, backoff=0.2, timeout=0.1)
+    assert client.transcribe_many(segments("a")) == {"a": None}
+    time.sleep(0.3)
+    assert backend.num_requests == 1
+    client.close()
+
+
+class FakeAudio:
+    sample_rate = 16000
+
+    def segment(self, start_sec, end_sec):
+        return np.zeros(int((end_sec - start_sec) * self.sample_rate), dtype=np.int16)
+
+
+def test_wer_filter_reuses_the_transcript_cache(tmp_path, monkeypatch):
+    pytest.importorskip("Levenshtein")
+    import crawler.asr
+    from crawler.captions import CaptionBatch
+    from crawler.filters import GoogleRandomSubsetWERFilter
+    backends = []
+
+    def recognizer(language):
+        backends.append(MockRecognizer(transcript="hello world"))
+        return backends[-1]
+
+    monkeypatch.setattr(crawler.asr, "GoogleWebRecognizer", recognizer)
+    cache_file = str(tmp_path / "transcripts.sqlite")
+    requested = []
+    for run in range(2):
+        wer_filter = GoogleRandomSubsetWERFilter(num_samples_to_test=3, transcript_cache=cache_file)
+        subtitles = CaptionBatch([i * 5.0 for i in range(20)], [i * 5.0 + 3 for i in range(20)],
+                                 ["hello world {}".format(i) for i in range(20)], sub_file="video.en.vtt")
+        output = wer_filter({"subtitles": subtitles, "audio": FakeAudio(), "video_file": "video.m4a"})
+        assert not output.get("rejected")
+        requested.append(backends[-1].num_requests)
+        wer_filter.asr.close()
+    # the same subset is tested again and answered from the cache
+    assert requested == [3, 0]
@@ -0,0 +1,44 @@
+import numpy as np
+from crawler.captions import CaptionBatch
+from crawler.youtube_helpers import load_all_subtitles, remove_overlapping_subtitles, merge_subtitles, \
+    if_contain_bad_symbols
+
+FIELDS = ["ts_start", "ts_end", "original_phrase", "sub_file", "duration", "idx"]
+
+
+def dict_pipeline(subs, min_dist, max_dist, min_duration, max_duration):
+    subs = remove_overlapping_subtitles(subs)
+    subs = [s for s in subs if not if_contain_bad_symbols(s["original_phrase"])]
+    subs = merge_subtitles(subs, min_dist=min_dist, max_dist=max_dist)
+    return [s for s in subs if min_duration <= s["duration"] <= max_duration]
+
+
+def batch_pipeline(batch, min_dist, max_dist, min_duration, max_duration):
+    batch.remove_overlapping()
+    batch.filter_texts(lambda t: not if_contain_bad_symbols(t))
+    batch = batch.merge(min_dist=min_dist, max_dist=max_dist)
+    return batch.filter((batch.duration >= min_duration) & (batch.duration <= max_duration))
+
+
+def test_from_file_matches_the_dicts(subtitle_file):
+    assert len(CaptionBatch.from_file(subtitle_file)) == 300
+    assert CaptionBatch.from_file(subtitle_file).to_dicts() == load_all_subtitles(subtitle_file)
+
+
+def test_same_captions_as_the_dict_pipeline(subtitle_file):
+    for min_dist, max_dist, min_duration, max_duration in [(1.0, 10.0, 1.0, 20.0), (1.5, 6.0, 3.0, 15.0)]:
+        expected = dict_pipeline(load_all_subtitles(subtitle_file), min_dist, max_dist, min_duration, max_duration)
+        batch = batch_pipeline(CaptionBatch.from_file(subtitle_file), min_dist, max_dist, min_duration, max_duration)
+        assert len(expected) > 10
+        assert [{k: s[k] for k in FIELDS} for s in batch.to_dicts()] == [{k: s[k] for k in FIELDS} for s in expected]
+
+
+def test_overlap_removal_matches_the_dicts():
+    rng = np.random.RandomState(0)
+    start = np.round(rng.uniform(0, 100, 200), 3)
+    end = np.round(start + rng.uniform(0.1, 3, 200), 3)
+    subs = [{"ts_start": s, "ts_end": e, "original_phrase": str(i), "idx": i, "sub_file": None}
+            for i, (s, e) in enumerate(zip(start.tolist(), end.tolist()))]
+    batch = CaptionBatch.from_dicts(subs)
+    batch.remove_overlapping()
+    assert batch.kept_indices().tolist() == [s["idx"] for s in remove_overlapping_subtitles(subs)]
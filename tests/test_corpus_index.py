@@ -0,0 +1,44 @@
+import collections
+import random
+import sqlite3
+import pytest
+from crawler.corpus_index import CorpusIndex
+
+
+def test_random_sample_is_uniform_after_removals(tmp_path):
+    index = CorpusIndex(str(tmp_path))
+    for i in range(100):
+        index.add("segment{}".format(i), 1.0, "video1")
+    index.flush()
+    # a gap of 97 ids before the last segment, which the first row at or after a random id would favour
+    index.remove(["segment{}".format(i) for i in range(2, 99)])
+    random.seed(0)
+    counts = collections.Counter(index.random_sample()[0] for _ in range(3000))
+    assert sorted(counts) == ["segment0", "segment1", "segment99"]
+    assert max(counts.values()) < 1200
+    index.close()
+
+
+def test_random_sample_skips_excluded_segments(tmp_path):
+    index = CorpusIndex(str(tmp_path))
+    for i in range(10):
+        index.add("segment{}".format(i), 1.0, "video1")
+    index.flush()
+    conn = sqlite3.connect(str(tmp_path / "annotations.sqlite"))
+    conn.execute("CREATE TABLE annotations (key TEXT PRIMARY KEY)")
+    conn.executemany("INSERT INTO annotations VALUES (?)", [("segment{}".format(i),) for i in range(9)])
+    conn.commit()
+    conn.close()
+    index.attach(str(tmp_path / "annotations.sqlite"), "annotations")
+    assert {index.random_sample(exclude="annotations.annotations")[0] for _ in range(20)} == {"segment9"}
+    with pytest.raises(ValueError):
+        index.random_sample(exclude="annotations; DROP TABLE segments")
+    index.close()
+
+
+def test_attach_rejects_invalid_names(tmp_path):
+    index = CorpusIndex(str(tmp_path))
+    with pytest.raises(ValueError):
+        index.attach(str(tmp_path / "other.sqlite"), "other; DROP TABLE segments")
+    assert index.random_sample() is None
+    index.close()
@@ -0,0 +1,28 @@
+from crawler.dedup import DedupIndex
+
+PHRASE = "the quick brown fox jumps over the lazy dog again"
+
+
+def test_mirror_on_another_channel_is_a_duplicate(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+    index.add("original", "video1", 10.0, 14.2, PHRASE)
+    # re-uploaded by another channel, at another time of the video
+    assert index.find_duplicate("mirror1", 73.5, 77.7, PHRASE.upper()) == "original"
+    index.close()
+
+
+def test_same_video_and_time_range_is_a_duplicate(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+    index.add("original", "video1", 10.0, 14.2, "thank you")
+    assert index.find_duplicate("video1", 10.0, 14.2, "thanks") == "original"
+    assert index.find_duplicate("video1", 10.0, 14.5, "thanks") is None
+    index.close()
+
+
+def test_short_or_differently_timed_phrases_are_not_duplicates(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite"))
+    index.add("short", "video1", 10.0, 12.0, "thank you very much")
+    index.add("long", "video1", 20.0, 24.2, PHRASE)
+    assert index.find_duplicate("video2", 30.0, 32.0, "thank you very much") is None
+    assert index.find_duplicate("video2", 30.0, 35.0, PHRASE) is None
+    index.close()
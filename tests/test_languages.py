@@ -0,0 +1,50 @@
+import pytest
+from crawler.languages import get_language, get_normalizer, caption_regexp, SUPPORTED
+
+NUMBERS = {
+    "de": {0: "null", 1: "eins", 16: "sechzehn", 21: "einundzwanzig", 30: "dreißig", 99: "neunundneunzig",
+           100: "hundert", 101: "hunderteins", 200: "zweihundert", 342: "dreihundertzweiundvierzig"},
+    "es": {0: "cero", 15: "quince", 16: "dieciséis", 21: "veintiuno", 22: "veintidós", 30: "treinta",
+           31: "treinta y uno", 100: "cien", 101: "ciento uno", 500: "quinientos", 999: "novecientos noventa y nueve"},
+    "fr": {0: "zéro", 17: "dix-sept", 21: "vingt et un", 22: "vingt-deux", 70: "soixante-dix",
+           71: "soixante et onze", 77: "soixante-dix-sept", 80: "quatre-vingts", 81: "quatre-vingt-un",
+           91: "quatre-vingt-onze", 100: "cent", 101: "cent un", 200: "deux cents", 280: "deux cent quatre-vingts"},
+}
+
+
+@pytest.mark.parametrize("code", sorted(NUMBERS))
+def test_number_to_words(code):
+    number_to_words = get_language(code).number_to_words
+    for num, words in NUMBERS[code].items():
+        assert number_to_words(num) == words
+    assert all(number_to_words(num) for num in range(1000))
+
+
+@pytest.mark.parametrize("code, caption, normalized, transcript", [
+    ("de", "Die Straße hat 5 Häuser, 21 Bäume - 100%",
+     "Die Straße hat fünf Häuser  einundzwanzig Bäume  hundert prozent",
+     "DIE STRASSE HAT FÜNF HÄUSER EINUNDZWANZIG BÄUME HUNDERT PROZENT"),
+    ("es", "Señor, tiene 21 años. El 100% niño",
+     "Señor  tiene veintiuno años  El cien por ciento  niño",
+     "SEÑOR TIENE VEINTIUNO AÑOS EL CIEN POR CIENTO NIÑO"),
+    ("fr", "Il a 71 ans, 80 œufs et 200 élèves à 100%",
+     "Il a soixante et onze ans  quatre-vingts œufs et deux cents élèves à cent pour cent",
+     "IL A SOIXANTE ET ONZE ANS QUATRE VINGTS ŒUFS ET DEUX CENTS ÉLÈVES À CENT POUR CENT"),
+])
+def test_normalizers_keep_the_letters_of_the_language(code, caption, normalized, transcript):
+    normalizer = get_normalizer(code)
+    assert normalizer.normalize(caption) == normalized
+    assert normalizer(caption) == transcript
+    assert caption_regexp(code).match(normalized)
+
+
+def test_english_pipeline_drops_accented_captions():
+    normalized = get_normalizer("en").normalize("Il a 5 élèves")
+    assert not caption_regexp("en").match(normalized)
+    assert caption_regexp("fr").match(get_normalizer("fr").normalize("Il a 5 élèves"))
+
+
+def test_unsupported_language():
+    assert "it" not in SUPPORTED
+    with pytest.raises(ValueError):
+        get_normalizer("it")
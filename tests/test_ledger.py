@@ -0,0 +1,79 @@
+import pytest
+from crawler.ledger import JobLedger, STATE
+from crawler.process import process_video, RESULT
+from crawler.writers import FileTreeWriter
+
+
+def test_ledger_keeps_state_after_reopening(tmp_path):
+    filename = str(tmp_path / "jobs.sqlite")
+    ledger = JobLedger(filename)
+    ledger.start("a.m4a")
+    ledger.update("a.m4a", STATE.EXTRACTING, num_segments=3)
+    ledger.add_segments("a.m4a", ["k1", "k2"])
+    ledger.close()
+
+    ledger = JobLedger(filename)
+    assert ledger.state("a.m4a") == STATE.EXTRACTING
+    assert not ledger.is_done("a.m4a")
+    assert ledger.segment_keys("a.m4a") == {"k1", "k2"}
+    ledger.finish("a.m4a", {"num_written": 3, "elapsed_sec": 1.0})
+    assert ledger.is_done("a.m4a")
+    assert ledger.counts() == {STATE.DONE: 1}
+    ledger.close()
+
+
+def test_interrupted_video_resumes_without_rewriting(tmp_path, video_file, monkeypatch):
+    ledger_file = str(tmp_path / "jobs.sqlite")
+    target_dir = str(tmp_path / "out")
+    write = FileTreeWriter.write
+    written = []
+
+    def interrupted_write(self, key, *args):
+        if len(written) == 3:
+            raise KeyboardInterrupt()
+        written.append(key)
+        return write(self, key, *args)
+
+    monkeypatch.setattr(FileTreeWriter, "write", interrupted_write)
+    with pytest.raises(KeyboardInterrupt):
+        process_video(video_file, target_dir, verbose=False, ledger=ledger_file, segments_per_checkpoint=2)
+    ledger = JobLedger(ledger_file)
+    assert ledger.state(video_file) == STATE.EXTRACTING
+    assert ledger.segment_keys(video_file) == set(written)
+    ledger.close()
+
+    monkeypatch.setattr(FileTreeWriter, "write", write)
+    info = process_video(video_file, target_dir, verbose=False, ledger=ledger_file)
+    assert info["result"] == RESULT.OK
+    assert info["num_written"] == 8 - len(written)
+    ledger = JobLedger(ledger_file)
+    assert ledger.is_done(video_file)
+    assert set(written) < ledger.segment_keys(video_file)
+    assert len(ledger.segment_keys(video_file)) == len(written) + info["num_written"]
+    ledger.close()
+
+    info = process_video(video_file, target_dir, verbose=False, ledger=ledger_file)
+    assert info["skipped"]
+
+
+def test_segments_written_without_ledger_are_not_rewritten(tmp_path, video_file, monkeypatch):
+    target_dir = str(tmp_path / "out")
+    info = process_video(video_file, target_dir, verbose=False, ledger=None)
+    assert info["num_written"] == 8
+
+    written = []
+    write = FileTreeWriter.write
+    monkeypatch.setattr(FileTreeWriter, "write", lambda self, key, *args: written.append(key) or write(self, key, *args))
+    info = process_video(video_file, target_dir, verbose=False, ledger=str(tmp_path / "jobs.sqlite"))
+    assert info["num_written"] == 0
+    assert written == []
+
+
+def test_ledger_defaults_to_the_target_dir(tmp_path, video_file, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    target_dir = str(tmp_path / "out")
+    process_video(video_file, target_dir, verbose=False)
+    assert not (tmp_path / "jobs.sqlite").exists()
+    ledger = JobLedger(str(tmp_path / "out" / "jobs.sqlite"))
+    assert ledger.is_done(video_file)
+    ledger.close()
@@ -0,0 +1,77 @@
+import re
+import random
+import unicodedata
+from crawler.normalizer import TextNormalizer, int_to_en
+
+# the caption normalization before TextNormalizer
+leave_chars = re.compile(r"[^a-z\s\']", re.IGNORECASE)
+
+
+def former_normalize_numbers(input_str):
+    input_str = input_str.replace('%', " percent ")
+    numbers = re.findall(r'\s([\d]+)\s', input_str)
+    for number in numbers:
+        if len(number) <= 3:
+            number_str = int_to_en(int(number))
+            input_str = input_str.replace(number, number_str)
+    return input_str
+
+
+def former_normalize_subtitle(input_str):
+    input_str = ' ' + input_str + ' '
+    input_str = input_str.replace(',', ' ').replace('.', ' ')
+    input_str = re.sub(r"([a-z])\-([a-z])", r"\1\2", input_str, 0, re.IGNORECASE)
+    input_str = input_str.replace("- ", " ")
+    input_str = input_str.replace("— ", " ")
+    input_str = input_str.replace('’', '\'').replace('‘', '\'').replace('ʻ', '\'').replace('´', '\'').replace("&nbsp;",
+                                                                                                              ' ')
+    input_str = re.sub('<[^<]+?>', ' ', input_str)
+    input_str = re.sub(r"[A-Z]\w+\:", " ", input_str)
+    input_str = re.sub(r'\[.*\]', ' ', input_str)
+    input_str = re.sub(r'\(.*\)', ' ', input_str)
+    input_str = re.sub(r'\*.*\*', ' ', input_str)
+    input_str = unicodedata.normalize('NFKD', input_str)
+    input_str = former_normalize_numbers(input_str)
+    return input_str.strip()
+
+
+def former_leave_alphanum_characters(input_string):
+    input_string = re.sub(leave_chars, ' ', input_string.lower())
+    input_string = re.sub(r'\s+', ' ', input_string)
+    input_string = input_string.upper()
+    return input_string.strip()
+
+
+TOKENS = ["quick", "Brown", "fox", "co-op", "-", "- ", "—", "— ", "—- ", "’tis", "‘", "ʻ", "´", "&nbsp;", "<i>",
+          "</i>", "<c.colorE5E5E5>", "Kelvin:", "JOHN:", "[music]", "[", "]", "(laughs)", "(", ")", "*sigh*", "*",
+          "café", "naïve", "%", ",", ".", "?", "!", "\"", " ", "  ", "\t", "5", " 12 ", " 300 ", "2019"]
+
+
+def fuzzed_captions(n, with_digits):
+    rng = random.Random(0)
+    tokens = [t for t in TOKENS if with_digits or not any(c.isdigit() for c in t)]
+    for _ in range(n):
+        yield "".join(rng.choice(tokens) + rng.choice(["", " "]) for _ in range(rng.randint(1, 12)))
+
+
+def test_same_output_as_the_former_functions():
+    normalizer = TextNormalizer()
+    for caption in fuzzed_captions(5000, with_digits=False):
+        assert normalizer.normalize(caption) == former_normalize_subtitle(caption), caption
+        assert normalizer.leave_alphanum(caption) == former_leave_alphanum_characters(caption), caption
+        assert normalizer(caption) == former_leave_alphanum_characters(former_normalize_subtitle(caption)), caption
+
+
+def test_single_numbers_as_before():
+    normalizer = TextNormalizer()
+    for caption in ["I have 5 apples", "5 percent", "it is 100% sure", "about 342 people", "in 2019 then"]:
+        assert normalizer.normalize(caption) == former_normalize_subtitle(caption)
+
+
+def test_only_whole_numbers_are_converted():
+    normalizer = TextNormalizer()
+    # formerly "five 2five" and "twenty five 5"
+    assert normalizer.normalize(" 5 25 ") == "five twenty five"
+    assert normalizer.normalize("25 5 ") == "twenty five five"
+    assert normalizer.normalize("room 5b and 1000 people") == "room 5b and 1000 people"
+    assert normalizer("10 12 apples") == "TEN TWELVE APPLES"
@@ -0,0 +1,16 @@
+from crawler.youtube_helpers import remove_overlapping_subtitles
+
+
+def subtitles():
+    # a long caption spanning ten short ones which do not overlap each other
+    return [{"ts_start": 0.0, "ts_end": 100.0}] + [{"ts_start": i * 5 + 1.0, "ts_end": i * 5 + 4.0} for i in range(10)]
+
+
+def test_all_overlaps_are_removed():
+    assert remove_overlapping_subtitles(subtitles()) == []
+    assert remove_overlapping_subtitles(subtitles(), width=20) == []
+
+
+def test_width_limits_the_compared_neighbours():
+    kept = remove_overlapping_subtitles(subtitles(), width=3)
+    assert [s["ts_start"] for s in kept] == [16.0, 21.0, 26.0, 31.0, 36.0, 41.0, 46.0]
@@ -0,0 +1,43 @@
+import json
+import pytest
+from crawler import filters
+from crawler.captions import CaptionBatch
+from crawler.pipeline_config import build_pipelines, build_filter, plan
+
+STAGES = [
+    {"filter": "OverlappingSubtitlesRemover"},
+    {"filter": "CaptionDurationFilter", "min_length": 1.5},
+    {"filter": "SubtitleCaptionTextFilter"},
+    {"filter": "CaptionNormalizer"},
+    {"filter": "CaptionRegexMatcher"},
+    {"filter": "CaptionLengthFilter", "min_length": 5},
+    {"filter": "CaptionLeaveOnlyAlphaNumCharacters"},
+    {"filter": "SubtitleMerger", "max_len_merged_sec": 10},
+    {"filter": "CaptionDurationFilter", "min_length": 1, "max_length": 20.0},
+]
+
+
+def run(pipeline, subtitle_file):
+    return pipeline({"sub_file": subtitle_file, "subtitles": CaptionBatch.from_file(subtitle_file)})
+
+
+def test_consecutive_stateless_filters_are_fused():
+    planned = plan([build_filter(stage) for stage in STAGES])
+    assert [type(c).__name__ for c in planned] == ["OverlappingSubtitlesRemover", "FusedCaptionFilter",
+                                                   "SubtitleMerger", "CaptionDurationFilter"]
+    assert planned[1].name == ("CaptionDurationFilter+SubtitleCaptionTextFilter+CaptionNormalizer+"
+                               "CaptionRegexMatcher+CaptionLengthFilter+CaptionLeaveOnlyAlphaNumCharacters")
+
+
+@pytest.mark.parametrize("config", [None, "stages"])
+def test_fused_pipeline_keeps_the_captions_of_the_unfused_one(subtitle_file, tmp_path, config):
+    if config is not None:
+        config = str(tmp_path / "pipeline.json")
+        with open(config, "w") as f:
+            json.dump({"pipeline": STAGES}, f)
+    fused = run(build_pipelines(config, fuse=True)["pipeline"], subtitle_file)
+    unfused = run(build_pipelines(config, fuse=False)["pipeline"], subtitle_file)
+    assert any(isinstance(c, filters.FusedCaptionFilter) for c in build_pipelines(config)["pipeline"].lst_components)
+    assert len(unfused["subtitles"]) > 10
+    assert fused["subtitles"].to_dicts() == unfused["subtitles"].to_dicts()
+    assert fused["stats"]["overlaps"] == unfused["stats"]["overlaps"]
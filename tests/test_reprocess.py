@@ -0,0 +1,67 @@
+import json
+import numpy as np
+from crawler.dedup import DedupIndex
+from crawler.ledger import JobLedger
+from crawler.languages import get_normalizer
+from crawler.process import process_video
+from crawler.reprocess import reprocess_video
+from crawler.pipeline_config import load_config
+
+
+def short_captions_config(tmp_path):
+    config = load_config()
+    for stage in config["pipeline"]:
+        if stage["filter"] == "CaptionDurationFilter":
+            stage["max_length"] = 3.5
+    filename = str(tmp_path / "short.json")
+    with open(filename, "w") as f:
+        json.dump(config, f)
+    return filename
+
+
+def test_reprocess_updates_the_ledger_and_the_dedup_index(tmp_path, video_file):
+    target_dir, cache_dir = str(tmp_path / "out"), str(tmp_path / "cache")
+    dedup_file = str(tmp_path / "dedup.sqlite")
+    process_video(video_file, target_dir, verbose=False, dedup_index=dedup_file)
+    ledger = JobLedger(str(tmp_path / "out" / "jobs.sqlite"))
+    keys = ledger.segment_keys(video_file)
+    assert len(keys) == 8
+
+    # the captions are 4 seconds long, none is kept
+    info = reprocess_video(video_file, target_dir, cache_dir, pipeline_config=short_captions_config(tmp_path),
+                           dedup_index=dedup_file)
+    assert "error" not in info
+    assert info["num_removed"] == 8
+    assert ledger.segment_keys(video_file) == set()
+    dedup = DedupIndex(dedup_file)
+    assert dedup.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0] == 0
+
+    info = reprocess_video(video_file, target_dir, cache_dir, dedup_index=dedup_file)
+    assert info["num_written"] == 8
+    assert ledger.segment_keys(video_file) == keys
+    assert set(k for k, in dedup.conn.execute("SELECT key FROM segments")) == keys
+    dedup.close()
+    ledger.close()
+
+
+def test_normalized_texts_are_cached(tmp_path, video_file, monkeypatch):
+    target_dir, cache_dir = str(tmp_path / "out"), str(tmp_path / "cache")
+    info = reprocess_video(video_file, target_dir, cache_dir)
+    assert not info["cached"] and info["num_written"] == 8
+    with np.load(str(tmp_path / "cache" / "video.en.npz")) as cache:
+        assert str(cache["normalized_lang"]) == "en"
+        assert cache["normalized"].tolist() == [get_normalizer("en").normalize(t) for t in cache["texts"].tolist()]
+
+    normalizer = get_normalizer("en")
+    normalize = type(normalizer).normalize
+    computed = []
+
+    def counting_normalize(self, text):
+        if self.known is None or text not in self.known:
+            computed.append(text)
+        return normalize(self, text)
+
+    monkeypatch.setattr(type(normalizer), "normalize", counting_normalize)
+    info = reprocess_video(video_file, target_dir, cache_dir, pipeline_config=short_captions_config(tmp_path))
+    assert info["cached"] and info["num_removed"] == 8
+    assert computed == []
@@ -0,0 +1,72 @@
+import os
+from crawler.scheduler import CrawlState, FakeExecutor, Scheduler
+from crawler.spool import Spool
+
+
+class FailingExecutor(FakeExecutor):
+    def download(self, video_id, target_dir, lang="en"):
+        if video_id == "broken":
+            raise IOError("download failed")
+        return super(FailingExecutor, self).download(video_id, target_dir, lang)
+
+
+def test_run_crawls_the_frontier(tmp_path):
+    state = CrawlState(str(tmp_path / "crawl.sqlite"))
+    state.add_queries(["cats", "dogs"], pages=3)
+    state.add_queries(["katzen"], pages=2, lang="de")
+    executor = FakeExecutor({("cats", 1): ["a", "b"], ("cats", 2): ["b", "c"], ("dogs", 1): ["a", "d"],
+                             ("katzen", 1): ["e"], ("katzen", 2): ["f"]})
+    downloaded = []
+    # one job at a time, concurrent searches may already run deeper pages when a page is empty
+    counts = Scheduler(state, executor, str(tmp_path / "downloads"), on_downloaded=downloaded.append,
+                       concurrency=1).run()
+
+    # the pages after an empty one are not searched
+    assert ("dogs", 3) not in executor.searches
+    assert sorted(executor.searches) == [("cats", 1), ("cats", 2), ("cats", 3), ("dogs", 1), ("dogs", 2),
+                                         ("katzen", 1), ("katzen", 2)]
+    assert counts["queries"] == {"done": 7, "exhausted": 1}
+    # every video is downloaded once, in the language of the query finding it
+    assert sorted(executor.downloads) == ["a", "b", "c", "d", "e", "f"]
+    assert counts["downloaded"] == {"en": 4, "de": 2}
+    assert os.path.exists(str(tmp_path / "downloads" / "e.de.vtt"))
+    assert sorted(os.path.basename(f) for f in downloaded) == ["a.m4a", "b.m4a", "c.m4a", "d.m4a", "e.m4a", "f.m4a"]
+    state.close()
+
+
+def test_run_resumes_and_skips_seen_videos(tmp_path):
+    filename = str(tmp_path / "crawl.sqlite")
+    state = CrawlState(filename)
+    state.add_queries(["cats"], pages=2)
+    state.add_videos(["a"], "cats", 1)
+    state.finish_video("a", "a.m4a")
+    # left running by an interrupted crawl
+    assert state.next_query() == ("cats", 1, "en")
+    state.close()
+
+    state = CrawlState(filename)
+    executor = FailingExecutor({("cats", 1): ["a", "b", "broken"]})
+    counts = Scheduler(state, executor, str(tmp_path / "downloads"), concurrency=2).run()
+    assert sorted(executor.searches) == [("cats", 1), ("cats", 2)]
+    assert sorted(executor.downloads) == ["b"]
+    assert counts["videos"] == {"downloaded": 2, "failed": 1}
+
+    state.close()
+
+    state = CrawlState(filename)
+    executor = FakeExecutor({})
+    Scheduler(state, executor, str(tmp_path / "downloads")).run()
+    assert executor.searches == [] and executor.downloads == []
+    state.close()
+
+
+def test_downloads_go_to_the_spool(tmp_path):
+    state = CrawlState(str(tmp_path / "crawl.sqlite"))
+    state.add_queries(["cats"], pages=1)
+    spool = Spool(str(tmp_path / "spool.sqlite"))
+    executor = FakeExecutor({("cats", 1): ["a", "b"]})
+    Scheduler(state, executor, str(tmp_path / "downloads"), on_downloaded=spool.put).run()
+    assert spool.backlog() == 2
+    assert sorted(os.path.basename(spool.claim()) for _ in range(2)) == ["a.m4a", "b.m4a"]
+    spool.close()
+    state.close()
@@ -0,0 +1,64 @@
+import threading
+from crawler.spool import Spool, STATE, iter_spool
+
+
+def test_two_consumers_claim_distinct_videos(tmp_path):
+    filename = str(tmp_path / "spool.sqlite")
+    producer, consumer_a, consumer_b = Spool(filename), Spool(filename), Spool(filename)
+    for i in range(3):
+        producer.put("video{}.m4a".format(i))
+    producer.put("video0.m4a")
+
+    assert consumer_a.claim() == "video0.m4a"
+    assert consumer_b.claim() == "video1.m4a"
+    assert consumer_a.claim() == "video2.m4a"
+    assert consumer_b.claim() is None
+    assert producer.backlog() == 3
+
+    consumer_a.finish("video0.m4a")
+    consumer_b.finish("video1.m4a", failed=True)
+    assert producer.backlog() == 1
+    states = dict(producer.conn.execute("SELECT video_file, state FROM spool").fetchall())
+    assert states == {"video0.m4a": STATE.DONE, "video1.m4a": STATE.FAILED, "video2.m4a": STATE.PROCESSING}
+    for spool in (producer, consumer_a, consumer_b):
+        spool.close()
+
+
+def test_concurrent_claims_are_exclusive(tmp_path):
+    filename = str(tmp_path / "spool.sqlite")
+    producer = Spool(filename)
+    for i in range(200):
+        producer.put("video{}.m4a".format(i))
+    claimed = [[] for _ in range(4)]
+
+    def consume(res):
+        spool = Spool(filename)
+        res.extend(iter_spool(spool, once=True))
+        spool.close()
+
+    threads = [threading.Thread(target=consume, args=(res,)) for res in claimed]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    all_claimed = [video_file for res in claimed for video_file in res]
+    assert len(all_claimed) == 200
+    assert len(set(all_claimed)) == 200
+    producer.close()
+
+
+def test_requeue_stale_claims_of_another_consumer(tmp_path):
+    filename = str(tmp_path / "spool.sqlite")
+    stopped, restarted = Spool(filename), Spool(filename)
+    stopped.put("video0.m4a")
+    stopped.put("video1.m4a")
+    assert stopped.claim() == "video0.m4a"
+    stopped.close()
+
+    assert restarted.requeue_stale(older_than_sec=3600.0) == 0
+    assert restarted.requeue_stale(older_than_sec=-1.0) == 1
+    # the oldest video is claimed first again
+    assert restarted.claim() == "video0.m4a"
+    assert restarted.claim() == "video1.m4a"
+    assert restarted.claim() is None
+    restarted.close()
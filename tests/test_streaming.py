@@ -0,0 +1,46 @@
+import io
+import json
+from crawler.captions import CaptionBatch
+from crawler.pipeline_config import build_pipelines
+from crawler.youtube_helpers import iter_vtt_cues
+
+
+def run_batch(pipelines, subtitle_file):
+    return pipelines["pipeline"]({"sub_file": subtitle_file, "subtitles": CaptionBatch.from_file(subtitle_file)})
+
+
+def run_streaming(pipelines, subtitle_file):
+    with io.open(subtitle_file, encoding="utf-8-sig") as f:
+        return pipelines["streaming_pipeline"]({"sub_file": subtitle_file, "subtitles": iter_vtt_cues(f)})
+
+
+def test_streaming_keeps_the_captions_of_the_batch_pipeline(subtitle_file):
+    for fuse in [True, False]:
+        pipelines = build_pipelines(fuse=fuse)
+        batch = run_batch(pipelines, subtitle_file)
+        streaming = run_streaming(pipelines, subtitle_file)
+        assert len(batch["subtitles"]) > 10
+        assert streaming["subtitles"].to_dicts() == batch["subtitles"].to_dicts()
+        assert streaming["stats"]["overlaps"] == batch["stats"]["overlaps"]
+        assert streaming["stats"]["num_captions_read"] == 300
+        # a CaptionBatch is streamed as well
+        streamed_batch = pipelines["streaming_pipeline"]({"subtitles": CaptionBatch.from_file(subtitle_file)})
+        assert streamed_batch["subtitles"].to_dicts() == batch["subtitles"].to_dicts()
+
+
+def test_streaming_gate_rejects_like_the_batch_pipeline(subtitle_file, tmp_path):
+    config_file = tmp_path / "gate.json"
+    for threshold, rejected in [(10, False), (1000, True)]:
+        config_file.write_text(json.dumps({"pipeline": [
+            {"filter": "OverlappingSubtitlesRemover", "width": 5},
+            {"filter": "SubtitleCaptionTextFilter"},
+            {"filter": "MinNumberSubtitlesFilter", "threshold": threshold},
+            {"filter": "CaptionNormalizer"},
+            {"filter": "SubtitleMerger", "max_len_merged_sec": 10}]}))
+        # the pipelines are cached by file name
+        build_pipelines.cache_clear()
+        pipelines = build_pipelines(str(config_file))
+        batch = run_batch(pipelines, subtitle_file)
+        streaming = run_streaming(pipelines, subtitle_file)
+        assert bool(batch.get("rejected")) == bool(streaming.get("rejected")) == rejected
+        assert streaming["subtitles"].to_dicts() == batch["subtitles"].to_dicts()
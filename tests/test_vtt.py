@@ -0,0 +1,63 @@
+import io
+import pytest
+from crawler.youtube_helpers import iter_vtt_cues, parse_ts, format_ts
+
+webvtt = pytest.importorskip("webvtt")
+
+VTT = """WEBVTT
+Kind: captions
+Language: en
+
+00:00:00.200 --> 00:00:02.200
+Kelvin café
+
+intro
+00:00:03.700 --> 00:00:15.700 align:start position:0%
+lazy <c.colorE5E5E5>Kelvin</c> quick -
+second line
+
+00:00:15.700 --> 00:00:21.700
+co-op 5 lazy <i>hi</i> quick<00:00:17.120><c> quick</c>
+
+01:02:03.040 --> 01:02:05.500
+♪ quick 2019 5 ♪
+
+00:01:29.300 --> 00:01:33.300
+’tis 5 5 naïve
+"""
+
+
+def seconds(ts):
+    # start_in_seconds of webvtt-py drops the milliseconds
+    hours, minutes, secs = ts.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(secs)
+
+
+def baseline_cues(tmp_path, content, newline):
+    vtt_file = tmp_path / "video.en.vtt"
+    with io.open(str(vtt_file), "w", encoding="utf-8", newline=newline) as f:
+        f.write(content)
+    captions = webvtt.read(str(vtt_file)).captions
+    return str(vtt_file), [(seconds(c.start), seconds(c.end), c.text) for c in captions]
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_cues_match_webvtt_py(tmp_path, newline):
+    vtt_file, expected = baseline_cues(tmp_path, VTT, newline)
+    with io.open(vtt_file, encoding="utf-8-sig") as f:
+        cues = list(iter_vtt_cues(f))
+    assert len(cues) == len(expected) == 5
+    for (start, end, text), (expected_start, expected_end, expected_text) in zip(cues, expected):
+        assert start == pytest.approx(expected_start, abs=1e-3)
+        assert end == pytest.approx(expected_end, abs=1e-3)
+        assert text == expected_text
+
+
+def test_last_cue_without_trailing_blank_line():
+    cues = list(iter_vtt_cues(io.StringIO("WEBVTT\n\n00:01.000 --> 00:02.500\nshort timestamps")))
+    assert cues == [(1.0, 2.5, "short timestamps")]
+
+
+@pytest.mark.parametrize("seconds", [0.0, 1.5, 59.999, 3723.04])
+def test_format_ts_round_trip(seconds):
+    assert parse_ts(format_ts(seconds)) == pytest.approx(seconds)
@@ -0,0 +1,60 @@
+import os
+import tarfile
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from crawler.writers import ShardWriter, ShardReader, get_writer
+
+
+def write_segment(writer, key, video_id="abc123"):
+    samples = (np.random.RandomState(0).randn(16000) * 3000).astype(np.int16)
+    writer.write(key, samples, 16000, "hello world", {"sub_file": "video.en.vtt"}, {"id": video_id})
+
+
+def test_reused_prefix_does_not_truncate_shards(tmp_path):
+    target_dir = str(tmp_path)
+    for key in ["first", "second", "third"]:
+        writer = ShardWriter(target_dir, prefix="host-1")
+        write_segment(writer, key)
+        writer.close()
+    # a middle shard is removed, the next process with the same pid adds one after the last shard
+    os.remove(os.path.join(target_dir, "shards", "host-1-000001.tar"))
+    writer = ShardWriter(target_dir, prefix="host-1")
+    write_segment(writer, "fourth")
+    writer.close()
+    assert sorted(os.listdir(os.path.join(target_dir, "shards"))) == [
+        "host-1-000000.idx", "host-1-000000.tar", "host-1-000001.idx",
+        "host-1-000002.idx", "host-1-000002.tar", "host-1-000003.idx", "host-1-000003.tar"]
+    assert sorted(sample["key"] for sample in ShardReader(target_dir)) == ["first", "fourth", "third"]
+
+
+def test_flushed_shard_is_complete_and_appendable(tmp_path):
+    target_dir = str(tmp_path)
+    writer = ShardWriter(target_dir, prefix="host-1")
+    write_segment(writer, "first")
+    writer.flush()
+    shard_file = os.path.join(target_dir, "shards", "host-1-000000.tar")
+    with tarfile.open(shard_file, "r") as tar:
+        assert tar.getnames() == ["videos/abc123.json", "first.wav", "first.txt", "first.json"]
+    write_segment(writer, "second", video_id="def456")
+    writer.flush()
+    assert [sample["key"] for sample in ShardReader(target_dir)] == ["first", "second"]
+    writer.close()
+    assert [sample["key"] for sample in ShardReader(target_dir)] == ["first", "second"]
+
+
+def write_in_worker(target_dir, key):
+    write_segment(get_writer(target_dir, "shards"), key)
+    return os.getpid()
+
+
+def test_pool_worker_closes_its_shard(tmp_path):
+    target_dir = str(tmp_path)
+    context = multiprocessing.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        pool.submit(write_in_worker, target_dir, "first").result()
+    shard_files = [f for f in os.listdir(os.path.join(target_dir, "shards")) if f.endswith(".tar")]
+    assert len(shard_files) == 1
+    # closed: the archive is padded to whole records
+    assert os.path.getsize(os.path.join(target_dir, "shards", shard_files[0])) % tarfile.RECORDSIZE == 0
+    assert [sample["key"] for sample in ShardReader(target_dir)] == ["first"]
@@ -1,99 +1,222 @@
 import os
-from path import Path
-import random
-from flask import Flask, jsonify, render_template
+import io
+import time
+import atexit
+import queue
+import functools
+import threading
+from flask import Flask, Response, jsonify, render_template, abort
 from flask import request
-import shutil
-import json
-from tqdm import tqdm
-from scipy.io.wavfile import read
-import numpy as np
 import json
+from crawler.corpus_index import CorpusIndex, FILES_LOCATION, build_index
+from crawler.writers import ShardReader
+from crawler.manifest import dump_manifest, is_valid
+from crawler.audio_stats import read_wav, audio_stats
+from crawler.annotations import AnnotationStore, ANNOTATIONS_FILENAME, STATUS
 
 app = Flask(__name__)
-MIN_SUM_AMPLITUTDE = 1e-2
-#ANNOTATIONS_FILE = "annotations.json"
+MAX_SAMPLING_ATTEMPTS = 1000
+VALIDATION_CACHE_SIZE = 100000
+SAMPLE_POOL_SIZE = 64
+SAMPLE_POOL_WAIT_SEC = 5.0
+STREAM_CHUNK_SIZE = 64 << 10
+EXPORT_STATUSES = {"accepted": STATUS.OK, "rejected": STATUS.NOT_OK}
 
-def select_random_sample(all_files):
-    while True:
-        data = random.choice(all_files)
-        if not os.path.exists(data["txt"]) or not os.path.exists(data["wav"]):
-            continue
-        phrase = open(data["txt"]).read().strip()
-        if len(phrase) < 10:
-            continue
-        rate, wav_data = read(data["wav"])
-        if len(wav_data) < 16000 // 2 or np.sum(np.abs(wav_data)) < MIN_SUM_AMPLITUTDE:
-            continue
-        break
-    return data
+# sqlite connections are per thread, the index is opened by every request thread on first use
+_local = threading.local()
+sample_pool = None
+annotation_store = None
+
+
+def get_corpus_index():
+    if not hasattr(_local, "corpus_index"):
+        _local.corpus_index = CorpusIndex(corpus_dir)
+        if annotation_store is not None:
+            _local.corpus_index.attach(annotation_store.filename, "annotations")
+    return _local.corpus_index
+
+
+def load_sample(key, location):
+    """
+    Reads wav bytes, text and metadata of an indexed segment from the wav/txt/metadata tree or a shard
+
+    """
+    if location == FILES_LOCATION:
+        with open(os.path.join(corpus_dir, "wav", key[:2], key + ".wav"), "rb") as f:
+            wav = f.read()
+        with io.open(os.path.join(corpus_dir, "txt", key[:2], key + ".txt"), encoding='utf-8') as f:
+            txt = f.read()
+        with io.open(os.path.join(corpus_dir, "metadata", key[:2], key + ".json"), encoding='utf-8') as f:
+            metadata = json.load(f)
+    else:
+        sample = shard_reader.read_sample(key, location)
+        wav, txt, metadata = sample["wav"], sample["txt"], sample["json"]
+        metadata["metadata"] = sample["info"]
+    return {"key": key, "wav": wav, "txt": txt.strip(), "metadata": metadata}
+
+
+def audio_range(key, location):
+    """
+    Returns (file, offset, size) of the wav bytes of a segment, a wav file or a member of a shard
+
+    """
+    if location == FILES_LOCATION:
+        wav_file = os.path.join(corpus_dir, "wav", key[:2], key + ".wav")
+        return wav_file, 0, os.path.getsize(wav_file)
+    return shard_reader.member_range(key, "wav", shard_name=location)
+
+
+@functools.lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def validate_sample(key, location):
+    """
+    Whether the segment can be annotated. Only the verdict is cached, so a segment drawn again is
+    not read again to be rejected, and the metadata is loaded when the sample is rendered
+
+    """
+    try:
+        data = load_sample(key, location)
+    except (OSError, KeyError):
+        # removed since it was indexed
+        return False
+    try:
+        rate, wav_data = read_wav(io.BytesIO(data["wav"]))
+    except (ValueError, EOFError):
+        return False
+    # the checks of the training manifest, quiet segments are kept and only all zero audio is rejected
+    stats = audio_stats(wav_data, rate)
+    stats["phrase_len"] = len(data["txt"])
+    return is_valid(stats, sample_rate=rate)
+
+
+def select_random_sample():
+    """
+    Returns (key, location) of a random segment which can be annotated
 
+    """
+    for _ in range(MAX_SAMPLING_ATTEMPTS):
+        # segments without annotations first
+        row = get_corpus_index().random_sample(exclude="annotations.annotations" if annotation_store is not None else None)
+        if row is None:
+            break
+        key, _, _, location = row
+        if validate_sample(key, location):
+            return key, location
+    raise RuntimeError("No valid sample found in the index of {}, rebuild it with "
+                       "python -m crawler.corpus_index {}".format(corpus_dir, corpus_dir))
+
+
+class SamplePool:
+    """
+    Background thread keeping up to size validated (key, location) pairs ready, so a page load takes
+    them from the pool instead of sampling and validating while the annotator waits
+
+    """
+    def __init__(self, size=SAMPLE_POOL_SIZE):
+        self.samples = queue.Queue(maxsize=size)
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        while True:
+            try:
+                self.samples.put(select_random_sample())
+            except RuntimeError as e:
+                print(e)
+                time.sleep(SAMPLE_POOL_WAIT_SEC)
+
+    def get(self, timeout=SAMPLE_POOL_WAIT_SEC):
+        try:
+            return self.samples.get(timeout=timeout)
+        except queue.Empty:
+            return select_random_sample()
+
+
+def _read_chunks(filename, offset, size):
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        while size > 0:
+            chunk = f.read(min(size, STREAM_CHUNK_SIZE))
+            if not chunk:
+                break
+            size -= len(chunk)
+            yield chunk
+
+
+@app.route("/audio/<key>.wav", methods=['GET'])
+def stream_audio(key):
+    """
+    Streams the wav bytes of a segment from the corpus tree or its shard, with HTTP range support
+    for seeking in the player
+
+    """
+    location = get_corpus_index().location(key)
+    if location is None:
+        abort(404)
+    try:
+        filename, offset, size = audio_range(key, location)
+    except (OSError, KeyError):
+        abort(404)
+    start, stop = 0, size
+    if request.range is not None:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            return Response(status=416, headers={"Content-Range": "bytes */{}".format(size)})
+        start, stop = byte_range
+    response = Response(_read_chunks(filename, offset + start, stop - start), mimetype="audio/wav",
+                        status=206 if request.range is not None else 200, direct_passthrough=True)
+    response.content_length = stop - start
+    response.headers["Accept-Ranges"] = "bytes"
+    if request.range is not None:
+        response.headers["Content-Range"] = "bytes {}-{}/{}".format(start, stop - 1, size)
+    return response
 
 
 @app.route("/annotate", methods=['POST'])
 def annotate():
-    #with open(ANNOTATIONS_FILE, 'a+') as f:
-    #    f.write(json.dumps(data) + "\n")
-    #    f.flush()
+    status = request.form.get("status")
+    if status not in (STATUS.OK, STATUS.NOT_OK):
+        abort(400)
+    key = os.path.splitext(request.form.get("wav", ""))[0]
+    # sent by the page, the address only identifies clients posting without it
+    annotator = request.form.get("annotator", "").strip() or request.remote_addr
+    # queued, written in batches by the writer thread of the store
+    annotation_store.add(key, annotator, status, request.form.get("txt"))
     return jsonify({"result" : "OK"})
 
+@app.route("/export/<name>", methods=['GET'])
+def export_annotations(name):
+    """
+    Keys of the accepted or rejected segments, one per line, optionally of a single annotator
+
+    """
+    if name not in EXPORT_STATUSES:
+        abort(404)
+    annotation_store.flush()
+    keys = annotation_store.keys(EXPORT_STATUSES[name], request.args.get("annotator"))
+    return Response("".join(key + "\n" for key in keys), mimetype="text/plain")
+
 @app.route('/',methods=['GET'])
 def render_random():
-    dataset = [select_random_sample(all_files) for i in range(8)]
     res = []
-    for d_idx, d in enumerate(dataset):
-        wav_file = d['wav']
-        txt = d['txt']
-        metadata_file = d["meta"]
-        with open(metadata_file, "r") as f:
-            metadata = json.loads(f.read())
-        shutil.copy( wav_file, os.path.join("./static", os.path.basename(wav_file)) )
+    for _ in range(MAX_SAMPLING_ATTEMPTS):
+        if len(res) == 8:
+            break
+        key, location = sample_pool.get() if sample_pool is not None else select_random_sample()
+        try:
+            d = load_sample(key, location)
+        except (OSError, KeyError):
+            # removed since it was validated
+            continue
         res.append({
-            "wav" : os.path.basename(wav_file),
-            "txt" : open(txt).read().strip(),
-            "metadata" : metadata,
-            "index" : d_idx
+            "wav" : d['key'] + ".wav",
+            "txt" : d['txt'],
+            "metadata" : d['metadata'],
+            "index" : len(res)
         })
     return render_template('index.html', samples={ "data" : res})
 
-def iterate_corpus(directory):
-    wav_dir = os.path.join(directory, "wav")
-    for f in tqdm(Path(wav_dir).walkfiles("*.wav")):
-        txt_dir = f.dirname().replace("/wav/", "/txt/")
-        txt_file = os.path.join(txt_dir, f.basename().replace(".wav", ".txt"))
-        metadata_dir =  f.dirname().replace("/wav/", "/metadata/")
-        metadata_file = os.path.join(metadata_dir, f.basename().replace(".wav", ".json"))
-        if os.path.exists(txt_file) and os.path.exists(metadata_file):
-            yield {
-                "wav" : str(f),
-                "txt" : txt_file,
-                "meta" : metadata_file
-            }
-
-def find_files(directory):
-    res = []
-    for data in iterate_corpus(directory):
-        res.append(data)
-    return res
-
-def dump_medatadata_corpus(dir, filename):
-    total_length = 0.0
-    with open(filename, "w") as f:
-        for data in iterate_corpus(dir):
-            try:
-                phrase = open(data["txt"]).read().strip()
-                if len(phrase) < 10:
-                    continue
-                rate, wav_data = read(data["wav"])
-                assert rate == 16000, "rate is wrong {}".format(data["wav"])
-                if len(wav_data) < 16000//2 or np.sum(np.abs(wav_data)) < MIN_SUM_AMPLITUTDE:
-                    continue
-                if os.path.exists(data["wav"]) and os.path.exists(data["txt"]):
-                    f.write("{},{}\n".format(data["wav"], data["txt"]))
-                    total_length += len(wav_data) / rate
-            except:
-                print("Exception", data["wav"])
-                continue
+def dump_medatadata_corpus(dir, filename, processes=None):
+    total_length = dump_manifest(dir, filename, processes=processes)
     print("total duration: {:.2f}h".format(total_length / 60 / 60))
 
 if __name__ == "__main__":
@@ -103,15 +226,25 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=8888)
     parser.add_argument('--dump', dest='dump', action='store_true', help='Dump manifest file')
     parser.add_argument('--dump-file', default=None)
+    parser.add_argument('--dump-processes', type=int, default=None, help='Processes computing the audio statistics')
+    parser.add_argument('--annotations', default=None,
+                        help='Annotation database, <corpus>/{} by default'.format(ANNOTATIONS_FILENAME))
+    parser.add_argument('--pool-size', type=int, default=SAMPLE_POOL_SIZE, help='Validated samples kept ready')
     parser.set_defaults(dump=False)
 
     opt = parser.parse_args()
     assert os.path.exists(opt.corpus), "Cannot find corpus directory"
     if opt.dump:
         print("dumping file")
-        dump_medatadata_corpus(opt.corpus, opt.dump_file)
+        dump_medatadata_corpus(opt.corpus, opt.dump_file, processes=opt.dump_processes)
 
-    all_files = find_files(opt.corpus)
-    print("Total files", len(all_files))
+    corpus_dir = opt.corpus
+    shard_reader = ShardReader(corpus_dir)
+    annotation_store = AnnotationStore(opt.annotations or os.path.join(corpus_dir, ANNOTATIONS_FILENAME))
+    atexit.register(annotation_store.close)
+    if get_corpus_index().random_sample() is None:
+        print("Building the corpus index")
+        build_index(corpus_dir)
+    sample_pool = SamplePool(opt.pool_size)
     app.run(host='0.0.0.0',
             port=opt.port, debug=True, use_reloader=False, )